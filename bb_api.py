@@ -1,105 +1,241 @@
 import os
-import requests
-import pandas as pd
+import re
+import asyncio
+import logging
+from dataclasses import dataclass
+import numpy as np
 from dotenv import load_dotenv
+import http_client
+
+logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 # Trusted seller criteria from .env
 TRUSTED_MIN_ORDERS = int(os.getenv("TRUSTED_MIN_ORDERS", "1000"))
 TRUSTED_MIN_SUCCESS = float(os.getenv("TRUSTED_MIN_SUCCESS", "95"))
+# RUB amounts shown in "Avg prices by amount", comma separated
+BYBIT_TARGET_AMOUNTS = [int(amount) for amount in os.getenv("BYBIT_TARGET_AMOUNTS", "10000,30000,60000,100000").split(",")]
+
+BYBIT_URL = "https://api2.bybit.com/fiat/otc/item/online"
+BYBIT_HEADERS = {
+    "Content-Type": "application/json",
+    "Origin": "https://www.bybit.com",
+    "Referer": "https://www.bybit.com/",
+    "User-Agent": "Mozilla/5.0"
+}
+
+# The only ad fields we use. Inside JSON strings quotes are escaped, so this
+# can`t match text in remarks; nested objects don`t use these keys.
+AD_FIELDS = ('price', 'minAmount', 'maxAmount', 'orderNum', 'finishNum')
+_AD_FIELD_RE = re.compile(rb'"(price|minAmount|maxAmount|orderNum|finishNum)"\s*:\s*"?(-?[0-9.eE+]+)')
+
+
+@dataclass
+class BybitAds:
+    price: np.ndarray
+    min_amount: np.ndarray
+    max_amount: np.ndarray
+    order_num: np.ndarray
+    finish_num: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.price)
+
+
+class BybitAdsScanner:
+    """Extracts the numeric ad fields from a streamed Bybit response without
+    building the JSON document, so remarks and nested objects are never decoded"""
+
+    def __init__(self) -> None:
+        self._values: dict[bytes, list[bytes]] = {field.encode(): [] for field in AD_FIELDS}
+        self._tail = b''
+
+    def _scan(self, buffer: bytes, end: int) -> None:
+        for field, value in _AD_FIELD_RE.findall(buffer, 0, end):
+            self._values[field].append(value)
+
+    def feed(self, chunk: bytes) -> None:
+        buffer = self._tail + chunk
+        # A field match never contains a comma, so none can straddle the last one
+        end = buffer.rfind(b',') + 1
+        self._scan(buffer, end)
+        self._tail = buffer[end:]
+
+    def result(self) -> BybitAds:
+        self._scan(self._tail, len(self._tail))
+        self._tail = b''
+        counts = {len(values) for values in self._values.values()}
+        if len(counts) != 1:
+            raise ValueError(f"Ad fields are not aligned: {[len(v) for v in self._values.values()]}")
+        arrays = [np.array(self._values[field.encode()], dtype=bytes).astype(np.float64)
+                  for field in AD_FIELDS]
+        return BybitAds(*arrays)
+
+
+class AmountPriceIndex:
+    """Average price of the ads whose [minAmount, maxAmount] range covers a RUB amount.
+
+    Ad limits are kept as two sorted endpoint arrays with prefix sums of prices:
+    the ads covering an amount are those already started (min <= amount) minus
+    those already ended (max < amount), so any amount is two binary searches."""
+
+    def __init__(self, starts: np.ndarray, start_sums: np.ndarray,
+                 ends: np.ndarray, end_sums: np.ndarray) -> None:
+        self.starts = starts
+        self.start_sums = start_sums
+        self.ends = ends
+        self.end_sums = end_sums
+
+    @classmethod
+    def build(cls, price: np.ndarray, min_amount: np.ndarray, max_amount: np.ndarray) -> 'AmountPriceIndex':
+        # Ads with min > max can`t cover any amount and would break the subtraction
+        valid = min_amount <= max_amount
+        price, min_amount, max_amount = price[valid], min_amount[valid], max_amount[valid]
+        by_start, by_end = np.argsort(min_amount), np.argsort(max_amount)
+        return cls(min_amount[by_start], np.concatenate(([0.0], np.cumsum(price[by_start]))),
+                   max_amount[by_end], np.concatenate(([0.0], np.cumsum(price[by_end]))))
+
+    def average_prices(self, amounts) -> np.ndarray:
+        """Vectorized lookup, NaN where no ad covers the amount"""
+        amounts = np.asarray(amounts, dtype=np.float64)
+        started = np.searchsorted(self.starts, amounts, side='right')
+        ended = np.searchsorted(self.ends, amounts, side='left')
+        counts = started - ended
+        with np.errstate(divide='ignore', invalid='ignore'):
+            averages = (self.start_sums[started] - self.end_sums[ended]) / counts
+        averages[counts == 0] = np.nan
+        return averages
+
+    def average_price(self, amount: float) -> float | None:
+        average = self.average_prices([amount])[0]
+        return None if np.isnan(average) else float(average)
+
+    def to_dict(self) -> dict:
+        return {"starts": self.starts.tolist(), "start_sums": self.start_sums.tolist(),
+                "ends": self.ends.tolist(), "end_sums": self.end_sums.tolist()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'AmountPriceIndex':
+        return cls(*[np.array(data[name], dtype=np.float64)
+                     for name in ("starts", "start_sums", "ends", "end_sums")])
+
 
-def fetch_bybit_p2p_stats(side="buy"):
-    url = "https://api2.bybit.com/fiat/otc/item/online"
-    side_code = "1" if side == "buy" else "0"
+def _ads_from_items(items: list[dict]) -> BybitAds:
+    """Fallback for responses the scanner can`t align"""
+    return BybitAds(*[np.array([item[field] for item in items], dtype=np.float64)
+                      for field in AD_FIELDS])
 
+
+def _nan_if_empty(func, values: np.ndarray) -> float:
+    return func(values) if values.size else np.nan
+
+
+async def _fetch_ads(side: str) -> BybitAds:
     payload = {
         "tokenId": "USDT",
         "currencyId": "RUB",
-        "side": side_code,
+        "side": "1" if side == "buy" else "0",
         "size": "10000"
     }
-    headers = {
-        "Content-Type": "application/json",
-        "Origin": "https://www.bybit.com",
-        "Referer": "https://www.bybit.com/",
-        "User-Agent": "Mozilla/5.0"
-    }
 
+    scanner = BybitAdsScanner()
+    async for chunk in http_client.stream_post(BYBIT_URL, payload, BYBIT_HEADERS):
+        scanner.feed(chunk)
     try:
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        ads = response.json().get("result", {}).get("items", [])
-        df = pd.DataFrame(ads)
-
-        df['price'] = df['price'].astype(float)
-        df['minAmount'] = df['minAmount'].astype(float)
-        df['maxAmount'] = df['maxAmount'].astype(float)
-        df['orderNum'] = df['orderNum'].astype(float)
-        df['finishNum'] = df['finishNum'].astype(float)
-        df['successRate'] = (df['finishNum'] / df['orderNum']) * 100
-        df['successRate'] = df['successRate'].fillna(0)
-
-        # General stats
-        stats = {
-            "price_min": df['price'].min(),
-            "price_max": df['price'].max(),
-            "price_mean": df['price'].mean(),
-            "price_median": df['price'].median(),
-            "min_amount_mean": df['minAmount'].mean(),
-            "min_amount_median": df['minAmount'].median(),
-            "max_amount_mean": df['maxAmount'].mean(),
-            "max_amount_median": df['maxAmount'].median(),
-            "mean_success_rate": df['successRate'].mean(),
-            "side": side,
-            "good_sellers": {
-                "count_100_trades": int((df['orderNum'] >= 100).sum()),
-                "count_95_percent_success": int((df['successRate'] >= 95).sum())
-            }
-        }
+        return scanner.result()
+    except ValueError as e:
+        logger.warning("Couldn`t scan Bybit ads stream, falling back to full JSON parsing: %s", e)
+        response = await http_client.post_json(BYBIT_URL, payload, BYBIT_HEADERS)
+        return _ads_from_items(response.get("result", {}).get("items", []))
 
-        # Trusted sellers
-        trusted = df[(df['orderNum'] >= TRUSTED_MIN_ORDERS) & (df['successRate'] >= TRUSTED_MIN_SUCCESS)]
-
-        target_amounts = [10000, 30000, 60000, 100000]
-        avg_prices_by_amount = {}
-        for amount in target_amounts:
-            eligible = trusted[(trusted['minAmount'] <= amount) & (trusted['maxAmount'] >= amount)]
-            avg_price = eligible['price'].mean() if not eligible.empty else None
-            avg_prices_by_amount[amount] = avg_price
-
-        stats["trusted"] = {
-            "count": len(trusted),
-            "price_mean": trusted['price'].mean(),
-            "price_median": trusted['price'].median(),
-            "success_mean": trusted['successRate'].mean(),
-            "min_avg": trusted['minAmount'].mean(),
-            "max_avg": trusted['maxAmount'].mean(),
-            "avg_prices_by_amount": avg_prices_by_amount
-        }
 
-        # Top 15 by price with min 400+ orders and 90% success
-        # Filter first, then take best 15 prices
-        filtered_top = df[(df['finishNum'] > 400) & (df['successRate'] >= 90)]
-        top15_filtered = filtered_top.sort_values(by='price').head(50)
+def calculate_bybit_stats(ads: BybitAds, side: str = "buy") -> dict:
+    price, min_amount, max_amount = ads.price, ads.min_amount, ads.max_amount
+    order_num, finish_num = ads.order_num, ads.finish_num
 
+    with np.errstate(divide='ignore', invalid='ignore'):
+        success_rate = finish_num / order_num * 100
+    success_rate[np.isnan(success_rate)] = 0
 
-        stats["top15_filtered"] = {
-            "count": len(top15_filtered),
-            "price_min": top15_filtered['price'].min(),
-            "price_max": top15_filtered['price'].max(),
-            "min_min_amount": top15_filtered['minAmount'].min(),
-            "max_max_amount": top15_filtered['maxAmount'].max(),
-            "avg_min_amount": top15_filtered['minAmount'].mean(),
-            "avg_max_amount": top15_filtered['maxAmount'].mean(),
+    # General stats
+    stats = {
+        "price_min": price.min(),
+        "price_max": price.max(),
+        "price_mean": price.mean(),
+        "price_median": np.median(price),
+        "min_amount_mean": min_amount.mean(),
+        "min_amount_median": np.median(min_amount),
+        "max_amount_mean": max_amount.mean(),
+        "max_amount_median": np.median(max_amount),
+        "mean_success_rate": success_rate.mean(),
+        "side": side,
+        "good_sellers": {
+            "count_100_trades": int((order_num >= 100).sum()),
+            "count_95_percent_success": int((success_rate >= 95).sum())
         }
+    }
+
+    # Trusted sellers
+    trusted = (order_num >= TRUSTED_MIN_ORDERS) & (success_rate >= TRUSTED_MIN_SUCCESS)
+    trusted_price = price[trusted]
+    trusted_min, trusted_max = min_amount[trusted], max_amount[trusted]
+
+    amount_index = AmountPriceIndex.build(trusted_price, trusted_min, trusted_max)
+    avg_prices_by_amount = {amount: (None if np.isnan(average) else float(average))
+                            for amount, average in zip(BYBIT_TARGET_AMOUNTS,
+                                                       amount_index.average_prices(BYBIT_TARGET_AMOUNTS))}
+
+    stats["trusted"] = {
+        "count": int(trusted.sum()),
+        "price_mean": _nan_if_empty(np.mean, trusted_price),
+        "price_median": _nan_if_empty(np.median, trusted_price),
+        "success_mean": _nan_if_empty(np.mean, success_rate[trusted]),
+        "min_avg": _nan_if_empty(np.mean, trusted_min),
+        "max_avg": _nan_if_empty(np.mean, trusted_max),
+        "avg_prices_by_amount": avg_prices_by_amount,
+        "amount_index": amount_index.to_dict()
+    }
 
-        return stats
+    # Top 15 by price with min 400+ orders and 90% success
+    # Filter first, then take best 15 prices
+    filtered_top = np.flatnonzero((finish_num > 400) & (success_rate >= 90))
+    top15_filtered = filtered_top[np.argsort(price[filtered_top], kind='stable')[:50]]
+    top_price, top_min, top_max = price[top15_filtered], min_amount[top15_filtered], max_amount[top15_filtered]
+
+    stats["top15_filtered"] = {
+        "count": len(top15_filtered),
+        "price_min": _nan_if_empty(np.min, top_price),
+        "price_max": _nan_if_empty(np.max, top_price),
+        "min_min_amount": _nan_if_empty(np.min, top_min),
+        "max_max_amount": _nan_if_empty(np.max, top_max),
+        "avg_min_amount": _nan_if_empty(np.mean, top_min),
+        "avg_max_amount": _nan_if_empty(np.mean, top_max),
+    }
+
+    return stats
+
+
+async def fetch_bybit_p2p_stats(side="buy"):
+    try:
+        ads = await _fetch_ads(side)
+        if not len(ads):
+            logger.error("Couldn`t find ads in Bybit response for %s side", side)
+            return None
+        return calculate_bybit_stats(ads, side)
 
     except Exception as e:
-        print("❌ Error fetching data:", e)
+        logger.error("Couldn`t fetch Bybit P2P stats: %s", e)
         return None
 
+
+def average_price_for_amount(stats: dict | None, amount: float) -> float | None:
+    """Average trusted sellers price for any RUB amount, None if nobody covers it"""
+    if not stats:
+        return None
+    return AmountPriceIndex.from_dict(stats["trusted"]["amount_index"]).average_price(amount)
+
+
 def build_telegram_message(stats: dict, lang: str = "en") -> str:
     if not stats:
         return "❌ Failed to fetch market stats." if lang == "en" else "❌ Не удалось получить данные с рынка."
@@ -180,7 +316,7 @@ def build_telegram_message(stats: dict, lang: str = "en") -> str:
 
 # Example usage
 if __name__ == "__main__":
-    stats = fetch_bybit_p2p_stats(side="buy")  # or "sell"
+    stats = asyncio.run(fetch_bybit_p2p_stats(side="buy"))  # or "sell"
     print(build_telegram_message(stats, lang="ru"))
     print("\n" + "-"*80 + "\n")
     print(build_telegram_message(stats, lang="en"))
@@ -0,0 +1,75 @@
+""" Compares Bybit P2P ads ingestion: full JSON + DataFrame vs streaming field scanner.
+
+The response is rebuilt from the 1.csv dump of real ads, repeated up to the
+requested number of ads.
+
+Usage: python -m benchmarks.bench_bybit_ingestion [num_of_ads] """
+import ast
+import json
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+from bb_api import BybitAdsScanner
+
+CHUNK_SIZE = 64 * 1024
+NESTED_COLUMNS = ('payments', 'symbolInfo', 'tradingPreferenceSet', 'authTag', 'verificationOrderLabels')
+STRING_COLUMNS = ('price', 'premium', 'lastQuantity', 'quantity', 'frozenQuantity',
+                  'executedQuantity', 'minAmount', 'maxAmount', 'id', 'accountId', 'userId')
+
+
+def make_bybit_response(num_of_ads: int, csv_path: str = '1.csv') -> bytes:
+    dump = pd.read_csv(csv_path, index_col=0)
+    items = []
+    for record in dump.to_dict(orient='records'):
+        for column in NESTED_COLUMNS:
+            if isinstance(record.get(column), str):
+                record[column] = ast.literal_eval(record[column])
+        for column in STRING_COLUMNS:
+            record[column] = str(record[column])
+        items.append({k: (None if isinstance(v, float) and pd.isna(v) else v) for k, v in record.items()})
+
+    items = (items * (num_of_ads // len(items) + 1))[:num_of_ads]
+    return json.dumps({"retCode": 0, "retMsg": "SUCCESS",
+                       "result": {"count": len(items), "items": items}}, ensure_ascii=False).encode()
+
+
+def ingest_dataframe(body: bytes) -> pd.DataFrame:
+    df = pd.DataFrame(json.loads(body).get("result", {}).get("items", []))
+    for column in ('price', 'minAmount', 'maxAmount', 'orderNum', 'finishNum'):
+        df[column] = df[column].astype(float)
+    return df
+
+
+def ingest_scanner(body: bytes):
+    scanner = BybitAdsScanner()
+    for start in range(0, len(body), CHUNK_SIZE):
+        scanner.feed(body[start:start + CHUNK_SIZE])
+    return scanner.result()
+
+
+def _measure(func, body: bytes) -> tuple[float, float]:
+    started = time.perf_counter()
+    func(body)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    func(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def main() -> None:
+    num_of_ads = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    body = make_bybit_response(num_of_ads)
+    print(f"{num_of_ads} ads, response {len(body) / 1024 / 1024:.1f} MB")
+    print(f"{'ingestion':<10} {'ms':>8} {'peak MB':>8}")
+    for name, func in (('dataframe', ingest_dataframe), ('scanner', ingest_scanner)):
+        elapsed, peak = _measure(func, body)
+        print(f"{name:<10} {elapsed * 1000:>8.1f} {peak:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+""" Compares quote table serializers on the Redis cache path.
+
+Usage: python -m benchmarks.bench_quotes_serializer [num_of_banks] """
+import sys
+import timeit
+
+from quotes_serializer import SERIALIZERS
+from tests.helpers import make_quotes_df
+
+
+def main() -> None:
+    num_of_banks = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    df = make_quotes_df(num_of_banks)
+    print(f"Quote table: {num_of_banks} banks")
+    print(f"{'serializer':<10} {'size, B':>8} {'dumps, µs':>10} {'loads, µs':>10}")
+
+    for name, serializer in SERIALIZERS.items():
+        data = serializer.dumps(df)
+        runs, dumps_total = timeit.Timer(lambda: serializer.dumps(df)).autorange()
+        dumps_us = dumps_total / runs * 1e6
+        runs, loads_total = timeit.Timer(lambda: serializer.loads(data)).autorange()
+        loads_us = loads_total / runs * 1e6
+        print(f"{name:<10} {len(data):>8} {dumps_us:>10.1f} {loads_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
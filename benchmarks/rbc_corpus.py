@@ -0,0 +1,116 @@
+""" Offline corpus of cash.rbc.ru pages and parser benchmark.
+
+Record every city/currency/side page (needs network):
+    python -m benchmarks.rbc_corpus record [corpus_dir]
+
+Benchmark the parser on the recorded pages (no network):
+    python -m benchmarks.rbc_corpus bench [corpus_dir] [--engine lxml|bs4]
+
+bench reports latency, throughput and peak allocations per stage and exits
+with code 1 if a page yields no quotes or the engines disagree, which
+usually means cash.rbc.ru changed its layout. """
+import argparse
+import asyncio
+import os
+import sys
+import time
+import timeit
+import tracemalloc
+
+from bot_logic import base_url, div_container
+from http_client import close_http_client
+from models import CityCode, CurrencyCode
+import rbc_parser
+
+DEFAULT_CORPUS_DIR = os.path.join('tests', 'fixtures', 'rbc')
+
+
+async def record(corpus_dir: str) -> None:
+    rbc_parser.RBC_RECORD_DIR = corpus_dir
+    rbc_parser.RBC_REPLAY_DIR = None
+    urls = [base_url.format(currency_code=currency.value, city_code=city.value, operation_code=side)
+            for city in CityCode for currency in CurrencyCode for side in ('buy', 'sell')]
+    try:
+        results = await asyncio.gather(*[rbc_parser.fetch_page(url) for url in urls], return_exceptions=True)
+    finally:
+        await close_http_client()
+    for url, result in zip(urls, results):
+        status = f"error: {result}" if isinstance(result, Exception) else f"{len(result) / 1024:.0f} KB"
+        print(f"{rbc_parser.page_file_name(url):<22} {status}")
+
+
+def _measure(func, *args) -> tuple[float, float]:
+    """ Returns (seconds per call, peak KB allocated by one call) """
+    runs, total = timeit.Timer(lambda: func(*args)).autorange()
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return total / runs, peak / 1024
+
+
+def bench(corpus_dir: str, engine: str) -> int:
+    pages = sorted(f for f in os.listdir(corpus_dir) if f.endswith('.html'))
+    if not pages:
+        print(f"No pages in {corpus_dir}, record them first")
+        return 1
+
+    parse = rbc_parser.PARSER_ENGINES[engine]
+    failed = False
+    total_time = total_rows = 0
+
+    print(f"engine: {engine}")
+    print(f"{'page':<22} {'KB':>5} {'rows':>5} {'parse ms':>9} {'peak KB':>8} "
+          f"{'prepare ms':>11} {'times ms':>9}")
+    for page in pages:
+        html = rbc_parser._read_from_file(os.path.join(corpus_dir, page))
+        currency = page.split('_')[1]
+
+        try:
+            data = parse(html, div_container, currency)
+            banks, quotes, times = rbc_parser.extract_office_rows(html, div_container)
+        except Exception as e:
+            print(f"{page:<22} parse failed: {e}")
+            failed = True
+            continue
+
+        parse_s, parse_peak = _measure(parse, html, div_container, currency)
+        prepare_s, _ = _measure(rbc_parser._prepare_parsed_data, banks, quotes, times, currency)
+        times_s, _ = _measure(rbc_parser.time_str_to_datetime, times)
+        total_time += parse_s
+        total_rows += len(data.quotes)
+
+        print(f"{page:<22} {len(html) / 1024:>5.0f} {len(data.quotes):>5} {parse_s * 1000:>9.2f} "
+              f"{parse_peak:>8.0f} {prepare_s * 1000:>11.3f} {times_s * 1000:>9.3f}")
+
+        if not data.quotes:
+            print(f"  {page}: no quotes found, layout changed?")
+            failed = True
+        other = [name for name in rbc_parser.PARSER_ENGINES if name != engine]
+        for name in other:
+            if rbc_parser.PARSER_ENGINES[name](html, div_container, currency) != data:
+                print(f"  {page}: {engine} and {name} results differ")
+                failed = True
+
+    if total_time:
+        print(f"throughput: {len(pages) / total_time:.0f} pages/s, {total_rows / total_time:.0f} rows/s")
+    return 1 if failed else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['record', 'bench'])
+    parser.add_argument('corpus_dir', nargs='?', default=DEFAULT_CORPUS_DIR)
+    parser.add_argument('--engine', choices=list(rbc_parser.PARSER_ENGINES), default=rbc_parser.RBC_PARSER_ENGINE)
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        started = time.perf_counter()
+        asyncio.run(record(args.corpus_dir))
+        print(f"recorded in {time.perf_counter() - started:.1f} s")
+    else:
+        sys.exit(bench(args.corpus_dir, args.engine))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,24 @@
+import numpy as np
 import pandas as pd
-import copy
+import asyncio
 import redis_client
 import json
 from rbc_parser import parse_quotes
 import os
+import time
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-from io import StringIO
 import logging
-from models import CurrencyStatistics, QuotesData, CurrencyCode, CityCode
+from models import CurrencyStatistics, QuotesData, CurrencyCode, CityCode, QUOTES_COLUMNS
+from quotes_serializer import dumps_quotes, loads_quotes
+from singleflight import SINGLE_FLIGHT
+from leader_election import SCRAPER_LEADER
+from quotes_history import QUOTES_HISTORY
+from rate_alerts import ALERTS
+from local_cache import LocalCache
+from db_manager import load_quotes_rollups_db
+from data_formatter import render_quotes_message, render_statistics_message, render_history_message
+from bb_api import fetch_bybit_p2p_stats, build_telegram_message
 from typing import Union
 
 
@@ -19,8 +30,50 @@ div_container = "quote__office__content js-office-content"
 # Load .env variables
 load_dotenv()
 
+# Soft TTL: after it cached data is still served, but refreshed in background
 TTL_QUOTES_IN_REDIS = int(os.getenv("TTL_QUOTES_IN_REDIS", 600))
 TTL_STATS_IN_REDIS = int(os.getenv("TTL_STATS_IN_REDIS", 600))
+# Hard TTL: how long stale data is kept in Redis when refreshes fail
+HARD_TTL_QUOTES_IN_REDIS = int(os.getenv("HARD_TTL_QUOTES_IN_REDIS", 3600))
+HARD_TTL_STATS_IN_REDIS = int(os.getenv("HARD_TTL_STATS_IN_REDIS", 3600))
+TTL_BYBIT_IN_REDIS = int(os.getenv("TTL_BYBIT_IN_REDIS", 600))
+HARD_TTL_BYBIT_IN_REDIS = int(os.getenv("HARD_TTL_BYBIT_IN_REDIS", 3600))
+# History replies are re-rendered after every quotes history flush
+HARD_TTL_HISTORY_IN_REDIS = int(os.getenv("HARD_TTL_HISTORY_IN_REDIS", 3600))
+
+# In-process cache in front of Redis. Entries younger than LOCAL_CACHE_TTL are
+# served without Redis, older ones are revalidated by the key version stamp.
+LOCAL_CACHE_TTL = float(os.getenv("LOCAL_CACHE_TTL", 5))
+LOCAL_CACHE_MAX_ITEMS = int(os.getenv("LOCAL_CACHE_MAX_ITEMS", 64))
+LOCAL_CACHE = LocalCache(LOCAL_CACHE_MAX_ITEMS, LOCAL_CACHE_TTL)
+
+# Replies are pre-rendered on every refresh for these languages
+RENDERED_LANGS = ('en', 'ru')
+BYBIT_SIDES = ('buy', 'sell')
+NUM_OF_RETURNED_BANKS = int(os.getenv("NUM_OF_RETURNED_BANKS", 5))
+# How far back the history reply looks for every rollup granularity
+HISTORY_WINDOWS = {'10min': timedelta(hours=3), 'hour': timedelta(hours=24), 'day': timedelta(days=7)}
+
+CACHE_STATS: dict[str, dict[str, int]] = {
+    'local': {'hits': 0, 'misses': 0},
+    'redis': {'hits': 0, 'misses': 0},
+}
+
+# Keep references to background revalidations so they are not garbage collected
+_background_refreshes: set[asyncio.Task] = set()
+
+# How often a refresh found the data unchanged and only confirmed the cache
+REFRESH_STATS = {'quotes_changed': 0, 'quotes_unchanged': 0,
+                 'statistics_changed': 0, 'statistics_unchanged': 0}
+# Last parse results, merged table and rendered replies of every quotes key,
+# parse results are compared by identity
+_last_quotes: dict[str, tuple[QuotesData, QuotesData, pd.DataFrame, dict[str, str] | None]] = {}
+# Last rendered statistics replies of every city
+_last_statistics_rendered: dict[str, dict[str, str]] = {}
+# When the leader last confirmed an unchanged entry. The rendered replies
+# get the new time, the bigger data entries keep the time of the last change,
+# so stale readers check this before revalidating.
+_verified_at: dict[str, float] = {}
 
 
 def _get_data_frame(data: QuotesData) -> pd.DataFrame:
@@ -49,17 +102,86 @@ def _merge_df(df_buy: pd.DataFrame, df_sell: pd.DataFrame) -> pd.DataFrame:
     # Sort merged df
     merged = merged.sort_values(by='buy_quote')
 
-    return merged[["currency", "bank", "buy_quote", "sell_quote", "spread",
-                  "spread_percent", "avg_price",  "time", "commissions"]]
+    return merged[QUOTES_COLUMNS]
+
+
+def _version_key(redis_json_name: str) -> str:
+    return f"{redis_json_name}:version"
+
+
+async def _set_with_version(redis_json_name: str, data: str | bytes, ttl: int,
+                            client=None) -> str:
+    """Store data and bump the version stamp other workers compare against"""
+    pipe = (client or redis_client.REDIS_CLIENT).pipeline()
+    pipe.set(redis_json_name, data, ex=ttl)
+    pipe.incr(_version_key(redis_json_name))
+    pipe.expire(_version_key(redis_json_name), ttl)
+    _, version, _ = await pipe.execute()
+    return str(version)
+
+
+async def _read_through_local_cache(redis_json_name: str, read_from_redis):
+    """Check the in-process cache first and fall back to Redis"""
+    entry = LOCAL_CACHE.get(redis_json_name)
+    if entry is not None:
+        value, version, is_fresh = entry
+        if is_fresh:
+            CACHE_STATS['local']['hits'] += 1
+            return value
+        # Entry is old, reuse it if nobody wrote the key meanwhile
+        if await redis_client.REDIS_CLIENT.get(_version_key(redis_json_name)) == version:
+            LOCAL_CACHE.touch(redis_json_name)
+            CACHE_STATS['local']['hits'] += 1
+            return value
+
+    CACHE_STATS['local']['misses'] += 1
+    # Version is read before the value, so a concurrent write can only make
+    # the stored stamp older than the value, which just causes a reload
+    version = await redis_client.REDIS_CLIENT.get(_version_key(redis_json_name))
+    value = await read_from_redis(redis_json_name)
+    if value is None:
+        CACHE_STATS['redis']['misses'] += 1
+        LOCAL_CACHE.invalidate(redis_json_name)
+        return None
+
+    CACHE_STATS['redis']['hits'] += 1
+    LOCAL_CACHE.set(redis_json_name, value, version)
+    return value
+
+
+async def _extend_ttl(redis_json_names: list[str], ttl: int) -> bool:
+    """Keep unchanged entries and their version stamps alive without
+    rewriting them. False if one of them is gone and has to be written."""
+    if redis_client.REDIS_CLIENT is None:
+        return True
+    try:
+        pipe = redis_client.REDIS_CLIENT.pipeline()
+        for redis_json_name in redis_json_names:
+            pipe.expire(redis_json_name, ttl)
+            pipe.expire(_version_key(redis_json_name), ttl)
+        results = await pipe.execute()
+    except Exception as e:
+        logger.error("Couldn`t extend TTL in Redis: %s", e)
+        return False
+    return all(results[::2])
+
+
+def get_refresh_stats() -> dict[str, int]:
+    return dict(REFRESH_STATS)
+
+
+def get_cache_stats() -> dict[str, dict[str, int]]:
+    stats = {tier: dict(counters) for tier, counters in CACHE_STATS.items()}
+    stats['local']['size'] = len(LOCAL_CACHE)
+    return stats
 
 
-def get_quotes_df_from_redis_cache(redis_json_name: str) -> pd.DataFrame | None:
+async def get_quotes_df_from_redis_cache(redis_json_name: str) -> pd.DataFrame | None:
+    """Return cached quotes, time of the scrape is in df.attrs['fetched_at']"""
     try:
-        data = redis_client.REDIS_CLIENT.get(redis_json_name)
+        data = await redis_client.REDIS_BINARY_CLIENT.get(redis_json_name)
         if data is not None:
-            df_merged = pd.read_json(StringIO(data))
-            df_merged['time'] = pd.to_datetime(df_merged['time']).dt.tz_localize('Europe/Moscow')
-            return df_merged
+            return loads_quotes(data)
         else:
             return None
     except Exception as e:
@@ -67,8 +189,9 @@ def get_quotes_df_from_redis_cache(redis_json_name: str) -> pd.DataFrame | None:
         return None
 
 
-def get_statistics_df_from_redis_cache(redis_json_name: str) -> pd.DataFrame | None:
-    data = redis_client.REDIS_CLIENT.get(redis_json_name)
+async def get_statistics_df_from_redis_cache(redis_json_name: str) -> dict | None:
+    """Return cached {'fetched_at': ..., 'data': statistics} or None"""
+    data = await redis_client.REDIS_CLIENT.get(redis_json_name)
     if data is not None:
         prepared_response = json.loads(data)
         return prepared_response
@@ -76,26 +199,241 @@ def get_statistics_df_from_redis_cache(redis_json_name: str) -> pd.DataFrame | N
         return None
 
 
-def set_quotes_to_redis_cache(redis_json_name: str, df_merged: pd.DataFrame) -> None:
+async def set_quotes_to_redis_cache(redis_json_name: str, df_merged: pd.DataFrame) -> None:
     try:
-        redis_client.REDIS_CLIENT.set(redis_json_name,
-                                      df_merged.to_json(orient='records'), 
-                                      ex=TTL_QUOTES_IN_REDIS
-                                      )
+        df_merged.attrs.setdefault('fetched_at', time.time())
+        version = await _set_with_version(redis_json_name, dumps_quotes(df_merged),
+                                          HARD_TTL_QUOTES_IN_REDIS, redis_client.REDIS_BINARY_CLIENT)
+        LOCAL_CACHE.set(redis_json_name, df_merged, version)
     except Exception as e:
+        LOCAL_CACHE.invalidate(redis_json_name)
         logger.error("Data where not save in Redis: %s", e)
 
 
-def set_statistics_to_redis_cache(redis_json_name, df_merged):
+async def set_statistics_to_redis_cache(redis_json_name: str,
+                                        statistics: dict[str, CurrencyStatistics],
+                                        fetched_at: float | None = None) -> None:
     try:
-        redis_client.REDIS_CLIENT.setex(redis_json_name,
-                                        TTL_STATS_IN_REDIS,
-                                        json.dumps(df_merged)
-                                        )
+        cached = {'fetched_at': fetched_at or time.time(), 'data': statistics}
+        version = await _set_with_version(redis_json_name, json.dumps(cached), HARD_TTL_STATS_IN_REDIS)
+        LOCAL_CACHE.set(redis_json_name, cached, version)
     except Exception as e:
+        LOCAL_CACHE.invalidate(redis_json_name)
         logger.error("Data where not saved in Redis: %s", e)
 
 
+def _rendered_quotes_key(city: str, currency: str, lang: str,
+                         num_of_banks: int = NUM_OF_RETURNED_BANKS) -> str:
+    return f"rendered:{city.lower()}:{currency.lower()}:{lang}:{num_of_banks}"
+
+
+def _rendered_statistics_key(city: str, lang: str) -> str:
+    return f"rendered:statistics:{city.lower()}:{lang}"
+
+
+def _rendered_bybit_key(side: str, lang: str) -> str:
+    return f"rendered:bybit:{side}:{lang}"
+
+
+def _rendered_history_key(city: str, currency: str, lang: str) -> str:
+    return f"rendered:history:{city.lower()}:{currency.lower()}:{lang}"
+
+
+async def _get_rendered_from_redis_cache(redis_json_name: str) -> dict | None:
+    data = await redis_client.REDIS_CLIENT.get(redis_json_name)
+    return json.loads(data) if data is not None else None
+
+
+async def _set_rendered_to_redis_cache(redis_json_name: str, text: str, fetched_at: float, ttl: int) -> None:
+    cached = {'fetched_at': fetched_at, 'text': text}
+    version = await _set_with_version(redis_json_name, json.dumps(cached), ttl)
+    LOCAL_CACHE.set(redis_json_name, cached, version)
+
+
+async def render_quotes_messages(city: str, currency: str, df_merged: pd.DataFrame) -> dict[str, str] | None:
+    """Build the quotes reply once per refresh for every language.
+    Returns the saved texts by their keys, None if they were not saved."""
+    rendered = {}
+    try:
+        for lang in RENDERED_LANGS:
+            text = render_quotes_message(df_merged.head(NUM_OF_RETURNED_BANKS), city, currency, lang)
+            rendered[_rendered_quotes_key(city, currency, lang)] = text
+            await _set_rendered_to_redis_cache(_rendered_quotes_key(city, currency, lang), text,
+                                               df_merged.attrs['fetched_at'], HARD_TTL_QUOTES_IN_REDIS)
+    except Exception as e:
+        logger.error("Couldn`t save rendered quotes in Redis: %s", e)
+        return None
+    return rendered
+
+
+async def render_statistics_messages(city: str, statistics: dict[str, CurrencyStatistics],
+                                     fetched_at: float) -> dict[str, str] | None:
+    rendered = {}
+    try:
+        for lang in RENDERED_LANGS:
+            text = render_statistics_message(statistics, lang)
+            rendered[_rendered_statistics_key(city, lang)] = text
+            await _set_rendered_to_redis_cache(_rendered_statistics_key(city, lang), text,
+                                               fetched_at, HARD_TTL_STATS_IN_REDIS)
+    except Exception as e:
+        logger.error("Couldn`t save rendered statistics in Redis: %s", e)
+        return None
+    return rendered
+
+
+async def _confirm_rendered(rendered: dict[str, str], fetched_at: float, ttl: int) -> bool:
+    """Store the same reply texts with the time they were confirmed, so the
+    age shown under them is the time of the last check on every instance"""
+    try:
+        for redis_json_name, text in rendered.items():
+            await _set_rendered_to_redis_cache(redis_json_name, text, fetched_at, ttl)
+    except Exception as e:
+        logger.error("Couldn`t confirm rendered messages in Redis: %s", e)
+        return False
+    return True
+
+
+async def render_bybit_messages(side: str, stats: dict, fetched_at: float) -> None:
+    try:
+        for lang in RENDERED_LANGS:
+            await _set_rendered_to_redis_cache(_rendered_bybit_key(side, lang),
+                                               build_telegram_message(stats, lang),
+                                               fetched_at, HARD_TTL_BYBIT_IN_REDIS)
+    except Exception as e:
+        logger.error("Couldn`t save rendered Bybit stats in Redis: %s", e)
+
+
+async def _load_history_rollups(city: str, currency: str) -> dict[str, list[dict]] | None:
+    now = datetime.now(timezone.utc)
+    since = {granularity: now - window for granularity, window in HISTORY_WINDOWS.items()}
+    return await asyncio.to_thread(load_quotes_rollups_db, city, currency, since)
+
+
+async def _render_history(city: str, currency: str) -> dict[str, dict] | None:
+    """Render the history reply for every language from the rollups and cache it"""
+    rollups = await _load_history_rollups(city, currency)
+    if rollups is None:
+        return None
+    fetched_at = time.time()
+    rendered = {lang: {'fetched_at': fetched_at, 'text': render_history_message(rollups, city, currency, lang)}
+                for lang in RENDERED_LANGS}
+    if redis_client.REDIS_AVAILABLE:
+        try:
+            for lang, cached in rendered.items():
+                await _set_rendered_to_redis_cache(_rendered_history_key(city, currency, lang), cached['text'],
+                                                   fetched_at, HARD_TTL_HISTORY_IN_REDIS)
+        except Exception as e:
+            logger.error("Couldn`t save rendered history in Redis: %s", e)
+    return rendered
+
+
+async def render_history_messages(pairs: set[tuple[str, str]]) -> None:
+    """Called by QUOTES_HISTORY after the rollups of these (city, currency) pairs changed"""
+    for city, currency in pairs:
+        await _render_history(city, currency)
+
+
+async def _get_rendered(redis_json_name: str) -> dict | None:
+    if not redis_client.REDIS_AVAILABLE:
+        return None
+    try:
+        return await _read_through_local_cache(redis_json_name, _get_rendered_from_redis_cache)
+    except Exception as e:
+        logger.error("Couldn`t get rendered message from Redis: %s", e)
+        return None
+
+
+async def get_rendered_quotes_message(currency: str, city: str, lang: str) -> dict | None:
+    """Return {'fetched_at': ..., 'text': ...} of the quotes reply or None"""
+    rendered = await _get_rendered(_rendered_quotes_key(city, currency, lang))
+    if rendered is not None and _is_stale(rendered['fetched_at'], TTL_QUOTES_IN_REDIS):
+        revalidate_quotes(currency, city)
+    return rendered
+
+
+async def get_rendered_statistics_message(city: str, currencies_list: list[str], lang: str) -> dict | None:
+    """Return {'fetched_at': ..., 'text': ...} of the statistics reply or None"""
+    rendered = await _get_rendered(_rendered_statistics_key(city, lang))
+    if rendered is not None and _is_stale(rendered['fetched_at'], TTL_STATS_IN_REDIS):
+        revalidate_statistics(city, currencies_list)
+    return rendered
+
+
+async def get_rendered_bybit_message(side: str, lang: str) -> dict | None:
+    """Return {'fetched_at': ..., 'text': ...} of the USDT reply or None"""
+    rendered = await _get_rendered(_rendered_bybit_key(side, lang))
+    if rendered is not None and _is_stale(rendered['fetched_at'], TTL_BYBIT_IN_REDIS):
+        revalidate_bybit_stats(side)
+    return rendered
+
+
+async def get_history_message(city: str, currency: str, lang: str) -> dict | None:
+    """Return {'fetched_at': ..., 'text': ...} of the history reply. It is
+    rendered after every history flush, on a miss only a few rollup
+    buckets are read, never the raw history."""
+    rendered = await _get_rendered(_rendered_history_key(city, currency, lang))
+    if rendered is not None:
+        return rendered
+    rendered = await _render_history(city, currency)
+    return rendered.get(lang) if rendered is not None else None
+
+
+def _is_stale(fetched_at: float, soft_ttl: int) -> bool:
+    return time.time() - fetched_at > soft_ttl
+
+
+def _revalidate_in_background(key: str, refresh, read_cached, soft_ttl: int) -> None:
+    """Start a refresh without waiting for it. SINGLE_FLIGHT makes sure
+    many stale readers still cause only one scrape. Followers leave it to
+    the leader`s refresher."""
+    if not SCRAPER_LEADER.is_leader:
+        return
+    # Old fetched_at of an entry that was found unchanged recently
+    if not _is_stale(_verified_at.get(key, 0), soft_ttl):
+        return
+
+    async def _run():
+        try:
+            await SINGLE_FLIGHT.do(key, refresh, read_cached)
+        except Exception as e:
+            logger.error("Background refresh of %s failed, serving stale data: %s", key, e)
+
+    task = asyncio.create_task(_run())
+    _background_refreshes.add(task)
+    task.add_done_callback(_background_refreshes.discard)
+
+
+async def _refresh_quotes_and_statistics(currency: str, city: str) -> pd.DataFrame:
+    df_merged = await refresh_quotes_df(currency, city)
+    # Only this currency changed, the other ones come from the running aggregates
+    await refresh_statistics(city)
+    return df_merged
+
+
+def revalidate_quotes(currency: str, city: str) -> None:
+    redis_json_name = _quotes_redis_key(city, currency)
+    _revalidate_in_background(redis_json_name,
+                              lambda: _refresh_quotes_and_statistics(currency, city),
+                              lambda: get_quotes_df_from_redis_cache(redis_json_name),
+                              TTL_QUOTES_IN_REDIS)
+
+
+def revalidate_statistics(city: str, currencies_list: list[str]) -> None:
+    redis_json_name = _statistics_redis_key(city)
+    _revalidate_in_background(redis_json_name,
+                              lambda: _refresh_statistics_from_quotes(city, currencies_list),
+                              lambda: _read_statistics_data(redis_json_name),
+                              TTL_STATS_IN_REDIS)
+
+
+def revalidate_bybit_stats(side: str) -> None:
+    redis_json_name = _bybit_redis_key(side)
+    _revalidate_in_background(redis_json_name,
+                              lambda: refresh_bybit_stats(side),
+                              lambda: _read_bybit_stats_data(redis_json_name),
+                              TTL_BYBIT_IN_REDIS)
+
+
 def get_currency_code(currency: Union[str, CurrencyCode]) -> int:
     if isinstance(currency, str):
         return CurrencyCode[currency.upper()].value
@@ -108,32 +446,11 @@ def get_city_code(city: Union[str, CityCode]) -> int:
     return city.value
 
 
-def get_quotes_df(currency: str,
-                  city: str = 'Moscow',
-                  num_of_returned_banks: int = 5,
-                  return_all_banks: bool = False
-                  ) -> pd.DataFrame:
-
-    redis_json_name = f'{city.lower()}:{currency.lower()}'
-    cached_quotes = None
-
-    if redis_client.REDIS_AVAILABLE:
-        try:
-            cached_quotes = get_quotes_df_from_redis_cache(redis_json_name)
-        except Exception as e:
-            cached_quotes = None
-            logger.error("Couldn`t retrive quotes from Redis: %s", e)
-
-    if cached_quotes is not None:
-        return cached_quotes if return_all_banks else cached_quotes.head(num_of_returned_banks)
-
+async def refresh_quotes_df(currency: str, city: str = 'Moscow') -> pd.DataFrame:
+    """Scrape buy/sell pages for the pair and store the merged table in Redis"""
     currency_code = get_currency_code(currency)
     city_code = get_city_code(city)
 
-    df_buy = None
-    df_sell = None
-    df_merged = None
-
     buy_url = base_url.format(currency_code=currency_code,
                               city_code=city_code,
                               operation_code='buy')
@@ -142,100 +459,380 @@ def get_quotes_df(currency: str,
                                city_code=city_code,
                                operation_code='sell')
 
-    df_buy = _get_data_frame(parse_quotes(buy_url, div_container, currency))
-    df_sell = _get_data_frame(parse_quotes(sell_url, div_container, currency))
+    # Buy and sell pages are fetched concurrently
+    data_buy, data_sell = await asyncio.gather(parse_quotes(buy_url, div_container, currency),
+                                               parse_quotes(sell_url, div_container, currency))
+
+    redis_json_name = _quotes_redis_key(city, currency)
+    # parse_quotes returns the very same objects for pages that did not change
+    last = _last_quotes.get(redis_json_name)
+    if last is not None and last[0] is data_buy and last[1] is data_sell:
+        if await _confirm_unchanged_quotes(city, redis_json_name, last[2], last[3]):
+            return last[2]
+
+    df_buy = _get_data_frame(data_buy)
+    df_sell = _get_data_frame(data_sell)
 
     df_merged = _merge_df(df_buy, df_sell)
+    df_merged.attrs['fetched_at'] = time.time()
+    # Saved to Postgres later by a background task
+    QUOTES_HISTORY.record(city, df_merged)
+    ALERTS.check(city, df_merged)
+    _update_statistics_aggregates(city, df_merged)
 
+    rendered = None
     if redis_client.REDIS_CLIENT is not None:
         try:
-            set_quotes_to_redis_cache(redis_json_name, df_merged)
+            await set_quotes_to_redis_cache(redis_json_name, df_merged)
         except Exception as e:
             logger.error("Couldn`t save quotes from Redis: %s", e)
+        rendered = await render_quotes_messages(city, currency, df_merged)
 
-    return df_merged if return_all_banks else df_merged.head(num_of_returned_banks)
+    _last_quotes[redis_json_name] = (data_buy, data_sell, df_merged, rendered)
+    _verified_at.pop(redis_json_name, None)
+    REFRESH_STATS['quotes_changed'] += 1
+    return df_merged
 
 
-def _get_several_currencies_in_city(city: str, 
-                                    currencies_list: list[str]
-                                    ) -> pd.DataFrame:
-    merged_df = pd.DataFrame()
-    for currency in currencies_list:
-        df = get_quotes_df(currency, city, return_all_banks=True)
-        if df is not None and not df.empty:  # ✅ if the result is valid
-            merged_df = pd.concat([merged_df, df], ignore_index=True)
-    return merged_df
+async def _confirm_unchanged_quotes(city: str, redis_json_name: str, df_merged: pd.DataFrame,
+                                    rendered: dict[str, str] | None) -> bool:
+    """Nothing to merge, serialize or render: the quotes are still valid now.
+    False if the cache has to be written anew."""
+    now = time.time()
+    if redis_client.REDIS_CLIENT is not None:
+        if rendered is None or not await _extend_ttl([redis_json_name], HARD_TTL_QUOTES_IN_REDIS):
+            return False
+        if not await _confirm_rendered(rendered, now, HARD_TTL_QUOTES_IN_REDIS):
+            return False
+    _verified_at[redis_json_name] = now
+    REFRESH_STATS['quotes_unchanged'] += 1
+    # History keeps one sample per refresh
+    sample = df_merged.copy(deep=False)
+    sample.attrs['fetched_at'] = now
+    QUOTES_HISTORY.record(city, sample)
+    # Subscriptions added since the last change may already hold
+    ALERTS.check(city, df_merged)
+    # Running aggregates must not expire while the page stays the same
+    city_aggregates = _statistics_aggregates.get(city.lower(), {})
+    for currency in df_merged['currency'].unique():
+        if currency in city_aggregates:
+            city_aggregates[currency]['fetched_at'] = now
+    return True
+
+
+def _quotes_redis_key(city: str, currency: str) -> str:
+    return f'{city.lower()}:{currency.lower()}'
+
+
+def _statistics_redis_key(city: str) -> str:
+    return f"statistics:{city.lower()}"
+
+
+async def get_quotes_df(currency: str,
+                        city: str = 'Moscow',
+                        num_of_returned_banks: int = 5,
+                        return_all_banks: bool = False,
+                        cache_only: bool = False
+                        ) -> pd.DataFrame | None:
+    """Return quotes for the pair. With cache_only=True, or on an instance
+    that is not the scraper leader, a Redis miss returns None instead of
+    scraping; the background refresher keeps the cache warm.
+    If Redis is down there is no cache to rely on, so we scrape anyway.
+    Data older than the soft TTL is returned as is and refreshed in background."""
+
+    redis_json_name = _quotes_redis_key(city, currency)
+    cached_quotes = None
 
+    if redis_client.REDIS_AVAILABLE:
+        try:
+            cached_quotes = await _read_through_local_cache(redis_json_name, get_quotes_df_from_redis_cache)
+        except Exception as e:
+            cached_quotes = None
+            logger.error("Couldn`t retrive quotes from Redis: %s", e)
 
-def _calculate_statistics(df: pd.DataFrame) -> dict[str, CurrencyStatistics]:
+        # Only the leader instance scrapes, the others read the cache
+        if cached_quotes is None and (cache_only or not SCRAPER_LEADER.is_leader):
+            return None
 
-    available_currencies = set(df['currency'])
-
-    statistics_template: CurrencyStatistics = {
-        'num_of_available_buys': 0,
-        'num_of_available_sells': 0,
-        'avg_buys': None,
-        'avg_sells': None,
-        'avg_price': None,
-        'min_spread_rub': 0.0,
-        'max_spread_rub': 0.0,
-        'avg_spread_rub': None,
+    if cached_quotes is not None:
+        if _is_stale(cached_quotes.attrs['fetched_at'], TTL_QUOTES_IN_REDIS):
+            revalidate_quotes(currency, city)
+        return cached_quotes if return_all_banks else cached_quotes.head(num_of_returned_banks)
+
+    df_merged = await refresh_quotes_single_flight(currency, city)
+
+    return df_merged if return_all_banks else df_merged.head(num_of_returned_banks)
+
+
+async def refresh_quotes_single_flight(currency: str, city: str) -> pd.DataFrame:
+    """refresh_quotes_df with only one scrape per key, concurrent misses and
+    the background refresher wait for it"""
+    redis_json_name = _quotes_redis_key(city, currency)
+    return await SINGLE_FLIGHT.do(redis_json_name,
+                                  lambda: refresh_quotes_df(currency, city),
+                                  lambda: get_quotes_df_from_redis_cache(redis_json_name))
+
+
+async def _get_several_currencies_in_city(city: str,
+                                          currencies_list: list[str]
+                                          ) -> pd.DataFrame:
+    # All currencies are requested at once, http_client limits the concurrency
+    results = await asyncio.gather(*[get_quotes_df(currency, city, return_all_banks=True)
+                                     for currency in currencies_list])
+    frames = [df for df in results if df is not None and not df.empty]
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    # concat drops attrs that differ, so every currency keeps the time of its own scrape
+    df.attrs['fetched_at_by_currency'] = {currency: frame.attrs['fetched_at']
+                                          for frame in frames for currency in frame['currency'].unique()}
+    return df
+
+
+# Columns summed and counted per currency, by the name used in the aggregates
+STATISTICS_COLUMNS = {'buy': 'buy_quote', 'sell': 'sell_quote', 'price': 'avg_price', 'spread': 'spread'}
+
+
+def _aggregate_quotes(df: pd.DataFrame) -> dict[str, dict]:
+    """Per currency counts and sums of STATISTICS_COLUMNS and spread min/max,
+    computed for all currencies in one pass over the arrays"""
+    codes, currencies = pd.factorize(df['currency'])
+    # Rows of every currency become one contiguous slice in their original order
+    order = np.argsort(codes, kind='stable')
+    starts = np.searchsorted(codes[order], np.arange(len(currencies)))
+    ends = np.append(starts[1:], len(order))
+    values = df[list(STATISTICS_COLUMNS.values())].to_numpy(dtype=float)[order]
+    present = ~np.isnan(values)
+    counts = np.add.reduceat(present.astype(np.int64), starts)
+    # Summed like pandas mean does it: NaN as 0 and np.sum over a contiguous
+    # column, so the same pairwise summation gives the same rounded averages
+    columns = np.ascontiguousarray(np.where(present, values, 0).T)
+
+    # fmin / fmax skip NaN, a currency without any spread gets NaN
+    spreads = values[:, list(STATISTICS_COLUMNS).index('spread')]
+    spread_min = np.fmin.reduceat(spreads, starts)
+    spread_max = np.fmax.reduceat(spreads, starts)
+
+    aggregates = {}
+    for code, currency in enumerate(currencies):
+        aggregate = {'spread_min': float(spread_min[code]), 'spread_max': float(spread_max[code])}
+        for i, name in enumerate(STATISTICS_COLUMNS):
+            aggregate[f'{name}_count'] = int(counts[code, i])
+            aggregate[f'{name}_sum'] = float(columns[i, starts[code]:ends[code]].sum())
+        aggregates[currency] = aggregate
+    return aggregates
+
+
+def _statistics_from_aggregate(aggregate: dict) -> CurrencyStatistics:
+
+    def _average(name: str) -> float | None:
+        count = aggregate[f'{name}_count']
+        # np.round like the pandas mean used to be rounded, Python round differs at .xx5
+        return float(np.round(aggregate[f'{name}_sum'] / count, 2)) if count else None
+
+    return {
+        'num_of_available_buys': int(aggregate['buy_count']),
+        'num_of_available_sells': int(aggregate['sell_count']),
+        'avg_buys': _average('buy'),
+        'avg_sells': _average('sell'),
+        'avg_price': _average('price'),
+        'min_spread_rub': float(round(aggregate['spread_min'], 2)),
+        'max_spread_rub': float(round(aggregate['spread_max'], 2)),
+        'avg_spread_rub': _average('spread'),
     }
 
-    stat: dict[str, CurrencyStatistics] = {}
 
-    for currency in available_currencies:
-        stat[currency] = copy.deepcopy(statistics_template)
-        r = stat[currency]
+def _calculate_statistics(df: pd.DataFrame) -> dict[str, CurrencyStatistics]:
+    return {currency: _statistics_from_aggregate(aggregate)
+            for currency, aggregate in _aggregate_quotes(df).items()}
+
+
+# Latest per currency aggregates of every city: {city: {currency: aggregate}}.
+# A refreshed quote table replaces only its own currency, so city statistics
+# are rebuilt from a few numbers instead of all the quote tables.
+_statistics_aggregates: dict[str, dict[str, dict]] = {}
+# Cities whose aggregates changed since their statistics were last stored
+_statistics_dirty: set[str] = set()
+
+
+def _update_statistics_aggregates(city: str, df: pd.DataFrame) -> None:
+    if df is None or df.empty:
+        return
+    fetched_at = df.attrs.get('fetched_at', time.time())
+    fetched_at_by_currency = df.attrs.get('fetched_at_by_currency', {})
+    city_aggregates = _statistics_aggregates.setdefault(city.lower(), {})
+    for currency, aggregate in _aggregate_quotes(df).items():
+        city_aggregates[currency] = {**aggregate, 'fetched_at': fetched_at_by_currency.get(currency, fetched_at)}
+    _statistics_dirty.add(city.lower())
+
+
+def _statistics_fetched_at(city: str) -> float:
+    """Statistics are as old as their oldest quote table"""
+    city_aggregates = _statistics_aggregates.get(city.lower(), {})
+    return min((aggregate['fetched_at'] for aggregate in city_aggregates.values()), default=time.time())
+
+
+def _statistics_from_aggregates(city: str) -> dict[str, CurrencyStatistics]:
+    city_aggregates = _statistics_aggregates.get(city.lower(), {})
+    # A currency that keeps failing to refresh drops out with its quote table
+    expired = [currency for currency, aggregate in city_aggregates.items()
+               if _is_stale(aggregate['fetched_at'], HARD_TTL_QUOTES_IN_REDIS)]
+    for currency in expired:
+        del city_aggregates[currency]
+        _statistics_dirty.add(city.lower())
+    return {currency: _statistics_from_aggregate(city_aggregates[currency]) for currency in sorted(city_aggregates)}
+
+
+async def refresh_statistics(city: str, df: pd.DataFrame | None = None) -> dict[str, CurrencyStatistics]:
+    """Store city statistics in Redis. Quote tables refreshed by
+    refresh_quotes_df are already aggregated, df adds other ones."""
+    _update_statistics_aggregates(city, df)
+    response = _statistics_from_aggregates(city)
+    if not response:
+        return {}
 
-        df_cur = df[df["currency"] == currency]
+    if redis_client.REDIS_CLIENT is not None:
+        redis_json_name = _statistics_redis_key(city)
+        rendered = _last_statistics_rendered.get(city.lower())
+        if city.lower() not in _statistics_dirty and rendered is not None:
+            now = time.time()
+            if await _extend_ttl([redis_json_name], HARD_TTL_STATS_IN_REDIS) and \
+                    await _confirm_rendered(rendered, now, HARD_TTL_STATS_IN_REDIS):
+                _verified_at[redis_json_name] = now
+                REFRESH_STATS['statistics_unchanged'] += 1
+                return response
+        _statistics_dirty.discard(city.lower())
+        _verified_at.pop(redis_json_name, None)
+        # save parsed data to redis for TTL minutes set in .env
+        fetched_at = _statistics_fetched_at(city)
+        await set_statistics_to_redis_cache(redis_json_name, response, fetched_at)
+        rendered = await render_statistics_messages(city, response, fetched_at)
+        if rendered is not None:
+            _last_statistics_rendered[city.lower()] = rendered
+        else:
+            _last_statistics_rendered.pop(city.lower(), None)
+        REFRESH_STATS['statistics_changed'] += 1
 
-        r['num_of_available_buys'] = int(df_cur['buy_quote'].notna().sum())
-        r['num_of_available_sells'] = int(df_cur['sell_quote'].notna().sum())
+    return response
 
-        avg_buys = df_cur['buy_quote'].mean()
-        r['avg_buys'] = round(avg_buys, 2) if pd.notna(avg_buys) else None
 
-        avg_sells = df_cur['sell_quote'].mean()
-        r['avg_sells'] = round(avg_sells, 2) if pd.notna(avg_sells) else None
+async def _refresh_statistics_from_quotes(city: str,
+                                          currencies_list: list[str]
+                                          ) -> dict[str, CurrencyStatistics]:
+    df = await _get_several_currencies_in_city(city, currencies_list)
+    return await refresh_statistics(city, df)
 
-        avg_price = df_cur['avg_price'].mean()
-        r['avg_price'] = round(avg_price, 2) if pd.notna(avg_price) else None
 
-        r['min_spread_rub'] = float(round(df_cur['spread'].min(), 2))
-        r['max_spread_rub'] = float(round(df_cur['spread'].max(), 2))
-        avg_spread = df_cur['spread'].mean()
-        r['avg_spread_rub'] = round(avg_spread, 2) if pd.notna(avg_spread) else None
+async def _read_statistics_data(redis_json_name: str) -> dict[str, CurrencyStatistics] | None:
+    cached = await get_statistics_df_from_redis_cache(redis_json_name)
+    return cached['data'] if cached is not None else None
 
-    return stat
 
+async def get_statistics_with_age(city: str,
+                                  currencies_list: list[str],
+                                  cache_only: bool = False
+                                  ) -> dict | None:
+    """Return {'fetched_at': ..., 'data': statistics} or None"""
+    redis_json_name = _statistics_redis_key(city)
 
-def get_statistics(city: str,
-                   currencies_list: list[str]
-                   ) -> dict[str, CurrencyStatistics]:
-    redis_json_name = f"statistics:{city.lower()}"
     # First we check redis storage. If empty we parsing from website.
-    if redis_client.REDIS_AVAILABLE is not None:
+    if redis_client.REDIS_AVAILABLE:
         try:
-            response = get_statistics_df_from_redis_cache(redis_json_name)
-            if response is not None:
-                return json.loads(response)
+            cached = await _read_through_local_cache(redis_json_name, get_statistics_df_from_redis_cache)
+            if cached is not None:
+                if _is_stale(cached['fetched_at'], TTL_STATS_IN_REDIS):
+                    revalidate_statistics(city, currencies_list)
+                return cached
         except Exception as e:
             logger.error('Couldn`t get statistics from Redis: %s', e)
 
-    # If no data in cache then we parse website
-    df = _get_several_currencies_in_city(city, currencies_list)
+        if cache_only or not SCRAPER_LEADER.is_leader:
+            return None
 
-    if df.empty:
-        return {}
+    # If no data in cache then we parse website, once for all concurrent callers
+    statistics = await SINGLE_FLIGHT.do(redis_json_name,
+                                        lambda: _refresh_statistics_from_quotes(city, currencies_list),
+                                        lambda: _read_statistics_data(redis_json_name))
+    if not statistics:
+        return None
+    return {'fetched_at': _statistics_fetched_at(city), 'data': statistics}
+
+
+async def get_statistics(city: str,
+                         currencies_list: list[str],
+                         cache_only: bool = False
+                         ) -> dict[str, CurrencyStatistics]:
+    cached = await get_statistics_with_age(city, currencies_list, cache_only)
+    return cached['data'] if cached is not None else {}
 
-    # calculating statistics and pack result in dict
-    response = _calculate_statistics(df)
+
+def _bybit_redis_key(side: str) -> str:
+    return f"bybit:{side}"
+
+
+async def get_bybit_stats_from_redis_cache(redis_json_name: str) -> dict | None:
+    """Return cached {'fetched_at': ..., 'data': stats} or None"""
+    data = await redis_client.REDIS_CLIENT.get(redis_json_name)
+    if data is None:
+        return None
+    cached = json.loads(data)
+    # JSON turns the int amounts into strings
+    trusted = cached['data']['trusted']
+    trusted['avg_prices_by_amount'] = {int(amount): price
+                                       for amount, price in trusted['avg_prices_by_amount'].items()}
+    return cached
+
+
+async def set_bybit_stats_to_redis_cache(redis_json_name: str, stats: dict, fetched_at: float) -> None:
+    try:
+        cached = {'fetched_at': fetched_at, 'data': stats}
+        version = await _set_with_version(redis_json_name, json.dumps(cached), HARD_TTL_BYBIT_IN_REDIS)
+        LOCAL_CACHE.set(redis_json_name, cached, version)
+    except Exception as e:
+        LOCAL_CACHE.invalidate(redis_json_name)
+        logger.error("Data where not saved in Redis: %s", e)
+
+
+async def refresh_bybit_stats(side: str) -> dict | None:
+    """Fetch Bybit P2P stats for the side and store them with rendered replies.
+    A failed fetch leaves the previous cached stats in place."""
+    stats = await fetch_bybit_p2p_stats(side=side)
+    if stats is None:
+        raise RuntimeError(f"Couldn`t fetch Bybit {side} stats")
 
     if redis_client.REDIS_CLIENT is not None:
-        # save parsed data to redis for TTL minutes set in .env
-        set_statistics_to_redis_cache(redis_json_name,
-                                      json.dumps(response)
-                                      )
+        fetched_at = time.time()
+        await set_bybit_stats_to_redis_cache(_bybit_redis_key(side), stats, fetched_at)
+        await render_bybit_messages(side, stats, fetched_at)
 
-    return response
+    return stats
+
+
+async def _read_bybit_stats_data(redis_json_name: str) -> dict | None:
+    cached = await get_bybit_stats_from_redis_cache(redis_json_name)
+    return cached['data'] if cached is not None else None
+
+
+async def get_bybit_stats(side: str = 'buy', cache_only: bool = False) -> dict | None:
+    redis_json_name = _bybit_redis_key(side)
+
+    if redis_client.REDIS_AVAILABLE:
+        try:
+            cached = await _read_through_local_cache(redis_json_name, get_bybit_stats_from_redis_cache)
+            if cached is not None:
+                if _is_stale(cached['fetched_at'], TTL_BYBIT_IN_REDIS):
+                    revalidate_bybit_stats(side)
+                return cached['data']
+        except Exception as e:
+            logger.error('Couldn`t get Bybit stats from Redis: %s', e)
+
+        if cache_only or not SCRAPER_LEADER.is_leader:
+            return None
+
+    try:
+        return await SINGLE_FLIGHT.do(redis_json_name,
+                                      lambda: refresh_bybit_stats(side),
+                                      lambda: _read_bybit_stats_data(redis_json_name))
+    except Exception as e:
+        logger.error('Couldn`t get Bybit %s stats: %s', side, e)
+        return None
@@ -1,4 +1,12 @@
 import pandas as pd
+import time
+import pytz
+from prompts import prompt_messages_show_data, prompt_messages_no_data, cities_prompt, \
+                    prompt_history_title, prompt_history_sections, prompt_history_metrics, prompt_history_no_data
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+HISTORY_METRICS = ('buy', 'sell', 'spread')
+MOSCOW_TZ = pytz.timezone('Europe/Moscow')
 
 # Sample: format your DataFrame into a readable string
 def format_dataframe(df: pd.DataFrame, lang: str) -> str:
@@ -67,4 +75,65 @@ def format_stats_for_telegram(prepared_response: dict, lang: str = "en") -> str:
 
         message_parts.append(part)
 
-    return "\n\n".join(message_parts)
\ No newline at end of file
+    return "\n\n".join(message_parts)
+
+
+def format_quotes_age(fetched_at: float, lang: str = "en") -> str:
+    minutes = max(int((time.time() - fetched_at) // 60), 0)
+    if lang.lower() == "ru":
+        return "🕒 Обновлено только что" if minutes == 0 else f"🕒 Обновлено {minutes} мин. назад"
+    return "🕒 Updated just now" if minutes == 0 else f"🕒 Updated {minutes} min ago"
+
+
+def render_quotes_message(df: pd.DataFrame, city: str, currency: str, lang: str) -> str:
+    """Full text of the quotes reply, without the data age line"""
+    preapred_currency_data = format_dataframe(df, lang) if df is not None else ""
+    if preapred_currency_data == "":
+        return prompt_messages_no_data[lang]
+    return prompt_messages_show_data[lang].format(currency=currency.upper(),
+                                                  city=cities_prompt[city.upper()][lang]) +\
+        preapred_currency_data
+
+
+def render_statistics_message(stats: dict, lang: str) -> str:
+    return format_stats_for_telegram(stats, lang) if stats else prompt_messages_no_data[lang]
+
+
+def sparkline(values: list[float]) -> str:
+    low, high = min(values), max(values)
+    if high == low:
+        return SPARK_CHARS[len(SPARK_CHARS) // 2] * len(values)
+    scale = (len(SPARK_CHARS) - 1) / (high - low)
+    return "".join(SPARK_CHARS[round((value - low) * scale)] for value in values)
+
+
+def _rollup_averages(buckets: list[dict], metric: str) -> list[float]:
+    return [bucket[f"{metric}_sum"] / bucket[f"{metric}_count"] for bucket in buckets if bucket[f"{metric}_count"]]
+
+
+def render_history_message(rollups: dict[str, list[dict]] | None, city: str, currency: str, lang: str) -> str:
+    """Trend reply built from quotes_rollups buckets, see db_manager.load_quotes_rollups_db"""
+    if not rollups or not any(rollups.values()):
+        return prompt_history_no_data[lang]
+
+    metrics = prompt_history_metrics[lang]
+    parts = [prompt_history_title[lang].format(currency=currency.upper(), city=cities_prompt[city.upper()][lang])]
+    for granularity in ('10min', 'hour'):
+        lines = []
+        for metric in HISTORY_METRICS:
+            averages = _rollup_averages(rollups.get(granularity, []), metric)
+            if averages:
+                lines.append(f"{metrics[metric]}: {sparkline(averages)} {averages[0]:.2f} → {averages[-1]:.2f}")
+        if lines:
+            parts.append("\n".join([prompt_history_sections[lang][granularity]] + lines))
+
+    days = rollups.get('day', [])
+    if days:
+        lines = [prompt_history_sections[lang]['day']]
+        for bucket in days:
+            values = [f"{metrics[metric]} {bucket[f'{metric}_min']:.2f}–{bucket[f'{metric}_max']:.2f} "
+                      f"({bucket[f'{metric}_sum'] / bucket[f'{metric}_count']:.2f})"
+                      for metric in HISTORY_METRICS if bucket[f"{metric}_count"]]
+            lines.append(f"📅 {bucket['bucket'].astimezone(MOSCOW_TZ):%d.%m}: " + ", ".join(values))
+        parts.append("\n".join(lines))
+    return "\n\n".join(parts)
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 import psycopg2
-from psycopg2 import sql
+from psycopg2 import sql, pool
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta, timezone
 import os
+import threading
+import time
 
 import logging
 
@@ -10,26 +15,422 @@ logger = logging.getLogger(__name__)
 
 load_dotenv(encoding='utf-8')
 
+DB_POOL_MIN_CONN = int(os.getenv('DB_POOL_MIN_CONN', 1))
+DB_POOL_MAX_CONN = int(os.getenv('DB_POOL_MAX_CONN', 10))
+# How long a request waits for a free connection before giving up
+DB_POOL_WAIT_TIMEOUT = float(os.getenv('DB_POOL_WAIT_TIMEOUT', 5))
+# Connections idle longer than this are pinged before they are handed out
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTHCHECK_INTERVAL', 30))
+# If DB is down the pool is created on a later borrow, waiting twice as long
+# after every failure up to the max delay
+DB_POOL_RETRY_DELAY = float(os.getenv('DB_POOL_RETRY_DELAY', 1))
+DB_POOL_RETRY_MAX_DELAY = float(os.getenv('DB_POOL_RETRY_MAX_DELAY', 60))
+
+
+def _connection_params() -> dict:
+    return dict(
+        dbname=os.getenv('DB_NAME'),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        host=os.getenv('DB_HOST', 'localhost'),
+        port=os.getenv('DB_PORT', '5432')
+    )
+
 
 # Database connection setup
 def get_db_connection() -> None:
     try:
-        conn = psycopg2.connect(
-            dbname=os.getenv('DB_NAME'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            host=os.getenv('DB_HOST', 'localhost'),
-            port=os.getenv('DB_PORT', '5432')
-        )
+        conn = psycopg2.connect(**_connection_params())
         return conn
     except Exception as e:
         logger.error('Couldn`t connect to db %s', e)
         return None
 
 
+class DBPool:
+    """Bounded pool of connections shared by all db_manager functions.
+
+    psycopg2 pools raise as soon as they are exhausted, so borrowers wait on
+    a semaphore instead. Broken connections are dropped and reopened by the
+    pool on the next borrow."""
+
+    def __init__(self, minconn: int = DB_POOL_MIN_CONN, maxconn: int = DB_POOL_MAX_CONN,
+                 wait_timeout: float = DB_POOL_WAIT_TIMEOUT,
+                 healthcheck_interval: float = DB_POOL_HEALTHCHECK_INTERVAL) -> None:
+        self.maxconn = maxconn
+        self.wait_timeout = wait_timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **_connection_params())
+        self._slots = threading.BoundedSemaphore(maxconn)
+        # Connections never returned yet were opened with the pool, or just now
+        self._created_at = time.monotonic()
+        self._last_used: dict[int, float] = {}
+        self._lock = threading.Lock()
+        self.stats = {'borrows': 0, 'in_use': 0, 'timeouts': 0, 'reconnects': 0,
+                      'wait_time_total': 0.0, 'wait_time_max': 0.0}
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), self._created_at) < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        # A connection can go bad while idle, give the pool a few tries to replace it
+        for _ in range(self.maxconn + 1):
+            conn = self._pool.getconn()
+            if self._is_healthy(conn):
+                return conn
+            logger.warning("Dropping broken DB connection")
+            self._discard(conn)
+        raise psycopg2.OperationalError("No healthy DB connection available")
+
+    def _discard(self, conn) -> None:
+        self._last_used.pop(id(conn), None)
+        self._pool.putconn(conn, close=True)
+        with self._lock:
+            self.stats['reconnects'] += 1
+
+    def getconn(self):
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            with self._lock:
+                self.stats['timeouts'] += 1
+            raise pool.PoolError(f"No free DB connection in {self.wait_timeout} s")
+        waited = time.monotonic() - started
+
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.stats['borrows'] += 1
+            self.stats['in_use'] += 1
+            self.stats['wait_time_total'] += waited
+            self.stats['wait_time_max'] = max(self.stats['wait_time_max'], waited)
+        return conn
+
+    def putconn(self, conn, broken: bool = False) -> None:
+        try:
+            if broken or conn.closed:
+                self._discard(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            with self._lock:
+                self.stats['in_use'] -= 1
+            self._slots.release()
+
+    def closeall(self) -> None:
+        self._pool.closeall()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats['size'] = self.maxconn
+        stats['wait_time_avg'] = stats['wait_time_total'] / stats['borrows'] if stats['borrows'] else 0.0
+        return stats
+
+
+# Shared pool, created by db_init or by the first borrow after DB came back
+DB_POOL: DBPool | None = None
+_pool_wanted = False
+_pool_lock = threading.Lock()
+_pool_retry_at = 0.0
+_pool_retry_delay = DB_POOL_RETRY_DELAY
+
+
+def _ensure_pool() -> DBPool | None:
+    """Create the pool if db_init asked for it and the last attempt is long enough ago"""
+    global DB_POOL, _pool_retry_at, _pool_retry_delay
+    if DB_POOL is not None or not _pool_wanted:
+        return DB_POOL
+    created = False
+    with _pool_lock:
+        if DB_POOL is None and _pool_wanted and time.monotonic() >= _pool_retry_at:
+            try:
+                DB_POOL = DBPool()
+                created = True
+                _pool_retry_delay = DB_POOL_RETRY_DELAY
+            except Exception as e:
+                logger.error('Couldn`t create DB pool, next try in %s s: %s', _pool_retry_delay, e)
+                _pool_retry_at = time.monotonic() + _pool_retry_delay
+                _pool_retry_delay = min(_pool_retry_delay * 2, DB_POOL_RETRY_MAX_DELAY)
+    if created:
+        logger.info("DB pool created")
+        with borrow_connection() as conn:
+            _create_tables(conn)
+    return DB_POOL
+
+
+@contextmanager
+def borrow_connection():
+    """Yield a pooled connection (or None if DB is not available) and return it afterwards"""
+    if _ensure_pool() is None:
+        yield None
+        return
+
+    try:
+        conn = DB_POOL.getconn()
+    except Exception as e:
+        logger.error('Couldn`t get connection from DB pool: %s', e)
+        conn = None
+    if conn is None:
+        yield None
+        return
+
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        if not broken and not conn.closed:
+            try:
+                # Don`t hand an aborted transaction to the next borrower
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        DB_POOL.putconn(conn, broken=broken)
+
+
+def get_pool_stats() -> dict:
+    return DB_POOL.get_stats() if DB_POOL is not None else {}
+
+
+def db_close() -> None:
+    global DB_POOL, _pool_wanted
+    _pool_wanted = False
+    if DB_POOL is not None:
+        logger.info("DB pool stats: %s", DB_POOL.get_stats())
+        DB_POOL.closeall()
+        DB_POOL = None
+
+
 def db_init() -> None:
-    """Initialize database (create tables if not exist)"""
-    conn = get_db_connection()
+    """Create the connection pool and initialize database (create tables if not exist).
+    If DB is not reachable yet, both happen on a later borrow_connection."""
+    global _pool_wanted, _pool_retry_at, _pool_retry_delay
+    _pool_wanted = True
+    _pool_retry_at, _pool_retry_delay = 0.0, DB_POOL_RETRY_DELAY
+    _ensure_pool()
+
+
+# Every scraped quote table, partitioned by month of the scrape
+QUOTES_HISTORY_COLUMNS = ('scraped_at', 'city', 'currency', 'bank', 'buy_quote', 'sell_quote', 'spread',
+                          'spread_percent', 'avg_price', 'quote_time', 'commissions')
+QUOTES_HISTORY_DDL = """
+    CREATE TABLE IF NOT EXISTS quotes_history (
+        scraped_at TIMESTAMPTZ NOT NULL,
+        city TEXT NOT NULL,
+        currency TEXT NOT NULL,
+        bank TEXT NOT NULL,
+        buy_quote DOUBLE PRECISION,
+        sell_quote DOUBLE PRECISION,
+        spread DOUBLE PRECISION,
+        spread_percent DOUBLE PRECISION,
+        avg_price DOUBLE PRECISION,
+        quote_time TIMESTAMPTZ,
+        commissions BOOLEAN
+    ) PARTITION BY RANGE (scraped_at);
+    CREATE INDEX IF NOT EXISTS quotes_history_city_currency_time_idx
+        ON quotes_history (city, currency, scraped_at);
+"""
+
+# Per (city, currency) min/sum/max of quotes per time bucket, updated on every
+# history flush so trends never scan quotes_history. avg = sum / count.
+QUOTES_ROLLUP_GRANULARITIES = ('10min', 'hour', 'day')
+QUOTES_ROLLUP_METRICS = ('buy', 'sell', 'spread')
+QUOTES_ROLLUP_COLUMNS = ('city', 'currency', 'granularity', 'bucket') + tuple(
+    f"{metric}_{agg}" for metric in QUOTES_ROLLUP_METRICS for agg in ('count', 'min', 'sum', 'max'))
+QUOTES_ROLLUPS_DDL = """
+    CREATE TABLE IF NOT EXISTS quotes_rollups (
+        city TEXT NOT NULL,
+        currency TEXT NOT NULL,
+        granularity TEXT NOT NULL,
+        bucket TIMESTAMPTZ NOT NULL,
+""" + "".join(f"""        {metric}_count INTEGER NOT NULL DEFAULT 0,
+        {metric}_min DOUBLE PRECISION,
+        {metric}_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+        {metric}_max DOUBLE PRECISION,
+""" for metric in QUOTES_ROLLUP_METRICS) + """        PRIMARY KEY (city, currency, granularity, bucket)
+    );
+"""
+
+# Partitions already created by this process
+_QUOTES_HISTORY_PARTITIONS: set[date] = set()
+
+
+def _month_range(month: date) -> tuple[datetime, datetime]:
+    """Bounds of the UTC month. Plain dates would be read in the session
+    time zone and not match the UTC months the rows are grouped by."""
+    start = datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def _ensure_quotes_history_partitions(cur, months: set[date]) -> None:
+    """months are UTC dates of scraped_at"""
+    for month in months:
+        start, end = _month_range(month)
+        if start.date() in _QUOTES_HISTORY_PARTITIONS:
+            continue
+        cur.execute(
+            sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF quotes_history FOR VALUES FROM (%s) TO (%s)").format(
+                sql.Identifier(f"quotes_history_{start:%Y_%m}")),
+            (start, end)
+        )
+        _QUOTES_HISTORY_PARTITIONS.add(start.date())
+
+
+_UPSERT_ROLLUPS_SQL = sql.SQL(
+    "INSERT INTO quotes_rollups AS r ({columns}) VALUES %s "
+    "ON CONFLICT (city, currency, granularity, bucket) DO UPDATE SET {updates}"
+).format(
+    columns=sql.SQL(", ").join(sql.Identifier(column) for column in QUOTES_ROLLUP_COLUMNS),
+    updates=sql.SQL(", ").join(
+        sql.SQL(template).format(sql.Identifier(f"{metric}_{agg}"))
+        for metric in QUOTES_ROLLUP_METRICS
+        for agg, template in (('count', "{0} = r.{0} + EXCLUDED.{0}"),
+                              ('min', "{0} = LEAST(r.{0}, EXCLUDED.{0})"),
+                              ('sum', "{0} = r.{0} + EXCLUDED.{0}"),
+                              ('max', "{0} = GREATEST(r.{0}, EXCLUDED.{0})")))
+)
+
+
+def copy_quotes_history_db(csv_buffer, months: set[date], rollup_rows: list[tuple] = (),
+                           page_size: int = 1000) -> bool:
+    """Bulk load quote rows with COPY. csv_buffer holds CSV rows in
+    QUOTES_HISTORY_COLUMNS order, months are the scrape months it covers.
+    rollup_rows (QUOTES_ROLLUP_COLUMNS order) are merged into quotes_rollups
+    in the same transaction, so a retried flush never counts rows twice."""
+    with borrow_connection() as conn:
+        if conn is None:
+            logger.error('DB is not available to save quotes history')
+            return False
+        try:
+            with conn.cursor() as cur:
+                _ensure_quotes_history_partitions(cur, months)
+                cur.copy_expert(
+                    sql.SQL("COPY quotes_history ({}) FROM STDIN WITH (FORMAT csv)").format(
+                        sql.SQL(", ").join(sql.Identifier(column) for column in QUOTES_HISTORY_COLUMNS)),
+                    csv_buffer
+                )
+                if rollup_rows:
+                    execute_values(cur, _UPSERT_ROLLUPS_SQL, rollup_rows, page_size=page_size)
+            conn.commit()
+            return True
+        except Exception as e:
+            # The partitions may not have been committed
+            _QUOTES_HISTORY_PARTITIONS.clear()
+            logger.error('Couldn`t save quotes history: %s', e)
+            return False
+
+
+def load_quotes_rollups_db(city: str, currency: str, since: dict[str, datetime]) -> dict[str, list[dict]] | None:
+    """Rollup buckets of (city, currency) newer than since[granularity],
+    oldest first, or None if DB is not available"""
+    columns = sql.SQL(", ").join(sql.Identifier(column) for column in QUOTES_ROLLUP_COLUMNS[3:])
+    query = sql.SQL("SELECT {} FROM quotes_rollups WHERE city = %s AND currency = %s "
+                    "AND granularity = %s AND bucket >= %s ORDER BY bucket").format(columns)
+    with borrow_connection() as conn:
+        if conn is None:
+            return None
+        try:
+            rollups = {}
+            with conn.cursor() as cur:
+                for granularity, start in since.items():
+                    cur.execute(query, (city.lower(), currency.upper(), granularity, start))
+                    rollups[granularity] = [dict(zip(QUOTES_ROLLUP_COLUMNS[3:], row)) for row in cur.fetchall()]
+            return rollups
+        except Exception as e:
+            logger.error('Couldn`t load quotes rollups: %s', e)
+            return None
+
+
+ALERT_SUBSCRIPTION_COLUMNS = ('id', 'user_id', 'lang', 'city', 'currency', 'side', 'direction', 'threshold')
+ALERT_SUBSCRIPTIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS alert_subscriptions (
+        id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        lang TEXT,
+        city TEXT NOT NULL,
+        currency TEXT NOT NULL,
+        side TEXT NOT NULL,
+        direction TEXT NOT NULL,
+        threshold DOUBLE PRECISION NOT NULL,
+        created_at TIMESTAMP DEFAULT NOW(),
+        UNIQUE (user_id, city, currency, side, direction, threshold)
+    );
+"""
+
+
+def add_alert_subscription_db(user_id: int, lang: str, city: str, currency: str,
+                              side: str, direction: str, threshold: float) -> int | None:
+    """Save the subscription, returns its id (also for an existing one) or None on failure"""
+    with borrow_connection() as conn:
+        if conn is None:
+            logger.error('DB is not available to save alert subscription of user %s', user_id)
+            return None
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO alert_subscriptions (user_id, lang, city, currency, side, direction, threshold)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (user_id, city, currency, side, direction, threshold)
+                    DO UPDATE SET lang = EXCLUDED.lang
+                    RETURNING id
+                """, (user_id, lang, city, currency, side, direction, threshold))
+                subscription_id = cur.fetchone()[0]
+            conn.commit()
+            return subscription_id
+        except Exception as e:
+            logger.error('Couldn`t save alert subscription of user %s: %s', user_id, e)
+            return None
+
+
+def delete_alert_subscriptions_db(user_id: int) -> bool:
+    with borrow_connection() as conn:
+        if conn is None:
+            logger.error('DB is not available to delete alert subscriptions of user %s', user_id)
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM alert_subscriptions WHERE user_id = %s", (user_id,))
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error('Couldn`t delete alert subscriptions of user %s: %s', user_id, e)
+            return False
+
+
+def load_alert_subscriptions_db() -> list[tuple] | None:
+    """All subscriptions as ALERT_SUBSCRIPTION_COLUMNS tuples, None if DB is not available"""
+    with borrow_connection() as conn:
+        if conn is None:
+            return None
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql.SQL("SELECT {} FROM alert_subscriptions").format(
+                    sql.SQL(", ").join(sql.Identifier(column) for column in ALERT_SUBSCRIPTION_COLUMNS)))
+                return cur.fetchall()
+        except Exception as e:
+            logger.error('Couldn`t load alert subscriptions: %s', e)
+            return None
+
+
+def _create_tables(conn) -> None:
     if conn is not None:
         try:
             with conn.cursor() as cur:
@@ -46,70 +447,106 @@ def db_init() -> None:
                         filled_requests_currencies INTEGER DEFAULT 0,
                         filled_requests_stats INTEGER DEFAULT 0
                     );
-                """)
+                """ + QUOTES_HISTORY_DDL + QUOTES_ROLLUPS_DDL + ALERT_SUBSCRIPTIONS_DDL)
                 conn.commit()
-                logger.info("Database initialized: 'users' table checked/created.")
+                logger.info("Database initialized: 'users', 'quotes_history', 'quotes_rollups' and 'alert_subscriptions' tables checked/created.")
         except Exception as e:
             logger.error(f"Error initializing database: {e}")
-        finally:
-            conn.close()
     else:
         logger.error("Couldn`t init DB because conn is not available")
 
 
 def save_new_user_data_in_db(user, conn=None) -> None:
     """Save new user data in the database"""
-    conn = conn or get_db_connection()  # Use passed conn or create a new one
-    if conn is not None:
+    if conn is not None:  # Use passed conn or borrow one from the pool
+        _save_new_user(user, conn)
+        return
+    with borrow_connection() as conn:
+        if conn is not None:
+            _save_new_user(user, conn)
+        else:
+            logger.error('DB is not available to save user.id {} in db'.format(user.id))
+
+
+_INSERT_USER_SQL = """
+    INSERT INTO users (id, first_name, last_name, username, language_code, is_bot, created_at)
+    VALUES %s
+    ON CONFLICT (id) DO NOTHING
+"""
+_USER_VALUES_TEMPLATE = "(%s, %s, %s, %s, %s, %s, NOW())"
+
+
+def _user_row(user) -> tuple:
+    return (user.id, user.first_name, user.last_name, user.username, user.language_code, user.is_bot)
+
+
+def _save_new_user(user, conn) -> None:
+    try:
+        with conn.cursor() as cur:
+            # Existing users are skipped by the primary key, no SELECT needed
+            cur.execute(_INSERT_USER_SQL % _USER_VALUES_TEMPLATE, _user_row(user))
+            conn.commit()
+            if cur.rowcount:
+                logger.info(f"User {user.id} saved to database successfully.")
+            else:
+                logger.info(f"User {user.id} already exists in the database.")
+    except Exception as e:
+        logger.error(f"Error saving user {user.id} to database: {e}")
+
+
+def save_new_users_batch_db(users: list, page_size: int = 1000) -> bool:
+    """Insert many users at once, already registered ones are skipped"""
+    if not users:
+        return True
+    with borrow_connection() as conn:
+        if conn is None:
+            logger.error('DB is not available to save %s new users', len(users))
+            return False
         try:
             with conn.cursor() as cur:
-                cur.execute("SELECT 1 FROM users WHERE id = %s", (user.id,))
-                if not cur.fetchone():  # If the user doesn't exist
-                    cur.execute("""
-                        INSERT INTO users (id, first_name, last_name, username, language_code, is_bot, created_at)
-                        VALUES (%s, %s, %s, %s, %s, %s, NOW())
-                    """, (
-                        user.id,
-                        user.first_name,
-                        user.last_name,
-                        user.username,
-                        user.language_code,
-                        user.is_bot
-                    ))
-                    conn.commit()
-                    logger.info(f"User {user.id} saved to database successfully.")
-                else:
-                    logger.info(f"User {user.id} already exists in the database.")
+                execute_values(cur, _INSERT_USER_SQL, [_user_row(user) for user in users],
+                               template=_USER_VALUES_TEMPLATE, page_size=page_size)
+            conn.commit()
+            return True
         except Exception as e:
-            logger.error(f"Error saving user {user.id} to database: {e}")
-        finally:
-            conn.close()
-    else:
-        logger.error('DB is not available to save user.id {} in db'.format(user.id))
+            logger.error('Couldn`t save %s new users: %s', len(users), e)
+            return False
 
 
-def increment_field_db(user, field_name: str, conn=None) -> None:
-    """Increment a field (e.g., request_count) in the users table"""
-    conn = conn or get_db_connection()
-    if conn is not None:
+def load_user_ids_db() -> set[int]:
+    """IDs of all registered users, used to warm the known users set"""
+    with borrow_connection() as conn:
+        if conn is None:
+            return set()
         try:
             with conn.cursor() as cur:
-                # Dynamically create a SQL statement
-                cur.execute("SELECT 1 FROM users WHERE id = %s", (user.id,))
-                if cur.fetchone():
-                    cur.execute(
-                        sql.SQL("UPDATE users SET {0} = {0} + 1 WHERE id = %s;").format(
-                            sql.Identifier(field_name)
-                        ),
-                        (user.id,)
-                    )
-                    conn.commit()
-                    logger.info(f"Field '{field_name}' incremented for user {user.id}.")
-                else:
-                    logger.warning(f"User {user.id} not found for increment operation.")
+                cur.execute("SELECT id FROM users")
+                return {row[0] for row in cur}
         except Exception as e:
-            logger.error(f"Error incrementing {field_name} for user {user.id}: {e}")
-        finally:
-            conn.close()
-    else:
-        logger.error('DB is not available to increment field {} for user.id {}'.format(field_name, user.id))
\ No newline at end of file
+            logger.error('Couldn`t load user ids: %s', e)
+            return set()
+
+
+def increment_fields_batch_db(fields: tuple[str, ...], rows: list[tuple], page_size: int = 1000) -> bool:
+    """Add per-user deltas to counters in one statement per page.
+    rows are (user_id, delta for fields[0], delta for fields[1], ...)"""
+    if not rows:
+        return True
+    query = sql.SQL("UPDATE users AS u SET {updates} FROM (VALUES %s) AS v (id, {columns}) WHERE u.id = v.id").format(
+        updates=sql.SQL(", ").join(
+            sql.SQL("{0} = u.{0} + v.{0}").format(sql.Identifier(field)) for field in fields
+        ),
+        columns=sql.SQL(", ").join(sql.Identifier(field) for field in fields),
+    )
+    with borrow_connection() as conn:
+        if conn is None:
+            logger.error('DB is not available to flush %s usage counters', len(rows))
+            return False
+        try:
+            with conn.cursor() as cur:
+                execute_values(cur, query, rows, page_size=page_size)
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error('Couldn`t flush usage counters: %s', e)
+            return False
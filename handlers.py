@@ -1,26 +1,38 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from bot_logic import get_quotes_df, get_statistics
+from bot_logic import get_quotes_df, get_statistics_with_age, get_rendered_quotes_message, \
+                      get_rendered_statistics_message, get_bybit_stats, get_rendered_bybit_message, \
+                      get_history_message, NUM_OF_RETURNED_BANKS, BYBIT_SIDES
 from prompts import prompt_get_statistics, prompt_choose_city_first, \
                     prompt_messages_choiced, prompt_messages_cities, \
                     prompt_messages_currencies, prompt_messages_greeting, \
-                    prompt_messages_no_data, prompt_messages_show_data, \
-                    cities_prompt, prompt_messages_crypto_or_cash
-from db_manager import save_new_user_data_in_db, increment_field_db
-from data_formatter import format_dataframe, format_stats_for_telegram
-import os
+                    cities_prompt, prompt_messages_crypto_or_cash, \
+                    prompt_usdt_amount_usage, prompt_usdt_amount_price, prompt_usdt_amount_no_offers, \
+                    prompt_messages_usdt_side, prompt_usdt_buy, prompt_usdt_sell, \
+                    prompt_history, prompt_history_usage, prompt_history_no_data, \
+                    prompt_alert_usage, prompt_alert_list, prompt_alert_saved, prompt_alert_not_saved, \
+                    prompt_alert_removed, prompt_alert_directions, prompt_alert_triggered
+from user_registry import USER_REGISTRY
+from sessions import SESSIONS
+from usage_counters import USAGE_COUNTERS
+from rate_alerts import ALERTS, ALERT_SIDES, ALERT_DIRECTIONS, AlertNotification
+from outbox import OUTBOX
+from db_manager import load_user_ids_db
+from data_formatter import render_quotes_message, render_statistics_message, format_quotes_age, \
+                           render_history_message
 from dotenv import load_dotenv
-from bb_api import fetch_bybit_p2p_stats, build_telegram_message
+from bb_api import build_telegram_message, average_price_for_amount
 
+import asyncio
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-NUM_OF_RETURNED_BANKS = int(os.getenv("NUM_OF_RETURNED_BANKS", 5))
-
-user_selection = {}  # Store user selections temporarily
+# Telegram user ids allowed to use /broadcast and /outbox
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
 
 currencies_list = ['usd', 'eur', 'gbp', 'aed']
 
@@ -52,10 +64,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     user = update.effective_user
 
-    save_new_user_data_in_db(user)
+    # Known users skip the DB, new ones are inserted in batches
+    await USER_REGISTRY.register(user)
 
     user_lang = update.effective_user.language_code
-    user_selection[user.id] = {"user_lang": user_lang}
+    await SESSIONS.update(user.id, user_lang=user_lang)
 
     
     keyboard = keyboards_cash_crypto[user_lang]
@@ -65,6 +78,140 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                     )
     
 
+# /usdt <amount> [buy|sell] command
+async def usdt_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    user_lang = update.effective_user.language_code
+    try:
+        amount = float(context.args[0].replace(',', '').replace('_', ''))
+        side = context.args[1].lower() if len(context.args) > 1 else 'buy'
+        if amount <= 0 or side not in ('buy', 'sell'):
+            raise ValueError
+    except (IndexError, ValueError):
+        await update.message.reply_text(prompt_usdt_amount_usage[user_lang])
+        return
+
+    stats = await get_bybit_stats(side)
+    if not stats:
+        await update.message.reply_text(build_telegram_message(stats, lang=user_lang))
+        return
+
+    price = average_price_for_amount(stats, amount)
+    if price is None:
+        message = prompt_usdt_amount_no_offers[user_lang].format(amount=amount)
+    else:
+        message = prompt_usdt_amount_price[user_lang].format(side=side, amount=amount, price=price)
+    await update.message.reply_text(message)
+
+
+async def _history_reply(user_id: int, currency: str, lang: str) -> str:
+    city = (await SESSIONS.get(user_id)).get("city", "Unknown")
+    if city == 'Unknown':
+        return prompt_choose_city_first[lang]
+    # Rendered from the rollups after every history flush
+    rendered = await get_history_message(city, currency, lang)
+    if rendered is None:
+        return render_history_message(None, city, currency, lang)
+    return rendered['text']
+
+
+# /history <currency> command, for the city chosen last
+async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    user_lang = update.effective_user.language_code
+    currency = context.args[0].lower() if context.args else ''
+    if currency not in currencies_list:
+        await update.message.reply_text(prompt_history_usage[user_lang])
+        return
+
+    message = await _history_reply(update.effective_user.id, currency, user_lang)
+    await update.message.reply_text(message[:4096])
+
+
+def _format_alert(lang: str, city: str, currency: str, side: str, direction: str, **values) -> str:
+    template = prompt_alert_triggered if 'price' in values else prompt_alert_saved
+    city_name = cities_prompt[city.upper()][lang] if city.upper() in cities_prompt else city
+    return template[lang].format(city=city_name, currency=currency.upper(), side=side,
+                                 direction=prompt_alert_directions[lang][direction], **values)
+
+
+# /alert <currency> <buy|sell> <below|above> <price> command, for the city chosen last
+async def alert(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    user_id = update.effective_user.id
+    user_lang = update.effective_user.language_code
+    args = [arg.lower() for arg in context.args]
+
+    if args == ['off']:
+        removed = await ALERTS.unsubscribe(user_id)
+        await update.message.reply_text(prompt_alert_removed[user_lang] if removed
+                                        else prompt_alert_not_saved[user_lang].format(max_alerts=ALERTS.max_per_user))
+        return
+
+    if not args:
+        alerts = [_format_alert(user_lang, city, currency, side, direction, threshold=threshold)
+                  for city, currency, side, direction, threshold in ALERTS.subscriptions(user_id)]
+        message = prompt_alert_list[user_lang].format(alerts="\n".join(alerts)) + "\n\n" if alerts else ""
+        await update.message.reply_text(message + prompt_alert_usage[user_lang])
+        return
+
+    try:
+        currency, side, direction = args[0], args[1], args[2]
+        threshold = float(args[3].replace(',', '.'))
+        if len(args) != 4 or currency not in currencies_list or side not in ALERT_SIDES \
+                or direction not in ALERT_DIRECTIONS or not 0 < threshold < float('inf'):
+            raise ValueError
+    except (IndexError, ValueError):
+        await update.message.reply_text(prompt_alert_usage[user_lang])
+        return
+
+    city = (await SESSIONS.get(user_id)).get("city", "Unknown")
+    if city == 'Unknown':
+        await update.message.reply_text(prompt_choose_city_first[user_lang])
+        return
+
+    if await ALERTS.subscribe(user_id, user_lang, city, currency, side, direction, threshold) is None:
+        await update.message.reply_text(prompt_alert_not_saved[user_lang].format(max_alerts=ALERTS.max_per_user))
+        return
+    await update.message.reply_text(_format_alert(user_lang, city, currency, side, direction, threshold=threshold))
+
+
+async def send_alert_notifications(notifications: list[AlertNotification]) -> None:
+    """ALERTS.notify: queue a message to every user whose alert has fired"""
+    messages = []
+    for notification in notifications:
+        lang = notification.lang if notification.lang in prompt_alert_triggered else 'en'
+        messages.append((notification.user_id,
+                         _format_alert(lang, notification.city, notification.currency, notification.side,
+                                       notification.direction, threshold=notification.threshold,
+                                       price=notification.price, bank=notification.bank)))
+    await OUTBOX.enqueue(messages)
+
+
+# /broadcast <text> command, admins only: message every user of the bot
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    text = update.message.text.partition(' ')[2].strip()
+    if not text:
+        await update.message.reply_text("Usage: /broadcast <text>")
+        return
+
+    user_ids = await asyncio.to_thread(load_user_ids_db)
+    queued = await OUTBOX.broadcast(sorted(user_ids), text)
+    await update.message.reply_text(f"Queued {queued} of {len(user_ids)} messages, see /outbox")
+
+
+# /outbox command, admins only: delivery queue metrics
+async def outbox_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    metrics = await OUTBOX.get_metrics()
+    await update.message.reply_text("\n".join(f"{name}: {value}" for name, value in metrics.items()))
+
+
 # Step 2: Ask for currency after city is chosen
 async def handle_callback(update, context):
 
@@ -78,7 +225,7 @@ async def handle_callback(update, context):
     data = query.data
     if data.startswith("cash_or_crypto:"):
         cash_or_crypto = data.split(":")[1]
-        user_selection[user_id] = {"cash_or_crypto": cash_or_crypto}
+        await SESSIONS.update(user_id, cash_or_crypto=cash_or_crypto)
 
         if cash_or_crypto == 'cash':
             keyboard = keyboards_cities[user_lang]
@@ -87,14 +234,28 @@ async def handle_callback(update, context):
                                         )
             
         elif cash_or_crypto == 'usdt':
-            message =  build_telegram_message(fetch_bybit_p2p_stats(side='buy'), lang=user_lang)
-                
-            await query.message.reply_text(message[:4096])
+            keyboard = [[InlineKeyboardButton(prompt_usdt_buy[user_lang], callback_data="usdt_side:buy"),
+                         InlineKeyboardButton(prompt_usdt_sell[user_lang], callback_data="usdt_side:sell")]]
+            await query.message.reply_text(prompt_messages_usdt_side[user_lang],
+                                           reply_markup=InlineKeyboardMarkup(keyboard))
+
+    elif data.startswith("usdt_side:"):
+        side = data.split(":")[1]
+        if side not in BYBIT_SIDES:
+            return
+        # Stats are fetched and rendered by the background refresher
+        rendered = await get_rendered_bybit_message(side, user_lang)
+        if rendered is not None:
+            message = rendered['text'] + "\n\n" + format_quotes_age(rendered['fetched_at'], user_lang)
+        else:
+            message = build_telegram_message(await get_bybit_stats(side, cache_only=True), lang=user_lang)
+
+        await query.message.reply_text(message[:4096])
 
 
     elif (data.startswith("city:")):
         city = data.split(":")[1]
-        user_selection[user_id] = {"city": city}
+        await SESSIONS.update(user_id, city=city)
 
         keyboard = [
             [InlineKeyboardButton("💵 USD", callback_data="currency:USD"),
@@ -102,6 +263,9 @@ async def handle_callback(update, context):
              InlineKeyboardButton("💷 GBP", callback_data="currency:GBP"),
              InlineKeyboardButton("💴 AED", callback_data="currency:AED")
             ],
+            [InlineKeyboardButton(f"{prompt_history[user_lang]} {currency.upper()}",
+                                  callback_data=f"history:{currency.upper()}")
+             for currency in currencies_list],
             [
              InlineKeyboardButton(prompt_get_statistics[user_lang], callback_data="get_statistics")
             ]
@@ -112,33 +276,43 @@ async def handle_callback(update, context):
 
     elif data.startswith("currency:"):
         currency = data.split(":")[1]
-        city = user_selection.get(user_id, {}).get("city", "Unknown")
+        city = (await SESSIONS.get(user_id)).get("city", "Unknown")
         if (city == 'Unknown'):
             await query.message.reply_text(prompt_choose_city_first[user_lang])
         else:
             await query.message.reply_text(prompt_messages_choiced[user_lang].format(city=cities_prompt[city.upper()][user_lang], currency=currency))
-            preapred_currency_data = format_dataframe(get_quotes_df(currency, city, NUM_OF_RETURNED_BANKS), user_lang) 
-            if preapred_currency_data == "":
-                message = prompt_messages_no_data[user_lang]
+            # Reply is rendered by the background refresher, so usually it is a single cache lookup
+            rendered = await get_rendered_quotes_message(currency, city, user_lang)
+            if rendered is not None:
+                message = rendered['text'] + "\n\n" + format_quotes_age(rendered['fetched_at'], user_lang)
             else:
-                message = prompt_messages_show_data[user_lang].format(currency=currency.upper(), city=cities_prompt[city.upper()][user_lang]) +\
-                preapred_currency_data  # df is your DataFrame
-                
+                df = await get_quotes_df(currency, city, NUM_OF_RETURNED_BANKS, cache_only=True)
+                message = render_quotes_message(df, city, currency, user_lang)
+                if df is not None and not df.empty:
+                    message += "\n\n" + format_quotes_age(df.attrs['fetched_at'], user_lang)
+
             await query.message.reply_text(message[:4096])
-            try:
-                increment_field_db(user, 'filled_requests_currencies')
-            except Exception as e:
-                logger.error('Couldn`t increment filled_requests_currencies in db for user_id: %s', e)
+            USAGE_COUNTERS.increment(user, 'filled_requests_currencies')
+
+    elif data.startswith("history:"):
+        currency = data.split(":")[1]
+        if currency.lower() not in currencies_list:
+            return
+        message = await _history_reply(user_id, currency, user_lang)
+        await query.message.reply_text(message[:4096])
 
     elif data.startswith("get_statistics"):
-        city = user_selection.get(user_id, {}).get("city", "Unknown")
+        city = (await SESSIONS.get(user_id)).get("city", "Unknown")
         if (city == 'Unknown'):
             await query.message.reply_text(prompt_choose_city_first[user_lang])
         else:
-            message = format_stats_for_telegram(get_statistics(city, currencies_list), user_lang)
+            rendered = await get_rendered_statistics_message(city, currencies_list, user_lang)
+            if rendered is not None:
+                message = rendered['text'] + "\n\n" + format_quotes_age(rendered['fetched_at'], user_lang)
+            else:
+                cached = await get_statistics_with_age(city, currencies_list, cache_only=True)
+                message = render_statistics_message(cached['data'] if cached is not None else {}, user_lang)
+                if cached is not None and cached['data']:
+                    message += "\n\n" + format_quotes_age(cached['fetched_at'], user_lang)
             await query.message.reply_text(message[:4096])
-            try:
-                increment_field_db(user, 'filled_requests_stats')
-            except Exception as e:
-                logger.error('Couldn`t increment filled_requests_stats\
-                              in db for user_id: %s', e) 
+            USAGE_COUNTERS.increment(user, 'filled_requests_stats')
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import logging
+from typing import AsyncIterator
+
+import httpx
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Max number of upstream requests in flight at once (cash.rbc.ru + Bybit)
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", 8))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 20))
+
+# Shared pooled client. httpx.AsyncClient and asyncio.Semaphore are bound to
+# the event loop they are first used on, so we recreate them if the loop changes.
+_HTTP_CLIENT: httpx.AsyncClient | None = None
+_FETCH_SEMAPHORE: asyncio.Semaphore | None = None
+_CLIENT_LOOP: asyncio.AbstractEventLoop | None = None
+
+
+def _get_client() -> tuple[httpx.AsyncClient, asyncio.Semaphore]:
+    global _HTTP_CLIENT, _FETCH_SEMAPHORE, _CLIENT_LOOP
+    loop = asyncio.get_running_loop()
+    if _HTTP_CLIENT is None or _CLIENT_LOOP is not loop or _HTTP_CLIENT.is_closed:
+        _HTTP_CLIENT = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=FETCH_CONCURRENCY,
+                                max_keepalive_connections=FETCH_CONCURRENCY),
+        )
+        _FETCH_SEMAPHORE = asyncio.Semaphore(FETCH_CONCURRENCY)
+        _CLIENT_LOOP = loop
+    return _HTTP_CLIENT, _FETCH_SEMAPHORE
+
+
+async def fetch_text(url: str) -> str:
+    client, semaphore = _get_client()
+    async with semaphore:
+        response = await client.get(url)
+    response.raise_for_status()
+    return response.text
+
+
+async def fetch_text_conditional(url: str, etag: str | None = None,
+                                 last_modified: str | None = None) -> tuple[str | None, str | None, str | None]:
+    """GET with If-None-Match / If-Modified-Since. Returns (text, etag,
+    last_modified), text is None when the server answered 304 Not Modified"""
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    client, semaphore = _get_client()
+    async with semaphore:
+        response = await client.get(url, headers=headers)
+    if response.status_code == 304:
+        return None, etag, last_modified
+    response.raise_for_status()
+    return response.text, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+
+async def post_json(url: str, payload: dict, headers: dict | None = None) -> dict:
+    client, semaphore = _get_client()
+    async with semaphore:
+        response = await client.post(url, json=payload, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
+
+async def stream_post(url: str, payload: dict, headers: dict | None = None) -> AsyncIterator[bytes]:
+    """Yield the response body in chunks instead of loading it at once"""
+    client, semaphore = _get_client()
+    async with semaphore:
+        async with client.stream('POST', url, json=payload, headers=headers) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                yield chunk
+
+
+async def close_http_client() -> None:
+    global _HTTP_CLIENT, _CLIENT_LOOP
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
+        _CLIENT_LOOP = None
+        logger.info("HTTP client closed")
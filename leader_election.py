@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+import uuid
+
+from dotenv import load_dotenv
+
+import redis_client
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# The leader must renew its lease within this time, otherwise another instance takes over
+LEADER_LEASE_TTL_MS = int(os.getenv("LEADER_LEASE_TTL_MS", 10000))
+# How often the leader renews the lease and followers try to take it
+LEADER_RENEW_INTERVAL = float(os.getenv("LEADER_RENEW_INTERVAL", LEADER_LEASE_TTL_MS / 3000))
+
+# Extend / delete the lease only if it still belongs to us
+_RENEW_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaderLease:
+    """Elects one bot instance to do the scraping.
+
+    The leader holds a Redis key with a TTL and keeps extending it; the
+    other instances retry SET NX on every tick, so when the leader dies one
+    of them takes over within LEADER_LEASE_TTL_MS. Without Redis there is
+    nobody to coordinate with and every instance is its own leader."""
+
+    def __init__(self, name: str, lease_ttl_ms: int = LEADER_LEASE_TTL_MS,
+                 renew_interval: float = LEADER_RENEW_INTERVAL) -> None:
+        self.key = f"leader:{name}"
+        self.lease_ttl_ms = lease_ttl_ms
+        self.renew_interval = renew_interval
+        self.token = uuid.uuid4().hex
+        self._is_leader = False
+        self._became_leader = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.stats = {'acquired': 0, 'lost': 0}
+
+    @property
+    def is_leader(self) -> bool:
+        return self._is_leader or not redis_client.REDIS_AVAILABLE
+
+    def _set_leader(self, is_leader: bool) -> None:
+        if is_leader and not self._is_leader:
+            self.stats['acquired'] += 1
+            logger.info("Became leader of %s", self.key)
+            self._became_leader.set()
+        elif not is_leader and self._is_leader:
+            self.stats['lost'] += 1
+            logger.warning("Lost leadership of %s", self.key)
+            self._became_leader.clear()
+        self._is_leader = is_leader
+
+    async def try_acquire(self) -> bool:
+        """Take or renew the lease, returns whether we are the leader now"""
+        if not redis_client.REDIS_AVAILABLE:
+            return True
+        try:
+            if self._is_leader:
+                held = await redis_client.REDIS_CLIENT.eval(_RENEW_LEASE_SCRIPT, 1, self.key,
+                                                            self.token, self.lease_ttl_ms)
+            else:
+                held = await redis_client.REDIS_CLIENT.set(self.key, self.token, nx=True,
+                                                           px=self.lease_ttl_ms)
+        except Exception as e:
+            # Can`t prove we still hold the lease, step down
+            logger.error("Couldn`t renew leader lease %s: %s", self.key, e)
+            held = False
+        self._set_leader(bool(held))
+        return self._is_leader
+
+    async def wait_for_leadership(self) -> None:
+        if self.is_leader:
+            return
+        await self._became_leader.wait()
+
+    async def run(self) -> None:
+        while True:
+            await self.try_acquire()
+            await asyncio.sleep(self.renew_interval)
+
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            # The Event must belong to the running loop
+            self._became_leader = asyncio.Event()
+            await self.try_acquire()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Stop renewing and release the lease, so a follower takes over right away"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._is_leader and redis_client.REDIS_AVAILABLE:
+            try:
+                await redis_client.REDIS_CLIENT.eval(_RELEASE_LEASE_SCRIPT, 1, self.key, self.token)
+            except Exception as e:
+                logger.error("Couldn`t release leader lease %s: %s", self.key, e)
+        self._set_leader(False)
+
+
+# Only the leader scrapes cash.rbc.ru and Bybit, the others read the caches
+SCRAPER_LEADER = LeaderLease("scraper")
@@ -0,0 +1,53 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+class LocalCache:
+    """Bounded in-process LRU cache with TTL.
+
+    Every entry is tagged with the version stamp of its Redis key. Within the
+    TTL an entry is served without touching Redis; after it the caller compares
+    the stamp with Redis and either renews the entry or reloads it."""
+
+    def __init__(self, max_items: int, ttl: float) -> None:
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items: OrderedDict[str, tuple[float, Any, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> tuple[Any, Any, bool] | None:
+        """Return (value, version, is_fresh) or None"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            checked_at, version, value = item
+            return value, version, time.monotonic() - checked_at < self.ttl
+
+    def set(self, key: str, value: Any, version: Any) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic(), version, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def touch(self, key: str) -> None:
+        """Mark entry as just checked against Redis"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items[key] = (time.monotonic(), item[1], item[2])
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
@@ -1,9 +1,22 @@
-from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler
+from telegram.ext import ApplicationBuilder, Application, CommandHandler, CallbackQueryHandler
+import multiprocessing
 import os
+import signal
+import socket
 from dotenv import load_dotenv
 from prompts import *
-from handlers import handle_callback, start
-from db_manager import db_init
+from handlers import handle_callback, start, usdt_amount, history, alert, send_alert_notifications, \
+                     broadcast, outbox_status
+from db_manager import db_init, db_close
+from quotes_refresher import QUOTES_REFRESHER
+from leader_election import SCRAPER_LEADER
+from usage_counters import USAGE_COUNTERS
+from user_registry import USER_REGISTRY
+from quotes_history import QUOTES_HISTORY
+from bot_logic import render_history_messages
+from rate_alerts import ALERTS
+from outbox import OUTBOX
+from http_client import close_http_client
 import redis_client
 import logging
 
@@ -22,20 +35,135 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 TOKEN = os.getenv("TEST_BOT_TOKEN")
 
+# polling (default) or webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Public HTTPS URL Telegram sends updates to is WEBHOOK_URL + WEBHOOK_PATH
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Max simultaneous HTTPS connections Telegram opens to the webhook (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 100))
+# Processes sharing the webhook port, the kernel balances connections between them
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 1))
+# Updates processed at once by one webhook process
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", 64))
 
-# Build and run the bot
-def main():
-    logging.info("Entry point...")
-    db_init()
-    redis_client.redis_client_init()
-    app = ApplicationBuilder().token(TOKEN).build()
+
+async def on_startup(app) -> None:
+    await redis_client.redis_client_init()
+    await USER_REGISTRY.warm()
+    # Refresh quotes in background so user requests are served from cache,
+    # only on the instance holding the scraper lease
+    await SCRAPER_LEADER.start()
+    QUOTES_REFRESHER.start()
+    # Request counters are buffered and written to DB in batches
+    USAGE_COUNTERS.start()
+    USER_REGISTRY.start()
+    # Every history flush updates the rollups, then the history replies are re-rendered
+    QUOTES_HISTORY.on_flushed = render_history_messages
+    QUOTES_HISTORY.start()
+    # Alerts are checked after every refresh against subscriptions kept in memory
+    ALERTS.notify = send_alert_notifications
+    await ALERTS.reload()
+    ALERTS.start()
+    # Alerts and broadcasts are queued in Redis and sent by the leader within Telegram limits
+    OUTBOX.bot = app.bot
+    OUTBOX.start()
+
+
+async def on_shutdown(app) -> None:
+    await QUOTES_REFRESHER.stop()
+    await ALERTS.stop()
+    await OUTBOX.stop()
+    await SCRAPER_LEADER.stop()
+    await close_http_client()
+    # Flush queued users and remaining counters while the DB pool is still open
+    await USER_REGISTRY.stop()
+    await USAGE_COUNTERS.stop()
+    await QUOTES_HISTORY.stop()
+    db_close()
+    await redis_client.redis_client_close()
+
+
+def build_application(concurrent_updates: int | bool = False) -> Application:
+    app = ApplicationBuilder().token(TOKEN)\
+        .concurrent_updates(concurrent_updates)\
+        .post_init(on_startup)\
+        .post_shutdown(on_shutdown)\
+        .build()
     app.add_handler(CallbackQueryHandler(handle_callback))
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("usdt", usdt_amount))
+    app.add_handler(CommandHandler("history", history))
+    app.add_handler(CommandHandler("alert", alert))
+    app.add_handler(CommandHandler("broadcast", broadcast))
+    app.add_handler(CommandHandler("outbox", outbox_status))
+    return app
+
+
+def _bind_webhook_socket() -> socket.socket:
+    """TCP socket every worker binds on its own; SO_REUSEPORT lets them share the port"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((WEBHOOK_LISTEN, WEBHOOK_PORT))
+    sock.listen(socket.SOMAXCONN)
+    sock.setblocking(False)
+    return sock
+
 
-    logger.info("Bot is running....")
+def run_webhook_worker(worker_id: int = 0) -> None:
+    logger.info("Webhook worker %s starting on port %s", worker_id, WEBHOOK_PORT)
+    # Every process needs its own DB connections
+    db_init()
+    app = build_application(CONCURRENT_UPDATES)
+    app.run_webhook(
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        # PTB accepts an already bound socket here, not only a unix socket path
+        unix=_bind_webhook_socket(),
+    )
+
+
+def run_webhook() -> None:
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL must be set in webhook mode")
+    if WEBHOOK_WORKERS <= 1:
+        run_webhook_worker()
+        return
+
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_webhook_worker, args=(worker_id,), name=f"webhook-{worker_id}")
+               for worker_id in range(WEBHOOK_WORKERS)]
+    for worker in workers:
+        worker.start()
+
+    def _stop_workers(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    signal.signal(signal.SIGTERM, _stop_workers)
+    signal.signal(signal.SIGINT, _stop_workers)
+    for worker in workers:
+        worker.join()
+
+
+# Build and run the bot
+def main():
+    logger.info("Entry point...")
+    logger.info("Bot is running in %s mode....", BOT_MODE)
 
-    print("Bot is running...")
-    app.run_polling()  # ❗ This is NOT awaited — it handles its own loop
+    if BOT_MODE == "webhook":
+        run_webhook()
+    else:
+        db_init()
+        app = build_application()
+        app.run_polling()  # ❗ This is NOT awaited — it handles its own loop
 
 
 if __name__ == "__main__":
@@ -4,6 +4,11 @@ from enum import Enum
 from typing import TypedDict, Optional
 
 
+# Columns of the merged buy/sell quotes table, in display order
+QUOTES_COLUMNS = ["currency", "bank", "buy_quote", "sell_quote", "spread",
+                  "spread_percent", "avg_price",  "time", "commissions"]
+
+
 @dataclass
 class QuotesData:
     banks_names: list[str]
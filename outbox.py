@@ -0,0 +1,392 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+import uuid
+from collections import deque
+
+from dotenv import load_dotenv
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import redis_client
+from leader_election import SCRAPER_LEADER
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Telegram allows about 30 messages per second for a bot and 1 per second in one chat
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", 25))
+OUTBOX_BURST = int(os.getenv("OUTBOX_BURST", 25))
+OUTBOX_PER_CHAT_INTERVAL = float(os.getenv("OUTBOX_PER_CHAT_INTERVAL", 1))
+# Messages taken from the queue at once, sent concurrently to different chats
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 100))
+# Network errors are retried with delays of OUTBOX_RETRY_BASE_DELAY * 2 ** attempt
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 5))
+OUTBOX_RETRY_BASE_DELAY = float(os.getenv("OUTBOX_RETRY_BASE_DELAY", 1))
+# How often the dispatcher logs its metrics while it has work
+OUTBOX_METRICS_INTERVAL = float(os.getenv("OUTBOX_METRICS_INTERVAL", 60))
+
+OUTBOX_QUEUE_KEY = "outbox:queue"
+# Messages waiting for a retry or for their chat, scored by the time they are due
+OUTBOX_DELAYED_KEY = "outbox:delayed"
+# Messages taken by a dispatcher and not finished yet, one list per dispatcher
+OUTBOX_PROCESSING_KEY = "outbox:processing:{worker_id}"
+# Dispatchers that may have left messages in their processing lists
+OUTBOX_WORKERS_KEY = "outbox:workers"
+
+# Move due delayed messages to the head of the queue in one step
+_PROMOTE_DUE_SCRIPT = """
+local due = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #due > 0 then
+    redis.call('zrem', KEYS[1], unpack(due))
+    for i = #due, 1, -1 do
+        redis.call('lpush', KEYS[2], due[i])
+    end
+end
+return #due
+"""
+
+# Move up to ARGV[1] messages from the head of the queue to the processing list
+_TAKE_SCRIPT = """
+local taken = redis.call('lrange', KEYS[1], 0, ARGV[1] - 1)
+if #taken > 0 then
+    redis.call('ltrim', KEYS[1], #taken, -1)
+    redis.call('rpush', KEYS[2], unpack(taken))
+end
+return taken
+"""
+
+# Put the whole processing list back at the head of the queue, keeping the order
+_REQUEUE_SCRIPT = """
+local taken = redis.call('lrange', KEYS[1], 0, -1)
+for i = #taken, 1, -1 do
+    redis.call('lpush', KEYS[2], taken[i])
+end
+redis.call('del', KEYS[1])
+return #taken
+"""
+
+
+class TokenBucket:
+    """Allows rate acquisitions per second on average and burst at once"""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def drain(self) -> None:
+        """Forget saved up tokens, used after Telegram asked us to slow down"""
+        self._tokens = 0
+        self._updated = time.monotonic()
+
+
+class Outbox:
+    """Outgoing message queue for alerts and broadcasts.
+
+    Anyone enqueues; messages are kept in Redis so they survive restarts,
+    and only the scraper leader drains them, so the bot-wide Telegram limit
+    is shared by one token bucket. Messages to one chat reserve send slots
+    OUTBOX_PER_CHAT_INTERVAL apart and wait in the delayed set meanwhile. On RetryAfter the whole dispatcher pauses
+    for the time Telegram asked; network errors are retried with backoff,
+    blocked or deleted chats are dropped. Without Redis the queue is local.
+
+    A taken message stays in the dispatcher`s processing list until it was
+    sent, dropped or rescheduled. Lists of stopped dispatchers go back to
+    the queue when a dispatcher starts, so a message is sent at least once."""
+
+    def __init__(self, rate: float = OUTBOX_GLOBAL_RATE, burst: int = OUTBOX_BURST,
+                 per_chat_interval: float = OUTBOX_PER_CHAT_INTERVAL, batch_size: int = OUTBOX_BATCH_SIZE,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS, retry_base_delay: float = OUTBOX_RETRY_BASE_DELAY,
+                 metrics_interval: float = OUTBOX_METRICS_INTERVAL) -> None:
+        self.bucket = TokenBucket(rate, burst)
+        self.per_chat_interval = per_chat_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.metrics_interval = metrics_interval
+        # Set from main, the dispatcher does nothing without it
+        self.bot = None
+        self.worker_id = uuid.uuid4().hex
+        self._local_queue: deque[str] = deque()
+        self._local_processing: list[str] = []
+        self._local_delayed: list[tuple[float, int, str]] = []
+        # Unix time from which the next message may go to the chat
+        self._chat_next_slot: dict[int, float] = {}
+        self._paused_until = 0.0
+        self._sent_times: deque[float] = deque()
+        self._task: asyncio.Task | None = None
+        self.stats = {'enqueued': 0, 'sent': 0, 'retried': 0, 'retry_after': 0, 'dropped': 0, 'failed': 0}
+
+    # Queue storage: Redis when available, otherwise this process
+
+    async def _push(self, raws: list[str], front: bool = False) -> None:
+        if redis_client.REDIS_AVAILABLE:
+            if front:
+                await redis_client.REDIS_CLIENT.lpush(OUTBOX_QUEUE_KEY, *reversed(raws))
+            else:
+                await redis_client.REDIS_CLIENT.rpush(OUTBOX_QUEUE_KEY, *raws)
+        elif front:
+            self._local_queue.extendleft(reversed(raws))
+        else:
+            self._local_queue.extend(raws)
+
+    async def _take(self, count: int) -> list[str]:
+        """Move messages from the queue to our processing list"""
+        if redis_client.REDIS_AVAILABLE:
+            return await redis_client.REDIS_CLIENT.eval(
+                _TAKE_SCRIPT, 2, OUTBOX_QUEUE_KEY, OUTBOX_PROCESSING_KEY.format(worker_id=self.worker_id), count)
+        taken = [self._local_queue.popleft() for _ in range(min(count, len(self._local_queue)))]
+        self._local_processing.extend(taken)
+        return taken
+
+    async def _ack(self, raws: list[str]) -> None:
+        """The messages were sent, dropped or queued again"""
+        if redis_client.REDIS_AVAILABLE:
+            pipe = redis_client.REDIS_CLIENT.pipeline()
+            for raw in raws:
+                pipe.lrem(OUTBOX_PROCESSING_KEY.format(worker_id=self.worker_id), 1, raw)
+            await pipe.execute()
+        else:
+            for raw in raws:
+                self._local_processing.remove(raw)
+
+    async def _requeue_processing(self, worker_id: str) -> int:
+        if redis_client.REDIS_AVAILABLE:
+            return await redis_client.REDIS_CLIENT.eval(
+                _REQUEUE_SCRIPT, 2, OUTBOX_PROCESSING_KEY.format(worker_id=worker_id), OUTBOX_QUEUE_KEY)
+        taken, self._local_processing = self._local_processing, []
+        self._local_queue.extendleft(reversed(taken))
+        return len(taken)
+
+    async def recover(self) -> int:
+        """Put messages taken by stopped dispatchers back at the head of the
+        queue and register this one, returns the number of messages"""
+        if not redis_client.REDIS_AVAILABLE:
+            recovered = await self._requeue_processing(self.worker_id)
+        else:
+            recovered = 0
+            for worker_id in await redis_client.REDIS_CLIENT.smembers(OUTBOX_WORKERS_KEY):
+                recovered += await self._requeue_processing(worker_id)
+                if worker_id != self.worker_id:
+                    await redis_client.REDIS_CLIENT.srem(OUTBOX_WORKERS_KEY, worker_id)
+            await redis_client.REDIS_CLIENT.sadd(OUTBOX_WORKERS_KEY, self.worker_id)
+        if recovered:
+            logger.warning("Requeued %s outbox messages left by stopped dispatchers", recovered)
+        return recovered
+
+    async def _defer(self, raw: str, due: float) -> None:
+        if redis_client.REDIS_AVAILABLE:
+            await redis_client.REDIS_CLIENT.zadd(OUTBOX_DELAYED_KEY, {raw: due})
+        else:
+            heapq.heappush(self._local_delayed, (due, id(raw), raw))
+
+    async def _promote_due(self) -> int:
+        now = time.time()
+        if redis_client.REDIS_AVAILABLE:
+            return await redis_client.REDIS_CLIENT.eval(_PROMOTE_DUE_SCRIPT, 2, OUTBOX_DELAYED_KEY,
+                                                        OUTBOX_QUEUE_KEY, now, self.batch_size)
+        due = []
+        while self._local_delayed and self._local_delayed[0][0] <= now and len(due) < self.batch_size:
+            due.append(heapq.heappop(self._local_delayed)[2])
+        self._local_queue.extendleft(reversed(due))
+        return len(due)
+
+    async def depth(self) -> tuple[int, int]:
+        """(queued, delayed) number of messages"""
+        if redis_client.REDIS_AVAILABLE:
+            return (await redis_client.REDIS_CLIENT.llen(OUTBOX_QUEUE_KEY),
+                    await redis_client.REDIS_CLIENT.zcard(OUTBOX_DELAYED_KEY))
+        return len(self._local_queue), len(self._local_delayed)
+
+    # Producers
+
+    async def enqueue(self, messages: list[tuple[int, str]], chunk_size: int = 1000) -> int:
+        """Queue (chat_id, text) messages, returns how many were queued"""
+        queued = 0
+        for start in range(0, len(messages), chunk_size):
+            # The id keeps equal messages apart in the delayed set
+            raws = [json.dumps({'id': uuid.uuid4().hex, 'chat_id': chat_id, 'text': text, 'attempts': 0},
+                               ensure_ascii=False)
+                    for chat_id, text in messages[start:start + chunk_size]]
+            try:
+                await self._push(raws)
+            except Exception as e:
+                logger.error("Couldn`t queue %s messages: %s", len(messages) - queued, e)
+                break
+            queued += len(raws)
+        self.stats['enqueued'] += queued
+        return queued
+
+    async def broadcast(self, chat_ids, text: str) -> int:
+        return await self.enqueue([(chat_id, text) for chat_id in chat_ids])
+
+    # Dispatcher
+
+    async def _retry(self, message: dict, delay: float) -> None:
+        await self._defer(json.dumps(message, ensure_ascii=False), time.time() + delay)
+
+    async def _deliver(self, message: dict) -> None:
+        try:
+            await self.bot.send_message(chat_id=message['chat_id'], text=message['text'])
+            self.stats['sent'] += 1
+            self._sent_times.append(time.monotonic())
+        except RetryAfter as e:
+            # Telegram wants the whole bot to slow down, the attempt is not counted
+            delay = float(getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)())
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self.bucket.drain()
+            self.stats['retry_after'] += 1
+            await self._retry(message, delay)
+        except (Forbidden, BadRequest) as e:
+            # Blocked the bot or the chat is gone, retrying won`t help
+            self.stats['dropped'] += 1
+            logger.info("Dropped message to chat %s: %s", message['chat_id'], e)
+        except NetworkError as e:
+            message['attempts'] += 1
+            if message['attempts'] >= self.max_attempts:
+                self.stats['failed'] += 1
+                logger.error("Couldn`t send message to chat %s after %s attempts: %s",
+                             message['chat_id'], message['attempts'], e)
+                return
+            self.stats['retried'] += 1
+            await self._retry(message, self.retry_base_delay * 2 ** (message['attempts'] - 1))
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.error("Couldn`t send message to chat %s: %s", message['chat_id'], e)
+
+    async def _deliver_and_ack(self, raw: str, message: dict) -> None:
+        await self._deliver(message)
+        await self._ack([raw])
+
+    async def dispatch_batch(self) -> int:
+        """Send one batch from the queue, returns the number of messages taken"""
+        await self._promote_due()
+        raws = await self._take(self.batch_size)
+        deliveries = []
+        try:
+            while raws:
+                now = time.monotonic()
+                if self._paused_until > now:
+                    # A send hit RetryAfter, the rest waits for the pause
+                    await self._push(raws, front=True)
+                    await self._ack(raws)
+                    raws = []
+                    break
+                raw = raws[0]
+                message = json.loads(raw)
+                chat_id = message['chat_id']
+                # Every message of a chat reserves its own send slot, so they keep their order
+                slot = message.pop('slot', None)
+                if slot is None:
+                    slot = max(time.time(), self._chat_next_slot.get(chat_id, 0))
+                    self._chat_next_slot[chat_id] = slot + self.per_chat_interval
+                if slot > time.time():
+                    message['slot'] = slot
+                    await self._defer(json.dumps(message, ensure_ascii=False), slot)
+                    await self._ack([raw])
+                    raws.pop(0)
+                    continue
+                await self.bucket.acquire()
+                self._chat_next_slot[chat_id] = max(self._chat_next_slot.get(chat_id, 0),
+                                                    time.time() + self.per_chat_interval)
+                deliveries.append(asyncio.create_task(self._deliver_and_ack(raw, message)))
+                raws.pop(0)
+            await asyncio.gather(*deliveries)
+        except asyncio.CancelledError:
+            # Stopping: whatever is not finished, handed out or not, goes back to the queue
+            for delivery in deliveries:
+                delivery.cancel()
+            await asyncio.gather(*deliveries, return_exceptions=True)
+            await self._requeue_processing(self.worker_id)
+            raise
+        self._forget_idle_chats()
+        return len(deliveries)
+
+    def _forget_idle_chats(self) -> None:
+        if len(self._chat_next_slot) > 10 * self.batch_size:
+            now = time.time()
+            self._chat_next_slot = {chat_id: slot for chat_id, slot in self._chat_next_slot.items() if slot > now}
+        now = time.monotonic()
+        while self._sent_times and self._sent_times[0] < now - 60:
+            self._sent_times.popleft()
+
+    async def get_metrics(self) -> dict:
+        try:
+            queued, delayed = await self.depth()
+        except Exception as e:
+            logger.error("Couldn`t get outbox depth: %s", e)
+            queued = delayed = None
+        self._forget_idle_chats()
+        return {
+            "queued": queued,
+            "delayed": delayed,
+            "sent_per_second": round(len(self._sent_times) / 60, 2),
+            "paused_for": max(round(self._paused_until - time.monotonic(), 1), 0),
+            "dispatching": self._task is not None and not self._task.done() and SCRAPER_LEADER.is_leader,
+            **self.stats,
+        }
+
+    async def run(self) -> None:
+        last_metrics = time.monotonic()
+        recovered = False
+        while True:
+            if not SCRAPER_LEADER.is_leader:
+                await SCRAPER_LEADER.wait_for_leadership()
+                recovered = False
+            if not recovered:
+                try:
+                    await self.recover()
+                    recovered = True
+                except Exception as e:
+                    logger.error("Couldn`t recover outbox messages: %s", e)
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            try:
+                taken = await self.dispatch_batch() if self.bot is not None else 0
+            except Exception as e:
+                logger.error("Couldn`t dispatch outbox messages: %s", e)
+                taken = 0
+            if time.monotonic() - last_metrics > self.metrics_interval and self.stats['enqueued']:
+                logger.info("Outbox: %s", await self.get_metrics())
+                last_metrics = time.monotonic()
+            if not taken:
+                await asyncio.sleep(0.5)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+            logger.info("Outbox dispatcher started, %s messages/s", self.bucket.rate)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logger.info("Outbox stopped: %s", await self.get_metrics())
+
+
+# Shared outbox used by rate alerts and /broadcast, dispatched on the leader
+OUTBOX = Outbox()
@@ -37,4 +37,63 @@ prompt_messages_crypto_or_cash = { 'en' : "Choose cash or crypto",\
 cities_prompt = {
     'MOSCOW': {'en': 'Moscow', 'ru' : 'Москва'},
     'SPB': {'en': 'SPB', 'ru' : 'Санкт-Петербург'},
-    }
\ No newline at end of file
+    }
+
+prompt_messages_usdt_side = { 'en' : "Choose the side of USDT stats:",\
+                              'ru' : "Выберите сторону статистики USDT:"}
+
+prompt_usdt_buy = { 'en' : "🟢 Buy USDT", 'ru' : "🟢 Покупка USDT"}
+
+prompt_usdt_sell = { 'en' : "🔴 Sell USDT", 'ru' : "🔴 Продажа USDT"}
+
+prompt_usdt_amount_usage = { 'en' : "Send the amount in RUB, e.g. /usdt 50000 or /usdt 50000 sell",\
+                             'ru' : "Укажите сумму в рублях, например /usdt 50000 или /usdt 50000 sell"}
+
+prompt_usdt_amount_price = { 'en' : "💰 USDT {side} for {amount:,.0f} RUB: {price:.2f} RUB on average among trusted sellers",\
+                             'ru' : "💰 USDT {side} на {amount:,.0f} RUB: в среднем {price:.2f} RUB у надежных продавцов"}
+
+prompt_usdt_amount_no_offers = { 'en' : "No trusted sellers accept {amount:,.0f} RUB right now.",\
+                                 'ru' : "Сейчас нет надежных продавцов на сумму {amount:,.0f} RUB."}
+
+prompt_history = { 'en' : "📈 History",\
+                   'ru' : "📈 История"}
+
+prompt_history_usage = { 'en' : "Usage: /history <currency>, e.g. /history USD. Choose a city with /start first.",\
+                         'ru' : "Использование: /history <валюта>, например /history USD. Сначала выберите город через /start."}
+
+prompt_history_title = { 'en' : "📈 {currency} in {city}",\
+                         'ru' : "📈 {currency} в городе {city}"}
+
+prompt_history_sections = { 'en' : {'10min': "Last 3 hours, every 10 min:", 'hour': "Last 24 hours, hourly:",
+                                    'day': "Last 7 days, min–max (avg):"},
+                            'ru' : {'10min': "Последние 3 часа, каждые 10 мин:", 'hour': "Последние 24 часа, по часам:",
+                                    'day': "Последние 7 дней, мин–макс (средн.):"}}
+
+prompt_history_metrics = { 'en' : {'buy': "💵 Buy", 'sell': "💴 Sell", 'spread': "📉 Spread"},
+                           'ru' : {'buy': "💵 Покупка", 'sell': "💴 Продажа", 'spread': "📉 Спред"}}
+
+prompt_history_no_data = { 'en' : "No quotes history has been collected for this currency yet.",\
+                           'ru' : "История курсов по этой валюте еще не собрана."}
+
+prompt_alert_usage = { 'en' : "Usage: /alert <currency> <buy|sell> <below|above> <price>, e.g. /alert USD sell below 90, "\
+                              "for the city chosen with /start. /alert off removes all your alerts.",\
+                       'ru' : "Использование: /alert <валюта> <buy|sell> <below|above> <цена>, например /alert USD sell below 90, "\
+                              "для города, выбранного через /start. /alert off удаляет все ваши уведомления."}
+
+prompt_alert_list = { 'en' : "Your alerts:\n{alerts}",\
+                      'ru' : "Ваши уведомления:\n{alerts}"}
+
+prompt_alert_saved = { 'en' : "🔔 Alert saved: {currency} {side} quote in {city} {direction} {threshold:.2f}",\
+                       'ru' : "🔔 Уведомление сохранено: курс {side} {currency} в городе {city} {direction} {threshold:.2f}"}
+
+prompt_alert_not_saved = { 'en' : "Couldn`t save the alert. You can have up to {max_alerts} alerts, try again later.",\
+                           'ru' : "Не удалось сохранить уведомление. Можно иметь не больше {max_alerts} уведомлений, попробуйте позже."}
+
+prompt_alert_removed = { 'en' : "🔕 All your alerts are removed.",\
+                         'ru' : "🔕 Все ваши уведомления удалены."}
+
+prompt_alert_directions = { 'en' : {'below': "below", 'above': "above"},
+                            'ru' : {'below': "ниже", 'above': "выше"}}
+
+prompt_alert_triggered = { 'en' : "🔔 {currency} {side} quote in {city} is {direction} {threshold:.2f}: {price:.2f} at {bank}",\
+                           'ru' : "🔔 Курс {side} {currency} в городе {city} {direction} {threshold:.2f}: {price:.2f} в банке {bank}"}
@@ -0,0 +1,156 @@
+import asyncio
+import io
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Awaitable, Callable
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from db_manager import copy_quotes_history_db, QUOTES_HISTORY_COLUMNS, QUOTES_ROLLUP_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+QUOTES_HISTORY_ENABLED = os.getenv("QUOTES_HISTORY_ENABLED", "1") == "1"
+# How often buffered quote tables are written to Postgres
+QUOTES_HISTORY_FLUSH_INTERVAL = float(os.getenv("QUOTES_HISTORY_FLUSH_INTERVAL", 30))
+# Max quote tables kept in memory while the DB is unavailable, oldest are dropped first
+QUOTES_HISTORY_MAX_PENDING = int(os.getenv("QUOTES_HISTORY_MAX_PENDING", 1000))
+
+# Rollup buckets are aligned to Moscow time, so a day is a Moscow calendar day
+ROLLUP_TIMEZONE = 'Europe/Moscow'
+ROLLUP_FREQUENCIES = {'10min': '10min', 'hour': 'h', 'day': 'D'}
+ROLLUP_SOURCE_COLUMNS = {'buy': 'buy_quote', 'sell': 'sell_quote', 'spread': 'spread'}
+
+
+def compute_quotes_rollups(df: pd.DataFrame) -> list[tuple]:
+    """Aggregate history rows into per (city, currency, granularity, bucket)
+    count/min/sum/max of every metric, rows in QUOTES_ROLLUP_COLUMNS order"""
+    if df.empty:
+        return []
+    values = pd.DataFrame({metric: pd.to_numeric(df[column], errors='coerce')
+                           for metric, column in ROLLUP_SOURCE_COLUMNS.items()})
+    values['city'] = df['city'].str.lower()
+    values['currency'] = df['currency'].str.upper()
+    scraped_at = pd.to_datetime(df['scraped_at'], utc=True).dt.tz_convert(ROLLUP_TIMEZONE)
+
+    parts = []
+    for granularity, frequency in ROLLUP_FREQUENCIES.items():
+        grouped = values.assign(granularity=granularity, bucket=scraped_at.dt.floor(frequency))\
+                        .groupby(['city', 'currency', 'granularity', 'bucket'])
+        parts.append(grouped.agg(**{f"{metric}_{agg}": (metric, agg)
+                                    for metric in ROLLUP_SOURCE_COLUMNS
+                                    for agg in ('count', 'min', 'sum', 'max')}))
+    rollups = pd.concat(parts).reset_index()[list(QUOTES_ROLLUP_COLUMNS)]
+    # NULL keeps LEAST/GREATEST of the stored bucket intact when a metric had no values
+    rollups = rollups.astype(object).where(rollups.notna(), None)
+    return [tuple(row) for row in rollups.itertuples(index=False, name=None)]
+
+
+class QuotesHistoryWriter:
+    """Collects every refreshed quote table and bulk loads them into the
+    quotes_history table with COPY from a background task, so the
+    refresh path only appends to a list. Every flush also merges the
+    rows into quotes_rollups and then awaits on_flushed with the
+    (city, currency) pairs that changed."""
+
+    def __init__(self, interval: float = QUOTES_HISTORY_FLUSH_INTERVAL,
+                 max_pending: int = QUOTES_HISTORY_MAX_PENDING,
+                 enabled: bool = QUOTES_HISTORY_ENABLED) -> None:
+        self.interval = interval
+        self.max_pending = max_pending
+        self.enabled = enabled
+        self._pending: list[pd.DataFrame] = []
+        self._lock = threading.Lock()
+        self._task: asyncio.Task | None = None
+        self._flushed_pairs: set[tuple[str, str]] = set()
+        self.on_flushed: Callable[[set[tuple[str, str]]], Awaitable[None]] | None = None
+        self.stats = {'recorded': 0, 'flushed_rows': 0, 'dropped': 0, 'failed_flushes': 0}
+
+    def record(self, city: str, df_merged: pd.DataFrame) -> None:
+        if not self.enabled or df_merged is None or df_merged.empty:
+            return
+        scraped_at = datetime.fromtimestamp(df_merged.attrs.get('fetched_at', datetime.now().timestamp()),
+                                            tz=timezone.utc)
+        df = df_merged.rename(columns={'time': 'quote_time'})\
+                      .assign(scraped_at=scraped_at, city=city.lower())
+        with self._lock:
+            self._pending.append(df)
+            self.stats['recorded'] += 1
+            if len(self._pending) > self.max_pending:
+                self._pending.pop(0)
+                self.stats['dropped'] += 1
+
+    def _take_pending(self) -> list[pd.DataFrame]:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+    def flush(self) -> int:
+        """COPY buffered tables into Postgres, returns the number of rows written"""
+        pending = self._take_pending()
+        if not pending:
+            return 0
+
+        df = pd.concat(pending, ignore_index=True)[list(QUOTES_HISTORY_COLUMNS)]
+        months = {scraped_at.date() for scraped_at in df['scraped_at'].unique()}
+        csv_buffer = io.StringIO()
+        df.to_csv(csv_buffer, header=False, index=False, date_format='%Y-%m-%d %H:%M:%S.%f%z')
+        csv_buffer.seek(0)
+
+        rollup_rows = compute_quotes_rollups(df)
+        if not copy_quotes_history_db(csv_buffer, months, rollup_rows=rollup_rows):
+            self.stats['failed_flushes'] += 1
+            with self._lock:
+                # Keep them for the next flush, still within the memory bound
+                self._pending = (pending + self._pending)[-self.max_pending:]
+            return 0
+
+        with self._lock:
+            self._flushed_pairs.update((row[0], row[1]) for row in rollup_rows)
+        self.stats['flushed_rows'] += len(df)
+        return len(df)
+
+    async def _flush(self) -> int:
+        rows = await asyncio.to_thread(self.flush)
+        with self._lock:
+            pairs, self._flushed_pairs = self._flushed_pairs, set()
+        if pairs and self.on_flushed is not None:
+            try:
+                await self.on_flushed(pairs)
+            except Exception as e:
+                logger.error("Couldn`t handle flushed quotes history: %s", e)
+        return rows
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.error("Couldn`t save quotes history: %s", e)
+
+    def start(self) -> None:
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self.run())
+            logger.info("Quotes history writer started, interval %s s", self.interval)
+
+    async def stop(self) -> None:
+        """Stop the writer and save what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        rows = await self._flush()
+        logger.info("Quotes history flushed on shutdown: %s rows, stats: %s", rows, self.stats)
+
+
+# Shared writer fed by bot_logic.refresh_quotes_df and started from main
+QUOTES_HISTORY = QuotesHistoryWriter()
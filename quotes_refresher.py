@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from bot_logic import refresh_quotes_single_flight, refresh_statistics, refresh_bybit_stats, get_cache_stats, \
+    get_refresh_stats, TTL_QUOTES_IN_REDIS, TTL_STATS_IN_REDIS, TTL_BYBIT_IN_REDIS, BYBIT_SIDES
+from rbc_parser import get_page_stats
+from models import CityCode, CurrencyCode
+from singleflight import SINGLE_FLIGHT
+from leader_election import SCRAPER_LEADER
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# How often all city/currency pairs are re-scraped. Must be shorter than the
+# Redis TTLs, otherwise users hit an empty cache between two refreshes.
+MIN_TTL_IN_REDIS = min(TTL_QUOTES_IN_REDIS, TTL_STATS_IN_REDIS, TTL_BYBIT_IN_REDIS)
+QUOTES_REFRESH_INTERVAL = int(os.getenv("QUOTES_REFRESH_INTERVAL", MIN_TTL_IN_REDIS // 2))
+
+
+class QuotesRefresher:
+    """Periodically scrapes every CityCode x CurrencyCode pair, the
+    statistics of every city and both sides of Bybit USDT stats into Redis,
+    so handlers only read the cache. With several bot instances only the
+    SCRAPER_LEADER refreshes, the others wait to take over."""
+
+    def __init__(self, interval: int = QUOTES_REFRESH_INTERVAL) -> None:
+        self.interval = interval
+        self.last_refresh: dict[str, datetime] = {}
+        self.failures: dict[str, int] = {}
+        self._task: asyncio.Task | None = None
+
+        if interval >= MIN_TTL_IN_REDIS:
+            logger.warning("Refresh interval %s s is not shorter than Redis TTL, "
+                           "cache will expire between refreshes", interval)
+
+    def _mark(self, key: str, ok: bool) -> None:
+        if ok:
+            self.last_refresh[key] = datetime.now()
+        else:
+            self.failures[key] = self.failures.get(key, 0) + 1
+
+    async def _refresh_pair(self, city_name: str, currency: CurrencyCode) -> pd.DataFrame | None:
+        key = f"{city_name}:{currency.name.lower()}"
+        try:
+            # Shares the scrape with handlers missing the same key right now
+            df = await refresh_quotes_single_flight(currency.name, city_name)
+            self._mark(key, ok=True)
+            return df
+        except Exception as e:
+            self._mark(key, ok=False)
+            logger.error("Couldn`t refresh quotes for %s: %s", key, e)
+            return None
+
+    async def refresh_city(self, city: CityCode) -> None:
+        city_name = city.name.lower()
+
+        await asyncio.gather(*[self._refresh_pair(city_name, currency) for currency in CurrencyCode])
+
+        key = f"statistics:{city_name}"
+        try:
+            # Every refreshed quote table has already updated the city aggregates
+            await refresh_statistics(city_name)
+            self._mark(key, ok=True)
+        except Exception as e:
+            self._mark(key, ok=False)
+            logger.error("Couldn`t refresh %s: %s", key, e)
+
+    async def refresh_bybit(self, side: str) -> None:
+        key = f"bybit:{side}"
+        try:
+            await refresh_bybit_stats(side)
+            self._mark(key, ok=True)
+        except Exception as e:
+            self._mark(key, ok=False)
+            logger.error("Couldn`t refresh %s: %s", key, e)
+
+    async def refresh_all(self) -> None:
+        await asyncio.gather(*[self.refresh_city(city) for city in CityCode],
+                             *[self.refresh_bybit(side) for side in BYBIT_SIDES])
+
+    async def run(self) -> None:
+        while True:
+            if not SCRAPER_LEADER.is_leader:
+                await SCRAPER_LEADER.wait_for_leadership()
+                logger.info("Refresher took over as scraper leader")
+            await self.refresh_all()
+            logger.info("Quotes refreshed: %s, no-op refreshes: %s, pages: %s, "
+                        "cache miss coalescing: %s, cache tiers: %s",
+                        self.get_status(), get_refresh_stats(), get_page_stats(),
+                        SINGLE_FLIGHT.get_stats(), get_cache_stats())
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+            logger.info("Quotes refresher started, interval %s s", self.interval)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_status(self) -> dict:
+        return {
+            "interval": self.interval,
+            "running": self._task is not None and not self._task.done(),
+            "leader": SCRAPER_LEADER.is_leader,
+            "last_refresh": {k: v.isoformat(timespec='seconds') for k, v in self.last_refresh.items()},
+            "failures": dict(self.failures),
+        }
+
+
+# Shared refresher started from main
+QUOTES_REFRESHER = QuotesRefresher()
@@ -0,0 +1,100 @@
+import json
+import os
+import time
+
+import msgpack
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from models import QUOTES_COLUMNS
+
+load_dotenv()
+
+# Which format is used to write quote tables to Redis. Both are always readable,
+# so the setting can be switched without flushing the cache.
+QUOTES_SERIALIZER = os.getenv("QUOTES_SERIALIZER", "msgpack")
+
+
+class JsonQuotesSerializer:
+    """Original format: {"fetched_at": ..., "data": df.to_json(orient='records')}"""
+
+    name = 'json'
+
+    def dumps(self, df: pd.DataFrame) -> bytes:
+        fetched_at = df.attrs.get('fetched_at', time.time())
+        # Records are already JSON, so wrap them instead of encoding twice
+        return f'{{"fetched_at": {fetched_at}, "data": {df.to_json(orient="records")}}}'.encode()
+
+    def loads(self, data: bytes) -> pd.DataFrame:
+        cached = json.loads(data)
+        df = pd.DataFrame.from_records(cached['data'], columns=QUOTES_COLUMNS)
+        df['time'] = pd.to_datetime(df['time'], unit='ms', utc=True).dt.tz_convert('Europe/Moscow')
+        df.attrs['fetched_at'] = cached['fetched_at']
+        return df
+
+
+class MsgpackQuotesSerializer:
+    """Columnar msgpack format. Numeric and bool columns are stored as raw
+    little-endian buffers, tz-aware datetimes as int64 UTC nanoseconds plus the
+    tz name, everything else as a msgpack list. Dtypes and column order
+    survive the round trip."""
+
+    name = 'msgpack'
+    SCHEMA_VERSION = 1
+
+    def dumps(self, df: pd.DataFrame) -> bytes:
+        columns = []
+        for name in df.columns:
+            series = df[name]
+            if isinstance(series.dtype, pd.DatetimeTZDtype):
+                values = pd.DatetimeIndex(series).as_unit('ns').asi8.astype('<i8').tobytes()
+                columns.append([name, 'datetime', str(series.dt.tz), values])
+            elif series.dtype.kind in 'fiub':
+                dtype = series.dtype.newbyteorder('<') if series.dtype.itemsize > 1 else series.dtype
+                values = np.ascontiguousarray(series.to_numpy(), dtype=dtype).tobytes()
+                columns.append([name, 'array', dtype.str, values])
+            else:
+                columns.append([name, 'list', None, series.tolist()])
+
+        return msgpack.packb({
+            'v': self.SCHEMA_VERSION,
+            'fetched_at': df.attrs.get('fetched_at', time.time()),
+            'columns': columns,
+        }, use_bin_type=True)
+
+    def loads(self, data: bytes) -> pd.DataFrame:
+        cached = msgpack.unpackb(data, raw=False)
+        if cached.get('v') != self.SCHEMA_VERSION:
+            raise ValueError(f"Unsupported quotes schema version {cached.get('v')}")
+
+        values = {}
+        for name, kind, dtype, payload in cached['columns']:
+            if kind == 'datetime':
+                values[name] = pd.DatetimeIndex(np.frombuffer(payload, dtype='<i8').view('M8[ns]'))\
+                                 .tz_localize('UTC').tz_convert(dtype)
+            elif kind == 'array':
+                values[name] = np.frombuffer(payload, dtype=dtype)
+            else:
+                values[name] = np.array(payload, dtype=object)
+
+        df = pd.DataFrame(values)
+        df.attrs['fetched_at'] = cached['fetched_at']
+        return df
+
+
+SERIALIZERS = {
+    JsonQuotesSerializer.name: JsonQuotesSerializer(),
+    MsgpackQuotesSerializer.name: MsgpackQuotesSerializer(),
+}
+
+
+def dumps_quotes(df: pd.DataFrame, serializer: str = QUOTES_SERIALIZER) -> bytes:
+    return SERIALIZERS[serializer].dumps(df)
+
+
+def loads_quotes(data: bytes) -> pd.DataFrame:
+    # JSON payloads always start with '{', msgpack maps never do
+    if data[:1] == b'{':
+        return SERIALIZERS['json'].loads(data)
+    return SERIALIZERS['msgpack'].loads(data)
@@ -0,0 +1,343 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+import redis_client
+from db_manager import add_alert_subscription_db, delete_alert_subscriptions_db, load_alert_subscriptions_db
+from leader_election import SCRAPER_LEADER
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# How often every instance checks whether subscriptions changed elsewhere
+ALERTS_RELOAD_INTERVAL = float(os.getenv("ALERTS_RELOAD_INTERVAL", 10))
+ALERTS_MAX_PER_USER = int(os.getenv("ALERTS_MAX_PER_USER", 10))
+
+ALERT_SIDES = ('buy', 'sell')
+ALERT_DIRECTIONS = ('below', 'above')
+# Bumped on every subscription change, instances reload when it differs from theirs
+ALERTS_VERSION_KEY = "alerts:version"
+# Ids of subscriptions notified for the current crossing, so restarts don`t notify again
+ALERTS_FIRED_KEY = "alerts:fired"
+
+
+@dataclass
+class AlertNotification:
+    user_id: int
+    lang: str
+    city: str
+    currency: str
+    side: str
+    direction: str
+    threshold: float
+    price: float
+    bank: str
+
+
+@dataclass
+class ThresholdArray:
+    """Subscriptions of one (city, currency, side, direction), sorted by threshold.
+    fired marks subscriptions already notified for the current crossing."""
+    thresholds: np.ndarray
+    ids: np.ndarray
+    user_ids: np.ndarray
+    langs: np.ndarray
+    fired: np.ndarray
+
+    @classmethod
+    def build(cls, ids, user_ids, langs, thresholds, fired_ids: set[int] = frozenset()) -> "ThresholdArray":
+        order = np.argsort(thresholds, kind='stable')
+        ids = np.asarray(ids, dtype=np.int64)[order]
+        return cls(thresholds=np.asarray(thresholds, dtype=float)[order],
+                   ids=ids,
+                   user_ids=np.asarray(user_ids, dtype=np.int64)[order],
+                   langs=np.asarray(langs, dtype=object)[order],
+                   fired=np.isin(ids, list(fired_ids)))
+
+    def insert(self, subscription_id: int, user_id: int, lang: str, threshold: float) -> None:
+        position = np.searchsorted(self.thresholds, threshold, side='right')
+        self.thresholds = np.insert(self.thresholds, position, threshold)
+        self.ids = np.insert(self.ids, position, subscription_id)
+        self.user_ids = np.insert(self.user_ids, position, user_id)
+        self.langs = np.insert(self.langs, position, lang)
+        self.fired = np.insert(self.fired, position, False)
+
+    def remove_user(self, user_id: int) -> None:
+        keep = self.user_ids != user_id
+        self.thresholds, self.ids, self.user_ids = self.thresholds[keep], self.ids[keep], self.user_ids[keep]
+        self.langs, self.fired = self.langs[keep], self.fired[keep]
+
+    def crossed(self, price: float, direction: str) -> np.ndarray:
+        """Positions of newly crossed subscriptions, closest threshold to the price first"""
+        active = np.zeros(len(self.thresholds), dtype=bool)
+        if direction == 'below':
+            # price < threshold: a suffix of the sorted thresholds
+            active[np.searchsorted(self.thresholds, price, side='right'):] = True
+        else:
+            # price > threshold: a prefix
+            active[:np.searchsorted(self.thresholds, price, side='left')] = True
+        new = np.flatnonzero(active & ~self.fired)
+        # Subscriptions whose condition no longer holds are re-armed
+        self.fired = active
+        return new if direction == 'below' else new[::-1]
+
+
+class AlertEngine:
+    """Threshold rate alerts checked after every quote refresh.
+
+    Subscriptions live in Postgres and in memory as sorted threshold arrays
+    per (city, currency, side, direction), so one refresh is checked with a
+    binary search per array instead of a loop over users. A subscription
+    fires once when the best quote crosses its threshold and again only
+    after the quote has gone back. Only the scraper leader refreshes quotes,
+    so only it evaluates; the others forward changes via ALERTS_VERSION_KEY.
+    The fired state is kept in ALERTS_FIRED_KEY for restarts and for the
+    instance that becomes the leader next."""
+
+    def __init__(self, reload_interval: float = ALERTS_RELOAD_INTERVAL,
+                 max_per_user: int = ALERTS_MAX_PER_USER) -> None:
+        self.reload_interval = reload_interval
+        self.max_per_user = max_per_user
+        self._index: dict[tuple[str, str, str, str], ThresholdArray] = {}
+        self._version: str | None = None
+        self._task: asyncio.Task | None = None
+        self._notifications: set[asyncio.Task] = set()
+        # Fired state changes of the last evaluations not saved to Redis yet
+        self._fired_added: set[int] = set()
+        self._fired_removed: set[int] = set()
+        # Sends the notifications of one evaluation, set from main
+        self.notify: Callable[[list[AlertNotification]], Awaitable[None]] | None = None
+        self.stats = {'evaluations': 0, 'notifications': 0, 'reloads': 0}
+
+    @staticmethod
+    def _key(city: str, currency: str, side: str, direction: str) -> tuple[str, str, str, str]:
+        return city.lower(), currency.upper(), side, direction
+
+    def fired_ids(self) -> set[int]:
+        return {int(subscription_id) for entry in self._index.values()
+                for subscription_id in entry.ids[entry.fired]}
+
+    def build(self, rows: list[tuple], fired_ids: set[int] | None = None) -> None:
+        """Replace the index with rows of db_manager.ALERT_SUBSCRIPTION_COLUMNS.
+        Subscriptions in fired_ids are marked fired, by default the ones fired now"""
+        if fired_ids is None:
+            fired_ids = self.fired_ids()
+        index = {}
+        if rows:
+            df = pd.DataFrame(rows, columns=['id', 'user_id', 'lang', 'city', 'currency',
+                                             'side', 'direction', 'threshold'])
+            df['city'] = df['city'].str.lower()
+            df['currency'] = df['currency'].str.upper()
+            for key, group in df.groupby(['city', 'currency', 'side', 'direction'], sort=False):
+                index[key] = ThresholdArray.build(group['id'].to_numpy(), group['user_id'].to_numpy(),
+                                                  group['lang'].to_numpy(), group['threshold'].to_numpy(),
+                                                  fired_ids)
+        self._index = index
+
+    def count(self) -> int:
+        return sum(len(entry.ids) for entry in self._index.values())
+
+    def subscriptions(self, user_id: int) -> list[tuple[str, str, str, str, float]]:
+        """(city, currency, side, direction, threshold) of the user`s subscriptions"""
+        return [(*key, float(threshold)) for key, entry in self._index.items()
+                for threshold in entry.thresholds[entry.user_ids == user_id]]
+
+    def evaluate(self, city: str, df: pd.DataFrame) -> list[AlertNotification]:
+        """Check the refreshed quote table of one city against all subscriptions.
+        Returns at most one notification per user and subscription array:
+        for the crossed threshold closest to the best quote."""
+        if df is None or df.empty:
+            return []
+        self.stats['evaluations'] += 1
+        notifications = []
+        for currency, quotes in df.groupby(df['currency'].str.upper(), sort=False):
+            for side in ALERT_SIDES:
+                prices = pd.to_numeric(quotes[f"{side}_quote"], errors='coerce')
+                if prices.isna().all():
+                    continue
+                best_rows = {'below': prices.idxmin(), 'above': prices.idxmax()}
+                for direction, row in best_rows.items():
+                    entry = self._index.get(self._key(city, currency, side, direction))
+                    if entry is None or not len(entry.ids):
+                        continue
+                    price = float(prices[row])
+                    was_fired = entry.fired
+                    crossed = entry.crossed(price, direction)
+                    self._fired_changed(entry.ids[entry.fired & ~was_fired].tolist(),
+                                        entry.ids[was_fired & ~entry.fired].tolist())
+                    if not crossed.size:
+                        continue
+                    _, first = np.unique(entry.user_ids[crossed], return_index=True)
+                    for position in crossed[np.sort(first)]:
+                        notifications.append(AlertNotification(
+                            user_id=int(entry.user_ids[position]), lang=entry.langs[position],
+                            city=city, currency=currency, side=side, direction=direction,
+                            threshold=float(entry.thresholds[position]), price=price,
+                            bank=quotes.at[row, 'bank']))
+        self.stats['notifications'] += len(notifications)
+        return notifications
+
+    def check(self, city: str, df: pd.DataFrame) -> None:
+        """Evaluate the refresh and send notifications without waiting for them"""
+        try:
+            notifications = self.evaluate(city, df)
+        except Exception as e:
+            logger.error("Couldn`t evaluate rate alerts for %s: %s", city, e)
+            return
+        if self._fired_added or self._fired_removed:
+            self._spawn(self._save_fired())
+        if notifications and self.notify is not None:
+            self._spawn(self._send(notifications))
+
+    def _fired_changed(self, added: list[int], removed: list[int]) -> None:
+        self._fired_added.difference_update(removed)
+        self._fired_added.update(added)
+        self._fired_removed.difference_update(added)
+        self._fired_removed.update(removed)
+
+    def _spawn(self, coroutine: Awaitable) -> None:
+        task = asyncio.create_task(coroutine)
+        self._notifications.add(task)
+        task.add_done_callback(self._notifications.discard)
+
+    async def _save_fired(self) -> None:
+        if not redis_client.REDIS_AVAILABLE:
+            self._fired_added.clear()
+            self._fired_removed.clear()
+            return
+        added, self._fired_added = self._fired_added, set()
+        removed, self._fired_removed = self._fired_removed, set()
+        try:
+            pipe = redis_client.REDIS_CLIENT.pipeline()
+            if removed:
+                pipe.srem(ALERTS_FIRED_KEY, *removed)
+            if added:
+                pipe.sadd(ALERTS_FIRED_KEY, *added)
+            await pipe.execute()
+        except Exception as e:
+            logger.error("Couldn`t save fired rate alerts: %s", e)
+
+    async def _load_fired(self) -> set[int] | None:
+        """Fired ids saved by the leader, None without Redis"""
+        if not redis_client.REDIS_AVAILABLE:
+            return None
+        return {int(subscription_id) for subscription_id in await redis_client.REDIS_CLIENT.smembers(ALERTS_FIRED_KEY)}
+
+    async def sync_fired(self) -> None:
+        """Take the fired state saved by the leader"""
+        fired_ids = await self._load_fired()
+        if fired_ids is None:
+            return
+        for entry in self._index.values():
+            entry.fired = np.isin(entry.ids, list(fired_ids))
+
+    async def _send(self, notifications: list[AlertNotification]) -> None:
+        try:
+            await self.notify(notifications)
+        except Exception as e:
+            logger.error("Couldn`t send %s rate alerts: %s", len(notifications), e)
+
+    async def subscribe(self, user_id: int, lang: str, city: str, currency: str,
+                        side: str, direction: str, threshold: float) -> int | None:
+        """Save the subscription, returns its id or None if it was not saved"""
+        if side not in ALERT_SIDES or direction not in ALERT_DIRECTIONS:
+            raise ValueError(f"Unknown alert {side} {direction}")
+        if len(self.subscriptions(user_id)) >= self.max_per_user:
+            return None
+        key = self._key(city, currency, side, direction)
+        subscription_id = await asyncio.to_thread(add_alert_subscription_db, user_id, lang, *key, threshold)
+        if subscription_id is None:
+            return None
+        entry = self._index.get(key)
+        if entry is None:
+            self._index[key] = ThresholdArray.build([subscription_id], [user_id], [lang], [threshold])
+        elif subscription_id not in entry.ids:
+            entry.insert(subscription_id, user_id, lang, threshold)
+        await self._bump_version()
+        return subscription_id
+
+    async def unsubscribe(self, user_id: int) -> bool:
+        if not await asyncio.to_thread(delete_alert_subscriptions_db, user_id):
+            return False
+        removed_ids = set()
+        for entry in self._index.values():
+            removed_ids.update(entry.ids[entry.user_ids == user_id].tolist())
+            entry.remove_user(user_id)
+        self._fired_changed([], list(removed_ids))
+        await self._save_fired()
+        await self._bump_version()
+        return True
+
+    async def _bump_version(self) -> None:
+        if not redis_client.REDIS_AVAILABLE:
+            return
+        try:
+            # Our own change is already applied, so don`t reload for it
+            version = await redis_client.REDIS_CLIENT.incr(ALERTS_VERSION_KEY)
+            if self._version is not None and int(self._version) == version - 1:
+                self._version = str(version)
+        except Exception as e:
+            logger.error("Couldn`t publish alert subscriptions change: %s", e)
+
+    async def _remote_version(self) -> str | None:
+        if not redis_client.REDIS_AVAILABLE:
+            return None
+        version = await redis_client.REDIS_CLIENT.get(ALERTS_VERSION_KEY)
+        return str(int(version)) if version is not None else '0'
+
+    async def reload(self) -> bool:
+        version = await self._remote_version()
+        rows = await asyncio.to_thread(load_alert_subscriptions_db)
+        if rows is None:
+            return False
+        try:
+            fired_ids = await self._load_fired()
+        except Exception as e:
+            logger.error("Couldn`t load fired rate alerts: %s", e)
+            fired_ids = None
+        self.build(rows, fired_ids)
+        self._version = version
+        self.stats['reloads'] += 1
+        logger.info("Loaded %s alert subscriptions", self.count())
+        return True
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                version = await self._remote_version()
+                if version is not None and version != self._version:
+                    await self.reload()
+                elif not SCRAPER_LEADER.is_leader:
+                    # Ready to evaluate without repeats if we become the leader
+                    await self.sync_fired()
+            except Exception as e:
+                logger.error("Couldn`t reload alert subscriptions: %s", e)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+            logger.info("Rate alerts started, reload check every %s s", self.reload_interval)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._notifications:
+            await asyncio.gather(*self._notifications, return_exceptions=True)
+        logger.info("Rate alerts stopped, stats: %s", self.stats)
+
+
+# Shared engine fed by bot_logic.refresh_quotes_df and started from main
+ALERTS = AlertEngine()
@@ -1,16 +1,41 @@
 from bs4 import BeautifulSoup
 from bs4.element import Tag
-import requests
+from lxml import etree, html as lxml_html
+import asyncio
+import hashlib
+import os
+import re
+from dataclasses import dataclass
 from datetime import datetime, date
+from urllib.parse import urlparse, parse_qs
 import pytz
 import logging
-from models import QuotesData
+from dotenv import load_dotenv
+from models import QuotesData, CityCode, CurrencyCode
+import http_client
 
 logger = logging.getLogger(__name__)
 
+load_dotenv()
 
-def time_str_to_datetime(time_str: list[Tag]) -> list[datetime]:
-    ''' Function accepts list of Tags with text in format HH:MM in 24 hrs format and
+# 'lxml' parses only the quotes container, 'bs4' is the original full page parser
+RBC_PARSER_ENGINE = os.getenv("RBC_PARSER_ENGINE", "lxml")
+# Save every fetched page into this directory (recording mode)
+RBC_RECORD_DIR = os.getenv("RBC_RECORD_DIR")
+# Read pages from this directory instead of cash.rbc.ru (replay mode, no network)
+RBC_REPLAY_DIR = os.getenv("RBC_REPLAY_DIR")
+
+BANK_NAME_CLASS = 'quote__office__one__name'
+QUOTE_CELL_CLASS = 'quote__office__cell quote__office__one__rate quote__mode_list_view'
+TIME_CELL_CLASS = 'quote__office__cell quote__office__one__time'
+
+_DIV_TAG_RE = re.compile(r'<(/?)div\b[^>]*>', re.IGNORECASE)
+_BANK_NAME_XPATH = etree.XPath(".//a[contains(concat(' ', normalize-space(@class), ' '), $name_class)]")
+_CELL_XPATH = etree.XPath(".//div[@class = $cell_class]")
+
+
+def time_str_to_datetime(time_str: list[Tag] | list[str]) -> list[datetime]:
+    ''' Function accepts list of Tags (or strings) with text in format HH:MM in 24 hrs format and
      returns list of datetime objects in format %Y-%m-%d %H:%M + Moscow TZ.
      The day is always current date because it is a real-time parser,
      timezone always Moscow TZ because we have only 2 cities SPb and Moscow '''
@@ -19,7 +44,7 @@ def time_str_to_datetime(time_str: list[Tag]) -> list[datetime]:
     moscow_tz = pytz.timezone('Europe/Moscow')
 
     # Strip time_str from possible spaces
-    t = [x.text.strip() for x in time_str]
+    t = [(x if isinstance(x, str) else x.text).strip() for x in time_str]
     # Converting str into datetime objects
     t_datetime = [datetime.strptime(f'{today} {x}', '%Y-%m-%d %H:%M') for x in t]
     # Adding timezone
@@ -39,11 +64,19 @@ def _read_from_file(file_name: str) -> str:
     return content
 
 
-def _prepare_parsed_data(banks_raw: list[Tag], quotes_raw: list[Tag],
-                         times_raw: list[Tag], currency: str) -> QuotesData:
+def page_file_name(url: str) -> str:
+    ''' Name of the saved page for the url: {city}_{currency}_{side}.html '''
+    query = parse_qs(urlparse(url).query)
+    city = CityCode(int(query['city'][0])).name.lower()
+    currency = CurrencyCode(int(query['currency'][0])).name.lower()
+    return f"{city}_{currency}_{query['deal'][0]}.html"
+
+
+def _prepare_parsed_data(banks_raw: list[Tag] | list[str], quotes_raw: list[Tag] | list[str],
+                         times_raw: list[Tag] | list[str], currency: str) -> QuotesData:
     datetime_objects_list = time_str_to_datetime(times_raw)
-    banks = [b.text.strip() for b in banks_raw]
-    quotes = [q.text.strip() for q in quotes_raw]
+    banks = [(b if isinstance(b, str) else b.text).strip() for b in banks_raw]
+    quotes = [(q if isinstance(q, str) else q.text).strip() for q in quotes_raw]
     # On the wevsite bank offers that have additional comissions are marked
     # with % sign. So, below we create list[bool] Yes/No Flag for commissions
     commissions = [True if '%' in x else False for x in quotes]
@@ -60,25 +93,167 @@ def _prepare_parsed_data(banks_raw: list[Tag], quotes_raw: list[Tag],
     )
 
 
-def parse_quotes(url: str, target_div_container: str,
-                 currency: str) -> QuotesData:
+def parse_quotes_bs4(html: str, target_div_container: str,
+                     currency: str) -> QuotesData:
 
-    content: requests.Response = requests.get(url)
-
-    data: BeautifulSoup = BeautifulSoup(content.text, 'lxml')
-
-    # _save_to_file('page1.html', content.text)
+    data: BeautifulSoup = BeautifulSoup(html, 'lxml')
 
     # content_text = _read_from_file('page.html')
     # data = BeautifulSoup(content_text,'lxml')
 
     container: Tag = data.find('div', class_=target_div_container)  # tarrget_div_container contains our target table with quotes
 
-    banks_raw: list[Tag] = container.find_all('a', class_='quote__office__one__name')
-    quotes_raw: list[Tag] = container.find_all('div', class_='quote__office__cell quote__office__one__rate quote__mode_list_view')
-    times_raw: list[Tag] = container.find_all('div', class_='quote__office__cell quote__office__one__time')
+    banks_raw: list[Tag] = container.find_all('a', class_=BANK_NAME_CLASS)
+    quotes_raw: list[Tag] = container.find_all('div', class_=QUOTE_CELL_CLASS)
+    times_raw: list[Tag] = container.find_all('div', class_=TIME_CELL_CLASS)
 
     prepared_quotes_data_object = _prepare_parsed_data(banks_raw, quotes_raw, times_raw, currency)
 
     return prepared_quotes_data_object
 
+
+def _extract_container_html(html: str, target_div_container: str) -> str:
+    ''' Returns markup of the container div without parsing the page: finds its
+    opening tag and counts nested div tags up to the matching </div> '''
+    start_re = re.compile(r'<div\b[^>]*\bclass\s*=\s*(["\'])' + re.escape(target_div_container) + r'\1[^>]*>')
+    start = start_re.search(html)
+    if start is None:
+        raise ValueError(f"Container '{target_div_container}' not found on the page")
+
+    depth = 1
+    for tag in _DIV_TAG_RE.finditer(html, start.end()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            return html[start.start():tag.end()]
+    # Page is cut off, let lxml close the open tags
+    return html[start.start():]
+
+
+def _find_office_row(name_tag: etree._Element, container: etree._Element) -> etree._Element | None:
+    ''' Office row is the closest ancestor of the bank name that also holds a quote cell '''
+    row = name_tag.getparent()
+    # Cells found in the container itself belong to other offices
+    while row is not None and row is not container:
+        if _CELL_XPATH(row, cell_class=QUOTE_CELL_CLASS):
+            return row
+        row = row.getparent()
+    return None
+
+
+def extract_office_rows(html: str, target_div_container: str) -> tuple[list[str], list[str], list[str]]:
+    ''' Returns raw bank names, quotes and times of the office rows '''
+    container = lxml_html.fragment_fromstring(_extract_container_html(html, target_div_container))
+
+    banks, quotes, times = [], [], []
+    # Take bank, quote and time from the same office row so they can`t get misaligned
+    for name_tag in _BANK_NAME_XPATH(container, name_class=f' {BANK_NAME_CLASS} '):
+        row = _find_office_row(name_tag, container)
+        if row is None:
+            logger.warning("Skipping office without quote: %s", name_tag.text_content().strip())
+            continue
+        quote_cells = _CELL_XPATH(row, cell_class=QUOTE_CELL_CLASS)
+        time_cells = _CELL_XPATH(row, cell_class=TIME_CELL_CLASS)
+        if len(quote_cells) != 1 or len(time_cells) != 1:
+            logger.warning("Skipping office with unexpected layout: %s", name_tag.text_content().strip())
+            continue
+        banks.append(name_tag.text_content())
+        quotes.append(quote_cells[0].text_content())
+        times.append(time_cells[0].text_content())
+
+    return banks, quotes, times
+
+
+def parse_quotes_lxml(html: str, target_div_container: str,
+                      currency: str) -> QuotesData:
+    banks, quotes, times = extract_office_rows(html, target_div_container)
+    return _prepare_parsed_data(banks, quotes, times, currency)
+
+
+PARSER_ENGINES = {
+    'bs4': parse_quotes_bs4,
+    'lxml': parse_quotes_lxml,
+}
+
+
+def parse_quotes_html(html: str, target_div_container: str,
+                      currency: str) -> QuotesData:
+    return PARSER_ENGINES[RBC_PARSER_ENGINE](html, target_div_container, currency)
+
+
+async def fetch_page(url: str) -> str:
+    if RBC_REPLAY_DIR:
+        return await asyncio.to_thread(_read_from_file, os.path.join(RBC_REPLAY_DIR, page_file_name(url)))
+
+    content: str = await http_client.fetch_text(url)
+
+    if RBC_RECORD_DIR:
+        try:
+            os.makedirs(RBC_RECORD_DIR, exist_ok=True)
+            _save_to_file(os.path.join(RBC_RECORD_DIR, page_file_name(url)), content)
+        except Exception as e:
+            logger.error("Couldn`t record page %s: %s", url, e)
+
+    return content
+
+
+@dataclass
+class PageSnapshot:
+    """What the last fetch of a page gave: validators for conditional
+    requests, digest of the quotes container and the parsed quotes"""
+    etag: str | None
+    last_modified: str | None
+    digest: str
+    day: date
+    data: QuotesData
+
+
+# Last snapshot of every page url, kept by the scraping process
+_PAGE_SNAPSHOTS: dict[str, PageSnapshot] = {}
+PAGE_STATS = {'fetched': 0, 'not_modified': 0, 'unchanged': 0, 'parsed': 0}
+
+
+def _container_digest(container_html: str, currency: str) -> str:
+    # Offer times are parsed into today`s date, so a new day is a new page
+    return hashlib.blake2b(f"{date.today()}|{currency}|{container_html}".encode(), digest_size=16).hexdigest()
+
+
+def get_page_stats() -> dict[str, int]:
+    return dict(PAGE_STATS)
+
+
+async def parse_quotes(url: str, target_div_container: str,
+                       currency: str) -> QuotesData:
+    """Fetch and parse the page. If it did not change since the previous
+    call (304 or the same quotes container), the previous QuotesData object
+    itself is returned without parsing, callers can test it with `is`."""
+    snapshot = _PAGE_SNAPSHOTS.get(url)
+    if snapshot is not None and snapshot.day != date.today():
+        snapshot = None
+
+    etag = last_modified = None
+    if RBC_REPLAY_DIR or RBC_RECORD_DIR:
+        content: str | None = await fetch_page(url)
+    else:
+        content, etag, last_modified = await http_client.fetch_text_conditional(
+            url, *((snapshot.etag, snapshot.last_modified) if snapshot is not None else (None, None)))
+        if content is None and snapshot is None:
+            # 304 for a page we have no snapshot of, can`t happen without validators
+            content = await fetch_page(url)
+    PAGE_STATS['fetched'] += 1
+
+    if content is None:
+        PAGE_STATS['not_modified'] += 1
+        return snapshot.data
+
+    container = _extract_container_html(content, target_div_container)
+    digest = _container_digest(container, currency)
+    if snapshot is not None and snapshot.digest == digest:
+        PAGE_STATS['unchanged'] += 1
+        snapshot.etag, snapshot.last_modified = etag, last_modified
+        return snapshot.data
+
+    # Parsing is CPU bound, keep it off the event loop so other pages keep downloading
+    data = await asyncio.to_thread(parse_quotes_html, container, target_div_container, currency)
+    PAGE_STATS['parsed'] += 1
+    _PAGE_SNAPSHOTS[url] = PageSnapshot(etag, last_modified, digest, date.today(), data)
+    return data
@@ -1,5 +1,6 @@
 import os
 import redis
+import redis.asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -8,20 +9,34 @@ logger = logging.getLogger(__name__)
 # we use REDIS_AVAILABLE
 REDIS_AVAILABLE: bool = True
 
-# Create and export a shared Redis client
-REDIS_CLIENT = redis.Redis(
+# Create and export a shared Redis client. Clients are asyncio based, so a slow
+# Redis call never blocks the handlers of other users.
+REDIS_CLIENT = redis.asyncio.Redis(
             host=os.getenv("REDIS_HOST", "localhost"),
             port=int(os.getenv("REDIS_PORT", 6379)),
             db=0,
             decode_responses=True
         )
 
+# Binary-safe client for values that are not UTF-8 text (msgpack quote tables)
+REDIS_BINARY_CLIENT = redis.asyncio.Redis(
+            host=os.getenv("REDIS_HOST", "localhost"),
+            port=int(os.getenv("REDIS_PORT", 6379)),
+            db=0,
+            decode_responses=False
+        )
 
-def redis_client_init() -> None:
+
+async def redis_client_init() -> None:
     global REDIS_AVAILABLE
     try:
-        REDIS_CLIENT.ping()
+        await REDIS_CLIENT.ping()
         logger.info("Redis connected successfully")
     except redis.RedisError as e:
         REDIS_AVAILABLE = False
         logger.error("Redis is not available: %s", e)
+
+
+async def redis_client_close() -> None:
+    await REDIS_CLIENT.aclose()
+    await REDIS_BINARY_CLIENT.aclose()
@@ -0,0 +1,77 @@
+import logging
+import os
+
+from dotenv import load_dotenv
+
+import redis_client
+from local_cache import LocalCache
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# Sessions of users inactive for this many seconds are dropped from Redis
+SESSION_TTL = int(os.getenv("SESSION_TTL", 86400))
+# In-process copies of recent sessions. They are written through to Redis and
+# re-read after SESSION_LOCAL_TTL, so a choice made on another worker is seen.
+SESSION_LOCAL_TTL = float(os.getenv("SESSION_LOCAL_TTL", 2))
+SESSION_LOCAL_MAX_ITEMS = int(os.getenv("SESSION_LOCAL_MAX_ITEMS", 1024))
+
+
+class SessionStore:
+    """Per-user choices (language, cash or crypto, city) shared by all bot
+    processes. Each session is a Redis hash with a TTL renewed on every write,
+    with a bounded LRU in front of it."""
+
+    def __init__(self, ttl: int = SESSION_TTL, local_ttl: float = SESSION_LOCAL_TTL,
+                 local_max_items: int = SESSION_LOCAL_MAX_ITEMS) -> None:
+        self.ttl = ttl
+        self._local = LocalCache(local_max_items, local_ttl)
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"session:{user_id}"
+
+    async def get(self, user_id: int) -> dict[str, str]:
+        key = self._key(user_id)
+        entry = self._local.get(key)
+        if entry is not None and (entry[2] or not redis_client.REDIS_AVAILABLE):
+            return dict(entry[0])
+        if not redis_client.REDIS_AVAILABLE:
+            return {}
+
+        try:
+            session = await redis_client.REDIS_CLIENT.hgetall(key)
+        except Exception as e:
+            logger.error("Couldn`t get session from Redis: %s", e)
+            return dict(entry[0]) if entry is not None else {}
+        self._local.set(key, session, None)
+        return dict(session)
+
+    async def update(self, user_id: int, **fields: str) -> None:
+        key = self._key(user_id)
+        entry = self._local.get(key)
+        if entry is not None and (entry[2] or not redis_client.REDIS_AVAILABLE):
+            self._local.set(key, {**entry[0], **fields}, None)
+        elif not redis_client.REDIS_AVAILABLE:
+            self._local.set(key, dict(fields), None)
+        else:
+            # Other fields may have changed on another worker, re-read them next time
+            self._local.invalidate(key)
+        if not redis_client.REDIS_AVAILABLE:
+            return
+
+        try:
+            pipe = redis_client.REDIS_CLIENT.pipeline()
+            pipe.hset(key, mapping=fields)
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+        except Exception as e:
+            logger.error("Couldn`t save session in Redis: %s", e)
+
+    def __len__(self) -> int:
+        return len(self._local)
+
+
+# Shared session store used by handlers
+SESSIONS = SessionStore()
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable
+
+from dotenv import load_dotenv
+
+import redis_client
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# How long a process may hold the refresh lock of a key in Redis
+REFRESH_LOCK_TTL_MS = int(os.getenv("REFRESH_LOCK_TTL_MS", 30000))
+# How long to wait for another process to fill the cache before refreshing ourselves
+REFRESH_WAIT_TIMEOUT = float(os.getenv("REFRESH_WAIT_TIMEOUT", 30))
+REFRESH_POLL_INTERVAL = 0.1
+
+# Delete the lock only if it still belongs to us
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """Coalesces concurrent refreshes of the same cache key.
+
+    Inside the process the first caller runs the refresh and everyone else
+    awaits its result. Across processes a Redis lock (SET NX PX) elects one
+    refresher, the other processes poll the cache until the value appears."""
+
+    def __init__(self) -> None:
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self.stats: dict[str, int] = {
+            'refreshes': 0,        # refreshes actually executed by this process
+            'coalesced': 0,        # callers that awaited an in-process refresh
+            'remote_waits': 0,     # callers that found the Redis lock taken
+            'remote_hits': 0,      # ... and got the value another process stored
+            'remote_timeouts': 0,  # ... and had to refresh themselves after all
+        }
+
+    async def do(self,
+                 key: str,
+                 refresh: Callable[[], Awaitable[Any]],
+                 read_cached: Callable[[], Awaitable[Any]] | None = None) -> Any:
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(in_flight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await self._refresh_with_lock(key, refresh, read_cached)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    async def _refresh_with_lock(self,
+                                 key: str,
+                                 refresh: Callable[[], Awaitable[Any]],
+                                 read_cached: Callable[[], Awaitable[Any]] | None) -> Any:
+        if not redis_client.REDIS_AVAILABLE or read_cached is None:
+            return await self._refresh(refresh)
+
+        lock_name = f"lock:{key}"
+        token = uuid.uuid4().hex
+        try:
+            acquired = await redis_client.REDIS_CLIENT.set(lock_name, token, nx=True, px=REFRESH_LOCK_TTL_MS)
+        except Exception as e:
+            logger.error("Couldn`t acquire refresh lock %s: %s", lock_name, e)
+            return await self._refresh(refresh)
+
+        if acquired:
+            try:
+                return await self._refresh(refresh)
+            finally:
+                try:
+                    await redis_client.REDIS_CLIENT.eval(_RELEASE_LOCK_SCRIPT, 1, lock_name, token)
+                except Exception as e:
+                    logger.error("Couldn`t release refresh lock %s: %s", lock_name, e)
+
+        # Another process is refreshing this key, wait for its result
+        self.stats['remote_waits'] += 1
+        deadline = time.monotonic() + REFRESH_WAIT_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(REFRESH_POLL_INTERVAL)
+            cached = await read_cached()
+            if cached is not None:
+                self.stats['remote_hits'] += 1
+                return cached
+            try:
+                lock_held = await redis_client.REDIS_CLIENT.exists(lock_name)
+            except Exception:
+                lock_held = False
+            if not lock_held:
+                # The value may have been stored right before the lock was released
+                cached = await read_cached()
+                if cached is not None:
+                    self.stats['remote_hits'] += 1
+                    return cached
+                # Otherwise the other refresh failed
+                break
+
+        self.stats['remote_timeouts'] += 1
+        return await self._refresh(refresh)
+
+    async def _refresh(self, refresh: Callable[[], Awaitable[Any]]) -> Any:
+        self.stats['refreshes'] += 1
+        return await refresh()
+
+    def get_stats(self) -> dict[str, int]:
+        return dict(self.stats)
+
+
+# Shared coalescer for quotes and statistics cache misses
+SINGLE_FLIGHT = SingleFlight()
@@ -0,0 +1,158 @@
+""" Fakes and data generators shared by the test modules """
+import asyncio
+import random
+import time
+import unittest
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+import pytz
+
+import redis_client
+from bot_logic import _get_data_frame, _merge_df
+from models import QuotesData
+
+PAGE_DELAY = 0.2
+
+
+class FakeRedis:
+    """Minimal in-memory stand-in for the commands bot_logic uses"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None, nx=False, px=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def setex(self, key, ttl, value):
+        self.data[key] = value
+
+    async def exists(self, key):
+        return int(key in self.data)
+
+    async def eval(self, script, numkeys, key, token):
+        return self.data.pop(key, None) is not None
+
+    async def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1)
+        return int(self.data[key])
+
+    async def expire(self, key, ttl):
+        return True
+
+    async def hset(self, key, mapping):
+        self.data.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+        return len(mapping)
+
+    async def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    async def sadd(self, key, *members):
+        self.data.setdefault(key, set()).update(str(member) for member in members)
+
+    async def srem(self, key, *members):
+        self.data.get(key, set()).difference_update(str(member) for member in members)
+
+    async def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.redis, name), args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        return [await command(*args, **kwargs) for command, args, kwargs in self.commands]
+
+
+@contextmanager
+def use_redis(client=None):
+    """Point redis_client at client for the block, None means Redis is down"""
+    saved = redis_client.REDIS_AVAILABLE, redis_client.REDIS_CLIENT, redis_client.REDIS_BINARY_CLIENT
+    redis_client.REDIS_AVAILABLE = client is not None
+    if client is not None:
+        redis_client.REDIS_CLIENT = redis_client.REDIS_BINARY_CLIENT = client
+    try:
+        yield client
+    finally:
+        redis_client.REDIS_AVAILABLE, redis_client.REDIS_CLIENT, redis_client.REDIS_BINARY_CLIENT = saved
+
+
+class RedisTestCase(unittest.IsolatedAsyncioTestCase):
+    """Every test runs with redis_client pointed at make_redis()"""
+
+    def make_redis(self):
+        return FakeRedis()
+
+    def setUp(self):
+        self.redis = self.enterContext(use_redis(self.make_redis()))
+
+
+async def fake_parse_quotes(url, target_div_container, currency):
+    """Stand-in for a cash.rbc.ru page that takes PAGE_DELAY seconds"""
+    await asyncio.sleep(PAGE_DELAY)
+    moscow_tz = pytz.timezone('Europe/Moscow')
+    return QuotesData(
+        banks_names=['Bank A', 'Bank B'],
+        quotes=[90.5, 91.0] if 'deal=buy' in url else [89.0, 89.5],
+        times=[moscow_tz.localize(datetime(2025, 1, 1, 12, 0))] * 2,
+        commissions=[False, True],
+        currency=[currency.upper()] * 2,
+    )
+
+
+def make_quotes_df(num_of_banks: int = 3, seed: int | None = None, missing_sells: int = 0) -> pd.DataFrame:
+    """Merged quote table, the last missing_sells banks have no sell offer"""
+    rng = random.Random(seed)
+    moscow_tz = pytz.timezone('Europe/Moscow')
+    banks = [f'Банк {i}' for i in range(num_of_banks)]
+    times = [moscow_tz.localize(datetime(2025, 4, 14, 10, i % 60)) for i in range(num_of_banks)]
+    buy = [round(rng.uniform(88, 95), 2) for _ in banks]
+    sell = [round(x - rng.uniform(0.5, 4), 2) for x in buy]
+    commissions = [rng.random() < 0.2 for _ in banks]
+    num_of_sells = num_of_banks - missing_sells
+
+    df_buy = _get_data_frame(QuotesData(banks, buy, times, commissions, ['USD'] * num_of_banks))
+    df_sell = _get_data_frame(QuotesData(banks[:num_of_sells], sell[:num_of_sells], times[:num_of_sells],
+                                         commissions[:num_of_sells], ['USD'] * num_of_sells))
+    df = _merge_df(df_buy, df_sell)
+    df.attrs['fetched_at'] = time.time()
+    return df
+
+
+def make_items(num_of_ads: int) -> list[dict]:
+    """Bybit P2P ads as they come in the API response"""
+    items = []
+    for i in range(num_of_ads):
+        items.append({
+            "id": str(i),
+            "nickName": f"seller{i}",
+            "price": f"{80 + i * 0.37:.2f}",
+            "minAmount": str(500 * (i % 7 + 1)),
+            "maxAmount": f"{10000 * (i % 11 + 1)}.00",
+            # Escaped keys inside strings must not be picked up
+            "remark": 'пишите "price": 1, "minAmount": 2, {"orderNum": 3}',
+            "payments": ["75", "377"],
+            "symbolInfo": {"tokenId": "USDT", "minTradeAmount": "1"},
+            "orderNum": 50 * i,
+            "finishNum": 48 * i,
+        })
+    return items
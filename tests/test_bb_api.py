@@ -0,0 +1,77 @@
+import json
+import random
+import unittest
+
+import numpy as np
+
+from bb_api import BybitAdsScanner, AmountPriceIndex, calculate_bybit_stats, average_price_for_amount, \
+                   _ads_from_items
+from tests.helpers import make_items
+
+
+class TestBybitAdsScanner(unittest.TestCase):
+
+    def test_scanner_matches_json_for_any_chunking(self):
+        items = make_items(30)
+        body = json.dumps({"retCode": 0, "result": {"count": 30, "items": items}}, ensure_ascii=False).encode()
+        expected = _ads_from_items(items)
+
+        rng = random.Random(1)
+        for _ in range(20):
+            scanner = BybitAdsScanner()
+            start = 0
+            while start < len(body):
+                end = start + rng.randint(1, 200)
+                scanner.feed(body[start:end])
+                start = end
+            ads = scanner.result()
+
+            self.assertEqual(len(ads), 30)
+            for field in ('price', 'min_amount', 'max_amount', 'order_num', 'finish_num'):
+                np.testing.assert_array_equal(getattr(ads, field), getattr(expected, field))
+
+    def test_misaligned_fields_raise(self):
+        scanner = BybitAdsScanner()
+        scanner.feed(b'{"items": [{"price": "90.1", "minAmount": "100"}]}')
+        with self.assertRaises(ValueError):
+            scanner.result()
+
+    def test_stats_from_arrays(self):
+        stats = calculate_bybit_stats(_ads_from_items(make_items(30)), side='sell')
+
+        self.assertEqual(stats['side'], 'sell')
+        self.assertAlmostEqual(stats['price_min'], 80.0)
+        self.assertEqual(stats['good_sellers']['count_100_trades'], 28)
+        self.assertEqual(stats['good_sellers']['count_95_percent_success'], 29)
+        self.assertEqual(stats['trusted']['count'], 10)
+
+
+class TestAmountPriceIndex(unittest.TestCase):
+
+    def test_matches_per_amount_masks(self):
+        rng = np.random.default_rng(0)
+        min_amount = rng.choice([500, 1000, 5000, 10000, 30000], 500).astype(float)
+        max_amount = min_amount + rng.choice([0, 1000, 20000, 100000], 500)
+        max_amount[:10] = min_amount[:10] - 1  # broken limits never match
+        price = rng.uniform(80, 95, 500)
+        index = AmountPriceIndex.build(price, min_amount, max_amount)
+
+        amounts = np.arange(0, 200000, 250.0)
+        for amount, average in zip(amounts, index.average_prices(amounts)):
+            eligible = price[(min_amount <= amount) & (max_amount >= amount)]
+            if eligible.size:
+                self.assertAlmostEqual(average, eligible.mean())
+            else:
+                self.assertTrue(np.isnan(average))
+
+    def test_custom_amount_from_stats(self):
+        stats = calculate_bybit_stats(_ads_from_items(make_items(30)), side='buy')
+
+        for amount, average in stats['trusted']['avg_prices_by_amount'].items():
+            self.assertEqual(average_price_for_amount(stats, amount), average)
+        self.assertIsNone(average_price_for_amount(stats, 10 ** 9))
+        self.assertIsNone(average_price_for_amount(None, 10000))
+
+
+if __name__ == '__main__':
+    unittest.main()
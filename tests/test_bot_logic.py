@@ -0,0 +1,295 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch, AsyncMock
+
+import pandas as pd
+
+import bot_logic
+from leader_election import SCRAPER_LEADER
+from bb_api import calculate_bybit_stats, _ads_from_items, BYBIT_TARGET_AMOUNTS
+from local_cache import LocalCache
+from tests.helpers import PAGE_DELAY, RedisTestCase, fake_parse_quotes, make_items, make_quotes_df
+
+
+@patch('bot_logic.set_statistics_to_redis_cache')
+@patch('bot_logic.set_quotes_to_redis_cache')
+@patch('bot_logic.parse_quotes', side_effect=fake_parse_quotes)
+class TestConcurrentFetching(RedisTestCase):
+
+    def make_redis(self):
+        return None
+
+    async def test_buy_and_sell_fetched_concurrently(self, mock_parse, *_):
+        started = time.perf_counter()
+        df = await bot_logic.get_quotes_df('usd', 'Moscow', return_all_banks=True)
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(mock_parse.call_count, 2)
+        self.assertEqual(list(df['bank']), ['Bank A', 'Bank B'])
+        self.assertLess(elapsed, PAGE_DELAY * 1.9)
+
+    async def test_statistics_miss_costs_one_page(self, mock_parse, *_):
+        started = time.perf_counter()
+        stats = await bot_logic.get_statistics('Moscow', ['usd', 'eur', 'gbp', 'aed'])
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(mock_parse.call_count, 8)
+        self.assertEqual(set(stats), {'USD', 'EUR', 'GBP', 'AED'})
+        self.assertLess(elapsed, PAGE_DELAY * 3)
+
+
+@patch('bot_logic.parse_quotes', side_effect=fake_parse_quotes)
+class TestStaleWhileRevalidate(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        bot_logic.LOCAL_CACHE.clear()
+        # This instance holds the scraper lease
+        SCRAPER_LEADER._is_leader = True
+
+    def tearDown(self):
+        bot_logic.LOCAL_CACHE.clear()
+        SCRAPER_LEADER._is_leader = False
+
+    async def _store_quotes(self, age):
+        df = await bot_logic.refresh_quotes_df('usd', 'Moscow')
+        df.attrs['fetched_at'] = time.time() - age
+        await bot_logic.set_quotes_to_redis_cache('moscow:usd', df)
+        return df
+
+    async def test_cache_roundtrip_keeps_types(self, mock_parse):
+        df = await self._store_quotes(age=0)
+        cached = await bot_logic.get_quotes_df_from_redis_cache('moscow:usd')
+
+        self.assertEqual(list(cached['time']), list(df['time']))
+        self.assertEqual(list(cached['buy_quote']), list(df['buy_quote']))
+        self.assertEqual(cached.attrs['fetched_at'], df.attrs['fetched_at'])
+
+    async def test_stale_data_served_and_refreshed_in_background(self, mock_parse):
+        await self._store_quotes(age=bot_logic.TTL_QUOTES_IN_REDIS + 60)
+        mock_parse.reset_mock()
+
+        started = time.perf_counter()
+        df = await bot_logic.get_quotes_df('usd', 'Moscow', cache_only=True)
+        self.assertLess(time.perf_counter() - started, PAGE_DELAY)
+        self.assertTrue(bot_logic._is_stale(df.attrs['fetched_at'], bot_logic.TTL_QUOTES_IN_REDIS))
+
+        await asyncio.gather(*bot_logic._background_refreshes)
+        self.assertEqual(mock_parse.call_count, 2)
+        fresh = await bot_logic.get_quotes_df_from_redis_cache('moscow:usd')
+        self.assertFalse(bot_logic._is_stale(fresh.attrs['fetched_at'], bot_logic.TTL_QUOTES_IN_REDIS))
+
+    async def test_refresh_prerenders_replies(self, mock_parse):
+        await bot_logic.refresh_quotes_df('usd', 'Moscow')
+        bot_logic.LOCAL_CACHE.clear()
+
+        for lang in bot_logic.RENDERED_LANGS:
+            rendered = await bot_logic.get_rendered_quotes_message('usd', 'Moscow', lang)
+            self.assertIn('Bank A', rendered['text'])
+        self.assertIsNone(await bot_logic.get_rendered_quotes_message('eur', 'Moscow', 'en'))
+
+    async def test_unchanged_pages_only_extend_ttl(self, mock_parse):
+        pages = {}
+
+        async def same_page_parse(url, target_div_container, currency):
+            if url not in pages:
+                pages[url] = await fake_parse_quotes(url, target_div_container, currency)
+            return pages[url]
+
+        mock_parse.side_effect = same_page_parse
+        df = await bot_logic.refresh_quotes_df('usd', 'Moscow')
+        await bot_logic.refresh_statistics('Moscow')
+        stats_before = bot_logic.get_refresh_stats()
+        changed_at = df.attrs['fetched_at']
+
+        with patch('bot_logic.set_quotes_to_redis_cache') as mock_set_quotes, \
+                patch('bot_logic.set_statistics_to_redis_cache') as mock_set_statistics, \
+                patch('bot_logic.render_quotes_message') as mock_render, \
+                patch('bot_logic.ALERTS.check') as mock_alerts:
+            self.assertIs(await bot_logic.refresh_quotes_df('usd', 'Moscow'), df)
+            await bot_logic.refresh_statistics('Moscow')
+        mock_set_quotes.assert_not_called()
+        mock_set_statistics.assert_not_called()
+        mock_render.assert_not_called()
+        # A subscription added meanwhile is checked against the same quotes
+        mock_alerts.assert_called_once_with('Moscow', df)
+
+        # Replies on every instance show the time of the last check
+        bot_logic.LOCAL_CACHE.clear()
+        rendered = await bot_logic.get_rendered_quotes_message('usd', 'Moscow', 'en')
+        self.assertIn('Bank A', rendered['text'])
+        self.assertGreater(rendered['fetched_at'], changed_at)
+
+        stats = bot_logic.get_refresh_stats()
+        self.assertEqual(stats['quotes_unchanged'] - stats_before['quotes_unchanged'], 1)
+        self.assertEqual(stats['statistics_unchanged'] - stats_before['statistics_unchanged'], 1)
+        # Stale fetched_at of a just confirmed entry doesn`t trigger a scrape
+        df.attrs['fetched_at'] -= bot_logic.TTL_QUOTES_IN_REDIS + 60
+        bot_logic.revalidate_quotes('usd', 'Moscow')
+        self.assertFalse(bot_logic._background_refreshes)
+
+
+async def fake_fetch_bybit_p2p_stats(side='buy'):
+    return calculate_bybit_stats(_ads_from_items(make_items(30)), side)
+
+
+@patch('bot_logic.fetch_bybit_p2p_stats', side_effect=fake_fetch_bybit_p2p_stats)
+class TestBybitStatsCache(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        bot_logic.LOCAL_CACHE.clear()
+
+    def tearDown(self):
+        bot_logic.LOCAL_CACHE.clear()
+
+    async def test_both_sides_cached_and_prerendered(self, mock_fetch):
+        await asyncio.gather(*[bot_logic.refresh_bybit_stats(side) for side in bot_logic.BYBIT_SIDES])
+        bot_logic.LOCAL_CACHE.clear()
+        mock_fetch.reset_mock()
+
+        for side in bot_logic.BYBIT_SIDES:
+            stats = await bot_logic.get_bybit_stats(side, cache_only=True)
+            self.assertEqual(stats['side'], side)
+            # Amounts survive JSON as ints, so the reply can still format them
+            self.assertEqual(list(stats['trusted']['avg_prices_by_amount']), BYBIT_TARGET_AMOUNTS)
+            for lang in bot_logic.RENDERED_LANGS:
+                self.assertIn('USDT', (await bot_logic.get_rendered_bybit_message(side, lang))['text'])
+        mock_fetch.assert_not_called()
+
+    async def test_failed_fetch_keeps_cached_stats(self, mock_fetch):
+        await bot_logic.refresh_bybit_stats('buy')
+        mock_fetch.side_effect = None
+        mock_fetch.return_value = None
+
+        with self.assertRaises(RuntimeError):
+            await bot_logic.refresh_bybit_stats('buy')
+        self.assertEqual((await bot_logic.get_bybit_stats('buy', cache_only=True))['side'], 'buy')
+        self.assertIsNone(await bot_logic.get_bybit_stats('sell', cache_only=True))
+
+
+class TestLocalCacheTier(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        bot_logic.LOCAL_CACHE.clear()
+
+    def tearDown(self):
+        bot_logic.LOCAL_CACHE.clear()
+
+    async def test_hit_served_locally_until_other_worker_writes(self):
+        await bot_logic.set_statistics_to_redis_cache('statistics:moscow', {'USD': {}})
+        read_from_redis = AsyncMock(side_effect=bot_logic.get_statistics_df_from_redis_cache)
+
+        with patch.object(bot_logic.LOCAL_CACHE, 'ttl', 0):
+            # Version unchanged: local entry is reused without decoding
+            cached = await bot_logic._read_through_local_cache('statistics:moscow', read_from_redis)
+            self.assertEqual(cached['data'], {'USD': {}})
+            read_from_redis.assert_not_called()
+
+            # Another worker writes the key, version moves and we reload
+            await self.redis.set('statistics:moscow', '{"fetched_at": 1, "data": {"EUR": {}}}')
+            await self.redis.incr('statistics:moscow:version')
+            cached = await bot_logic._read_through_local_cache('statistics:moscow', read_from_redis)
+            self.assertEqual(cached['data'], {'EUR': {}})
+            read_from_redis.assert_called_once()
+
+    def test_local_cache_is_bounded(self):
+        cache = LocalCache(max_items=2, ttl=60)
+        for key in ['a', 'b', 'c']:
+            cache.set(key, key, version='1')
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('a'))
+
+
+def per_currency_statistics(df) -> dict:
+    """Reference: one boolean mask and one set of reductions per currency"""
+    stat = {}
+    for currency in set(df['currency']):
+        df_cur = df[df['currency'] == currency]
+
+        def average(column):
+            value = df_cur[column].mean()
+            return round(value, 2) if value == value else None
+
+        stat[currency] = {
+            'num_of_available_buys': int(df_cur['buy_quote'].notna().sum()),
+            'num_of_available_sells': int(df_cur['sell_quote'].notna().sum()),
+            'avg_buys': average('buy_quote'), 'avg_sells': average('sell_quote'),
+            'avg_price': average('avg_price'),
+            'min_spread_rub': float(round(df_cur['spread'].min(), 2)),
+            'max_spread_rub': float(round(df_cur['spread'].max(), 2)),
+            'avg_spread_rub': average('spread'),
+        }
+    return stat
+
+
+class TestStatistics(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        bot_logic._statistics_aggregates.clear()
+
+    def tearDown(self):
+        bot_logic._statistics_aggregates.clear()
+
+    @staticmethod
+    def make_city_df(currencies=('USD', 'EUR', 'GBP', 'AED'), seed=0):
+        frames = []
+        for i, currency in enumerate(currencies):
+            df = make_quotes_df(20 + i, seed=seed + i)
+            df['currency'] = currency
+            frames.append(df)
+        df = pd.concat(frames, ignore_index=True)
+        df.loc[df.index[::7], 'sell_quote'] = None
+        df.loc[df.index[::7], 'spread'] = None
+        return df
+
+    def test_grouped_pass_matches_per_currency_masks(self):
+        for seed in range(50):
+            df = self.make_city_df(seed=seed)
+            self.assertEqual(bot_logic._calculate_statistics(df), per_currency_statistics(df), msg=f"seed {seed}")
+
+    async def test_one_currency_refresh_updates_city_statistics(self):
+        df = self.make_city_df()
+        stats = await bot_logic.refresh_statistics('Moscow', df)
+        self.assertEqual(stats, per_currency_statistics(df))
+
+        # Only USD was refreshed, the other currencies come from the aggregates
+        df_usd = self.make_city_df(('USD',), seed=100)
+        bot_logic._update_statistics_aggregates('Moscow', df_usd)
+        stats = await bot_logic.refresh_statistics('Moscow')
+        expected = per_currency_statistics(pd.concat([df[df['currency'] != 'USD'], df_usd]))
+        self.assertEqual(stats, expected)
+        cached = await bot_logic.get_statistics_df_from_redis_cache(bot_logic._statistics_redis_key('Moscow'))
+        self.assertEqual(cached['data']['USD'], stats['USD'])
+
+        # A currency without fresh quotes for too long is dropped
+        bot_logic._statistics_aggregates['moscow']['AED']['fetched_at'] = 0
+        self.assertNotIn('AED', await bot_logic.refresh_statistics('Moscow'))
+
+    async def test_statistics_keep_fetched_at_of_cached_quotes(self):
+        now = time.time()
+        frames = {}
+        for age, currency in [(0, 'USD'), (300, 'EUR')]:
+            frames[currency] = make_quotes_df(20, seed=age)
+            frames[currency]['currency'] = currency
+            frames[currency].attrs['fetched_at'] = now - age
+
+        async def cached_quotes(currency, city, return_all_banks=False):
+            return frames[currency.upper()]
+
+        with patch('bot_logic.get_quotes_df', side_effect=cached_quotes):
+            await bot_logic._refresh_statistics_from_quotes('Moscow', ['usd', 'eur'])
+
+        aggregates = bot_logic._statistics_aggregates['moscow']
+        self.assertEqual(aggregates['USD']['fetched_at'], now)
+        self.assertEqual(aggregates['EUR']['fetched_at'], now - 300)
+        # The statistics are as old as the oldest quote table
+        cached = await bot_logic.get_statistics_df_from_redis_cache(bot_logic._statistics_redis_key('Moscow'))
+        self.assertEqual(cached['fetched_at'], now - 300)
+
+
+if __name__ == '__main__':
+    unittest.main()
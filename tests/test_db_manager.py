@@ -1,9 +1,22 @@
 import unittest
 import os
-from db_manager import get_db_connection, save_new_user_data_in_db, db_init
+import threading
+from datetime import date, datetime, timedelta, timezone
+import psycopg2
+import db_manager
+from db_manager import get_db_connection, save_new_user_data_in_db, db_init, DBPool, borrow_connection
 from unittest.mock import patch, MagicMock
 
 
+def make_mock_pool(mock_pool_cls, connections):
+    """Fake psycopg2 pool handing out the given mock connections"""
+    idle = list(connections)
+    mock_pool = mock_pool_cls.return_value
+    mock_pool.getconn.side_effect = lambda: idle.pop(0) if idle else MagicMock(closed=0)
+    mock_pool.putconn.side_effect = lambda conn, close=False: None if close else idle.append(conn)
+    return mock_pool
+
+
 class TestDBConnection(unittest.TestCase):
 
     def test_connection_faile(self):
@@ -27,16 +40,20 @@ class TestDBConnection(unittest.TestCase):
 
 
 class TestSaveUser(unittest.TestCase):
-    @patch('db_manager.get_db_connection')
-    def test_save_new_user(self, mock_get_conn):
+    def tearDown(self):
+        db_manager.DB_POOL = None
+
+    @patch('db_manager.pool.ThreadedConnectionPool')
+    def test_save_new_user(self, mock_pool_cls):
         # Setup mocks
-        mock_conn = MagicMock()
+        mock_conn = MagicMock(closed=0)
         mock_cursor = MagicMock()
-        mock_get_conn.return_value = mock_conn
+        mock_pool = make_mock_pool(mock_pool_cls, [mock_conn])
+        db_manager.DB_POOL = DBPool()
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
-        # Cursor will simulate "no user found"
-        mock_cursor.fetchone.return_value = None
+        # Cursor will simulate "user inserted"
+        mock_cursor.rowcount = 1
 
         # Fake user object
         user = MagicMock()
@@ -50,24 +67,30 @@ class TestSaveUser(unittest.TestCase):
         # Call function
         save_new_user_data_in_db(user)
 
-        # Check if SELECT and INSERT were called
-        mock_cursor.execute.assert_any_call("SELECT 1 FROM users WHERE id = %s", (user.id,))
-        self.assertTrue(mock_cursor.execute.call_count >= 2)
+        # Check a single upsert was executed
+        mock_cursor.execute.assert_called_once()
+        args, kwargs = mock_cursor.execute.call_args
+        self.assertIn("ON CONFLICT (id) DO NOTHING", args[0])
+        self.assertEqual(args[1][0], user.id)
 
         # Check if commit was called
         mock_conn.commit.assert_called_once()
 
-        # Check if connection closed
-        mock_conn.close.assert_called_once()
+        # Check the connection went back to the pool instead of being closed
+        mock_conn.close.assert_not_called()
+        mock_pool.putconn.assert_called_once_with(mock_conn)
 
 
 class TestDBInit(unittest.TestCase):
-    @patch('db_manager.get_db_connection')
-    def test_db_init(self, mock_get_conn):
+    def tearDown(self):
+        db_manager.db_close()
+
+    @patch('db_manager.pool.ThreadedConnectionPool')
+    def test_db_init(self, mock_pool_cls):
         #SetUp mocks
-        mock_conn = MagicMock()
+        mock_conn = MagicMock(closed=0)
         mock_cursor = MagicMock()
-        mock_get_conn.return_value = mock_conn
+        mock_pool = make_mock_pool(mock_pool_cls, [mock_conn])
         mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
 
         #call the function
@@ -78,9 +101,88 @@ class TestDBInit(unittest.TestCase):
         args, kwargs = mock_cursor.execute.call_args
         self.assertIn("CREATE TABLE IF NOT EXISTS users", args[0])
         
-        # Check commit and close were called
+        # Check commit was called and connection returned to the pool
         mock_conn.commit.assert_called_once()
-        mock_conn.close.assert_called_once()
+        mock_pool.putconn.assert_called_once_with(mock_conn)
+
+    @patch('db_manager.DB_POOL_RETRY_DELAY', 0)
+    @patch('db_manager.pool.ThreadedConnectionPool')
+    def test_pool_created_when_db_comes_back(self, mock_pool_cls):
+        mock_conn = MagicMock(closed=0)
+        mock_cursor = mock_conn.cursor.return_value.__enter__.return_value
+        mock_pool = make_mock_pool(mock_pool_cls, [mock_conn])
+        # DB is still starting when the bot starts
+        mock_pool_cls.side_effect = [psycopg2.OperationalError("connection refused"), mock_pool]
+
+        db_init()
+        self.assertIsNone(db_manager.DB_POOL)
+
+        with borrow_connection() as conn:
+            self.assertIs(conn, mock_conn)
+        self.assertIn("CREATE TABLE IF NOT EXISTS users", mock_cursor.execute.call_args_list[0].args[0])
+
+    @patch('db_manager.DB_POOL_RETRY_DELAY', 60)
+    @patch('db_manager.pool.ThreadedConnectionPool', side_effect=psycopg2.OperationalError("connection refused"))
+    def test_pool_retries_are_spaced(self, mock_pool_cls):
+        db_init()
+        with borrow_connection() as conn:
+            self.assertIsNone(conn)
+        mock_pool_cls.assert_called_once()
+
+
+@patch('db_manager.pool.ThreadedConnectionPool')
+class TestDBPool(unittest.TestCase):
+
+    def test_waits_for_free_connection_and_times_out(self, mock_pool_cls):
+        make_mock_pool(mock_pool_cls, [MagicMock(closed=0)])
+        db_pool = DBPool(maxconn=1, wait_timeout=0.05)
+
+        conn = db_pool.getconn()
+        with self.assertRaises(psycopg2.pool.PoolError):
+            db_pool.getconn()
+
+        threading.Timer(0.02, db_pool.putconn, args=(conn,)).start()
+        db_pool.wait_timeout = 1
+        self.assertIs(db_pool.getconn(), conn)
+
+        stats = db_pool.get_stats()
+        self.assertEqual(stats['borrows'], 2)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['in_use'], 1)
+        self.assertGreater(stats['wait_time_max'], 0.01)
+
+    def test_broken_connection_is_replaced(self, mock_pool_cls):
+        broken, healthy = MagicMock(closed=0), MagicMock(closed=0)
+        broken.cursor.side_effect = psycopg2.OperationalError("server closed the connection")
+        mock_pool = make_mock_pool(mock_pool_cls, [broken, healthy])
+        db_manager.DB_POOL = DBPool(maxconn=2, healthcheck_interval=0)
+        try:
+            with borrow_connection() as conn:
+                self.assertIs(conn, healthy)
+        finally:
+            db_manager.DB_POOL = None
+
+        mock_pool.putconn.assert_any_call(broken, close=True)
+        mock_pool.putconn.assert_called_with(healthy)
+
+
+class TestQuotesHistoryPartitions(unittest.TestCase):
+
+    def setUp(self):
+        db_manager._QUOTES_HISTORY_PARTITIONS.clear()
+
+    def tearDown(self):
+        db_manager._QUOTES_HISTORY_PARTITIONS.clear()
+
+    def test_bounds_are_utc_months(self):
+        cur = MagicMock()
+        db_manager._ensure_quotes_history_partitions(cur, {date(2025, 12, 31), date(2025, 12, 1)})
+
+        cur.execute.assert_called_once()
+        start, end = cur.execute.call_args.args[1]
+        self.assertEqual((start, end), (datetime(2025, 12, 1, tzinfo=timezone.utc),
+                                        datetime(2026, 1, 1, tzinfo=timezone.utc)))
+        self.assertEqual(start.utcoffset(), timedelta(0))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,90 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch, MagicMock, AsyncMock
+
+import bot_logic
+import handlers
+from leader_election import SCRAPER_LEADER
+from sessions import SESSIONS
+from tests.helpers import RedisTestCase, fake_parse_quotes
+
+SLOW_UPSTREAM_DELAY = 1.0
+
+
+async def slow_stream_post(url, payload, headers=None):
+    """Bybit stand-in that takes SLOW_UPSTREAM_DELAY seconds to answer"""
+    await asyncio.sleep(SLOW_UPSTREAM_DELAY)
+    yield b'{"result": {"items": []}}'
+
+
+def make_callback_update(user_id, data, replies):
+    update = MagicMock()
+    update.effective_user.id = user_id
+    query = update.callback_query
+    query.from_user.id = user_id
+    query.from_user.language_code = 'en'
+    query.data = data
+    query.answer = AsyncMock()
+    query.message.reply_text = AsyncMock(side_effect=lambda text, **kwargs: replies.append((time.perf_counter(), text)))
+    return update
+
+
+@patch('bot_logic.parse_quotes', side_effect=fake_parse_quotes)
+class TestNonBlockingHandlers(RedisTestCase):
+
+    def setUp(self):
+        super().setUp()
+        bot_logic.LOCAL_CACHE.clear()
+        # This instance holds the scraper lease
+        SCRAPER_LEADER._is_leader = True
+
+    def tearDown(self):
+        bot_logic.LOCAL_CACHE.clear()
+        SCRAPER_LEADER._is_leader = False
+
+    @patch('bb_api.http_client.stream_post', side_effect=slow_stream_post)
+    async def test_slow_upstream_does_not_delay_other_users(self, mock_stream, mock_parse):
+        await bot_logic.refresh_quotes_df('USD', 'Moscow')
+        await SESSIONS.update(2, city='Moscow')
+
+        # User 1 asks for a USDT price, nothing is cached so Bybit is called
+        slow_update = MagicMock()
+        slow_update.effective_user.language_code = 'en'
+        slow_update.message.reply_text = AsyncMock()
+        context = MagicMock(args=['50000'])
+        slow_request = asyncio.create_task(handlers.usdt_amount(slow_update, context))
+        await asyncio.sleep(0.05)
+
+        # User 2 asks for cached cash quotes meanwhile
+        replies = []
+        started = time.perf_counter()
+        await handlers.handle_callback(make_callback_update(2, 'currency:USD', replies), MagicMock())
+
+        self.assertFalse(slow_request.done())
+        self.assertIn('Bank A', replies[-1][1])
+        self.assertLess(replies[-1][0] - started, SLOW_UPSTREAM_DELAY / 5)
+
+        await slow_request
+        mock_stream.assert_called_once()
+        slow_update.message.reply_text.assert_awaited_once()
+
+    async def test_statistics_reply_shows_data_age(self, mock_parse):
+        await bot_logic.refresh_quotes_df('USD', 'Moscow')
+        await bot_logic.refresh_statistics('Moscow')
+        await SESSIONS.update(3, city='Moscow')
+
+        replies = []
+        await handlers.handle_callback(make_callback_update(3, 'get_statistics', replies), MagicMock())
+        self.assertIn('USD', replies[-1][1])
+        self.assertTrue(replies[-1][1].endswith('🕒 Updated just now'))
+
+        # Without the rendered reply it is rendered from the cached statistics
+        del self.redis.data[bot_logic._rendered_statistics_key('Moscow', 'en')]
+        bot_logic.LOCAL_CACHE.clear()
+        await handlers.handle_callback(make_callback_update(3, 'get_statistics', replies), MagicMock())
+        self.assertEqual(replies[-1][1], replies[-2][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
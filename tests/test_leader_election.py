@@ -0,0 +1,65 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import bot_logic
+import redis_client
+from leader_election import LeaderLease
+from tests.helpers import FakeRedis, RedisTestCase
+
+
+class FakeLeaseRedis(FakeRedis):
+    """FakeRedis that runs the renew / release scripts"""
+
+    async def eval(self, script, numkeys, key, token, *args):
+        if self.data.get(key) != token:
+            return 0
+        if 'pexpire' in script:
+            return 1
+        del self.data[key]
+        return 1
+
+
+class TestLeaderLease(RedisTestCase):
+
+    def make_redis(self):
+        return FakeLeaseRedis()
+
+    async def test_exactly_one_leader_and_failover(self):
+        instances = [LeaderLease('scraper', renew_interval=0.01) for _ in range(3)]
+        for instance in instances:
+            await instance.start()
+        await asyncio.sleep(0.05)
+        leaders = [instance for instance in instances if instance.is_leader]
+        self.assertEqual(len(leaders), 1)
+
+        # The leader dies and its lease expires
+        leaders[0]._task.cancel()
+        leaders[0]._is_leader = False
+        del self.redis.data['leader:scraper']
+        followers = [instance for instance in instances if instance is not leaders[0]]
+        await asyncio.sleep(0.05)
+        self.assertEqual(sum(instance.is_leader for instance in followers), 1)
+
+        for instance in instances:
+            await instance.stop()
+        self.assertNotIn('leader:scraper', self.redis.data)
+
+    async def test_every_instance_leads_without_redis(self):
+        redis_client.REDIS_AVAILABLE = False
+        self.assertTrue(LeaderLease('scraper').is_leader)
+
+    @patch('bot_logic.parse_quotes')
+    async def test_follower_only_reads_cache(self, mock_parse):
+        follower = LeaderLease('scraper')
+        self.redis.data['leader:scraper'] = 'other-instance'
+        self.assertFalse(await follower.try_acquire())
+
+        with patch('bot_logic.SCRAPER_LEADER', follower):
+            self.assertIsNone(await bot_logic.get_quotes_df('usd', 'Moscow'))
+            self.assertEqual(await bot_logic.get_statistics('Moscow', ['usd']), {})
+        mock_parse.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import importlib
+import os
+import unittest
+from unittest.mock import DEFAULT, patch
+
+from telegram.ext import CommandHandler
+
+import main
+
+SERVICES = ('USER_REGISTRY', 'SCRAPER_LEADER', 'QUOTES_REFRESHER', 'USAGE_COUNTERS',
+            'QUOTES_HISTORY', 'ALERTS', 'OUTBOX')
+
+
+class TestBuildApplication(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.enterContext(patch.object(main, 'TOKEN', '123:ABC'))
+
+    def reload_main(self, env: dict) -> None:
+        """Read the module settings again from env"""
+        self.addCleanup(importlib.reload, main)
+        self.enterContext(patch.dict(os.environ, env))
+        importlib.reload(main)
+
+    def test_handlers_and_hooks(self):
+        app = main.build_application(64)
+        self.assertEqual(app.concurrent_updates, 64)
+        self.assertIs(app.post_init, main.on_startup)
+        self.assertIs(app.post_shutdown, main.on_shutdown)
+        commands = {command for handler in app.handlers[0] if isinstance(handler, CommandHandler)
+                    for command in handler.commands}
+        self.assertEqual(commands, {'start', 'usdt', 'history', 'alert', 'broadcast', 'outbox'})
+
+    def test_webhook_config_from_env(self):
+        self.reload_main({'BOT_MODE': 'webhook', 'WEBHOOK_URL': 'https://bot.example.com/',
+                          'WEBHOOK_PATH': 'hook', 'WEBHOOK_SECRET': 'secret',
+                          'WEBHOOK_MAX_CONNECTIONS': '40', 'WEBHOOK_WORKERS': '1',
+                          'CONCURRENT_UPDATES': '16', 'TEST_BOT_TOKEN': '123:ABC'})
+        with patch.multiple(main, db_init=DEFAULT, _bind_webhook_socket=DEFAULT) as mocks, \
+                patch('telegram.ext.Application.run_webhook') as run_webhook:
+            main.main()
+        mocks['db_init'].assert_called_once()
+
+        kwargs = run_webhook.call_args.kwargs
+        self.assertEqual(kwargs['url_path'], 'hook')
+        self.assertEqual(kwargs['webhook_url'], 'https://bot.example.com/hook')
+        self.assertEqual(kwargs['secret_token'], 'secret')
+        self.assertEqual(kwargs['max_connections'], 40)
+        self.assertIs(kwargs['unix'], mocks['_bind_webhook_socket'].return_value)
+        self.assertEqual(run_webhook.call_args.args, ())
+
+    def test_webhook_needs_url(self):
+        self.reload_main({'BOT_MODE': 'webhook', 'WEBHOOK_URL': ''})
+        with self.assertRaises(ValueError):
+            main.run_webhook()
+
+    async def test_startup_and_shutdown_hooks(self):
+        services = self.enterContext(patch.multiple(main, autospec=True, **dict.fromkeys(SERVICES, DEFAULT)))
+        functions = self.enterContext(patch.multiple(main, close_http_client=DEFAULT, db_close=DEFAULT))
+        redis_init = self.enterContext(patch('redis_client.redis_client_init'))
+        redis_close = self.enterContext(patch('redis_client.redis_client_close'))
+        app = main.build_application()
+
+        await app.post_init(app)
+        redis_init.assert_awaited_once()
+        services['USER_REGISTRY'].warm.assert_awaited_once()
+        services['ALERTS'].reload.assert_awaited_once()
+        for name in SERVICES:
+            self.assertEqual(services[name].start.call_count, 1, name)
+        self.assertIs(services['OUTBOX'].bot, app.bot)
+        self.assertIs(services['QUOTES_HISTORY'].on_flushed, main.render_history_messages)
+
+        await app.post_shutdown(app)
+        for name in SERVICES:
+            services[name].stop.assert_awaited_once()
+        functions['close_http_client'].assert_awaited_once()
+        functions['db_close'].assert_called_once()
+        redis_close.assert_awaited_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
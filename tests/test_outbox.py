@@ -0,0 +1,194 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import AsyncMock
+
+from telegram.error import Forbidden, RetryAfter, TimedOut
+
+import outbox as outbox_module
+from outbox import Outbox
+from tests.helpers import FakeRedis, RedisTestCase, use_redis
+
+
+class FakeBot:
+
+    def __init__(self, errors: dict | None = None) -> None:
+        self.sent = []
+        # chat_id -> list of exceptions raised by the next sends to it
+        self.errors = errors or {}
+
+    async def send_message(self, chat_id, text):
+        if self.errors.get(chat_id):
+            raise self.errors[chat_id].pop(0)
+        self.sent.append((chat_id, text, time.monotonic()))
+
+
+class HangingBot(FakeBot):
+    """Sends to the chats in hang_on never finish until release is set"""
+
+    def __init__(self, hang_on: set) -> None:
+        super().__init__()
+        self.hang_on = hang_on
+        self.release = asyncio.Event()
+
+    async def send_message(self, chat_id, text):
+        if chat_id in self.hang_on:
+            await self.release.wait()
+        await super().send_message(chat_id, text)
+
+
+class FakeListRedis(FakeRedis):
+    """FakeRedis with the list commands and the scripts of the outbox"""
+
+    async def rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(values)
+
+    async def lrem(self, key, count, value):
+        self.data[key].remove(value)
+        return 1
+
+    async def llen(self, key):
+        return len(self.data.get(key, []))
+
+    async def zcard(self, key):
+        return 0
+
+    async def eval(self, script, numkeys, *args):
+        if script == outbox_module._PROMOTE_DUE_SCRIPT:
+            return 0
+        source, target = (self.data.setdefault(key, []) for key in args[:2])
+        if script == outbox_module._TAKE_SCRIPT:
+            taken = source[:args[2]]
+            del source[:args[2]]
+            target.extend(taken)
+            return taken
+        taken = source[:]
+        source.clear()
+        target[:0] = taken
+        return len(taken)
+
+
+class TestOutbox(RedisTestCase):
+
+    def make_redis(self):
+        return None
+
+    def make_outbox(self, bot, **kwargs) -> Outbox:
+        params = dict(rate=1000, burst=1000, per_chat_interval=0, retry_base_delay=0)
+        params.update(kwargs)
+        outbox = Outbox(**params)
+        outbox.bot = bot
+        return outbox
+
+    async def drain(self, outbox: Outbox, rounds: int = 50) -> None:
+        for _ in range(rounds):
+            await outbox.dispatch_batch()
+            if await outbox.depth() == (0, 0):
+                return
+
+    async def test_broadcast_respects_global_rate(self):
+        bot = FakeBot()
+        outbox = self.make_outbox(bot, rate=200, burst=5)
+        self.assertEqual(await outbox.broadcast(range(45), "hi"), 45)
+
+        started = time.monotonic()
+        await self.drain(outbox)
+        self.assertEqual(sorted(chat_id for chat_id, _, _ in bot.sent), list(range(45)))
+        # 5 at once, the other 40 at 200 per second
+        self.assertGreaterEqual(time.monotonic() - started, 0.18)
+        metrics = await outbox.get_metrics()
+        self.assertEqual((metrics['queued'], metrics['sent']), (0, 45))
+
+    async def test_one_chat_is_paced(self):
+        bot = FakeBot()
+        outbox = self.make_outbox(bot, per_chat_interval=0.05)
+        await outbox.enqueue([(1, "a"), (1, "b"), (1, "c"), (2, "d")])
+
+        for _ in range(100):
+            await outbox.dispatch_batch()
+            if len(bot.sent) == 4:
+                break
+            time.sleep(0.01)
+
+        chat_1 = [sent for sent in bot.sent if sent[0] == 1]
+        self.assertEqual([text for _, text, _ in chat_1], ["a", "b", "c"])
+        # Slots are reserved 0.05 s apart
+        self.assertGreaterEqual(chat_1[-1][2] - chat_1[0][2], 0.095)
+        self.assertLess(next(sent[2] for sent in bot.sent if sent[0] == 2) - chat_1[0][2], 0.05)
+
+    async def test_retry_after_pauses_dispatcher(self):
+        bot = FakeBot({1: [RetryAfter(3)]})
+        outbox = self.make_outbox(bot)
+        await outbox.enqueue([(1, "alert"), (2, "alert")])
+
+        await outbox.dispatch_batch()
+        self.assertEqual(outbox.stats['retry_after'], 1)
+        self.assertGreater(outbox._paused_until - time.monotonic(), 2)
+        self.assertEqual(await outbox.depth(), (0, 1))
+
+        # Pretend the pause is over
+        outbox._paused_until = 0
+        outbox._local_delayed = [(0, *entry[1:]) for entry in outbox._local_delayed]
+        await outbox.dispatch_batch()
+        self.assertEqual(sorted(chat_id for chat_id, _, _ in bot.sent), [1, 2])
+
+    async def test_blocked_chats_dropped_and_errors_retried(self):
+        bot = FakeBot({1: [Forbidden("bot was blocked by the user")],
+                       2: [TimedOut(), TimedOut()],
+                       3: [TimedOut()] * 5})
+        outbox = self.make_outbox(bot, max_attempts=3)
+        await outbox.enqueue([(1, "x"), (2, "x"), (3, "x")])
+        await self.drain(outbox)
+
+        self.assertEqual([chat_id for chat_id, _, _ in bot.sent], [2])
+        self.assertEqual(outbox.stats['dropped'], 1)
+        self.assertEqual(outbox.stats['failed'], 1)
+        self.assertEqual(outbox.stats['retried'], 4)
+
+    async def test_messages_go_to_redis(self):
+        with use_redis(AsyncMock()) as redis:
+            outbox = self.make_outbox(FakeBot())
+            await outbox.enqueue([(1, "x")] * 3)
+            redis.rpush.assert_awaited_once()
+            self.assertEqual(len(redis.rpush.call_args.args), 4)
+
+    async def test_cancelled_dispatch_keeps_messages(self):
+        bot = HangingBot({2})
+        outbox = self.make_outbox(bot, rate=1, burst=2)
+        await outbox.enqueue([(1, "a"), (2, "b"), (3, "c")])
+
+        dispatch = asyncio.create_task(outbox.dispatch_batch())
+        await asyncio.sleep(0.1)
+        # 1 is sent, 2 hangs in send_message and 3 waits for a token
+        dispatch.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await dispatch
+        self.assertEqual([chat_id for chat_id, _, _ in bot.sent], [1])
+        self.assertEqual(await outbox.depth(), (2, 0))
+
+        bot.release.set()
+        outbox.bucket = self.make_outbox(bot).bucket
+        await self.drain(outbox)
+        self.assertEqual([chat_id for chat_id, _, _ in bot.sent], [1, 2, 3])
+
+    async def test_messages_of_stopped_dispatcher_recovered(self):
+        with use_redis(FakeListRedis()) as redis:
+            crashed = self.make_outbox(FakeBot())
+            await crashed.recover()
+            await crashed.enqueue([(1, "a"), (2, "b")])
+            # Taken but never finished, as if the process died mid-send
+            await crashed._take(10)
+            self.assertEqual(await crashed.depth(), (0, 0))
+
+            bot = FakeBot()
+            outbox = self.make_outbox(bot)
+            self.assertEqual(await outbox.recover(), 2)
+            await self.drain(outbox)
+            self.assertEqual([chat_id for chat_id, _, _ in bot.sent], [1, 2])
+            self.assertEqual(await redis.smembers(outbox_module.OUTBOX_WORKERS_KEY), {outbox.worker_id})
+            self.assertEqual(await redis.llen(outbox_module.OUTBOX_PROCESSING_KEY.format(
+                worker_id=outbox.worker_id)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
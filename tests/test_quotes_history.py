@@ -0,0 +1,130 @@
+import asyncio
+import csv
+import unittest
+from datetime import date, datetime, timezone
+from unittest.mock import AsyncMock, patch
+
+import pandas as pd
+
+from data_formatter import render_history_message
+from db_manager import QUOTES_HISTORY_COLUMNS, QUOTES_ROLLUP_COLUMNS
+from quotes_history import QuotesHistoryWriter, compute_quotes_rollups
+from tests.helpers import make_quotes_df
+
+
+def history_rows(city: str, scraped_at: datetime, num_of_banks: int = 5) -> pd.DataFrame:
+    df = make_quotes_df(num_of_banks)
+    return df.rename(columns={'time': 'quote_time'}).assign(scraped_at=scraped_at, city=city)
+
+
+def merge_rollups(stored: dict, rows: list[tuple]) -> None:
+    """Same merge as the quotes_rollups upsert"""
+    for row in rows:
+        row = dict(zip(QUOTES_ROLLUP_COLUMNS, row))
+        key = tuple(row[column] for column in QUOTES_ROLLUP_COLUMNS[:4])
+        if key not in stored:
+            stored[key] = row
+            continue
+        old = stored[key]
+        for column, value in row.items():
+            if column.endswith(('_count', '_sum')):
+                old[column] += value
+            elif column.endswith('_min') and value is not None:
+                old[column] = value if old[column] is None else min(old[column], value)
+            elif column.endswith('_max') and value is not None:
+                old[column] = value if old[column] is None else max(old[column], value)
+
+
+class TestQuotesHistoryWriter(unittest.TestCase):
+
+    @patch('quotes_history.copy_quotes_history_db', return_value=True)
+    def test_refreshes_are_copied_in_one_batch(self, mock_copy):
+        writer = QuotesHistoryWriter(enabled=True)
+        for city in ('Moscow', 'SPB'):
+            df = make_quotes_df(5)
+            df.attrs['fetched_at'] = 1744614000  # 2025-04-14
+            writer.record(city, df)
+
+        self.assertEqual(writer.flush(), 10)
+        mock_copy.assert_called_once()
+        csv_buffer, months = mock_copy.call_args.args
+        rows = list(csv.reader(csv_buffer))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(len(rows[0]), len(QUOTES_HISTORY_COLUMNS))
+        self.assertEqual({row[1] for row in rows}, {'moscow', 'spb'})
+        self.assertTrue(rows[0][0].startswith('2025-04-14'))
+        self.assertEqual(months, {date(2025, 4, 14)})
+        self.assertEqual(writer.flush(), 0)
+
+    @patch('quotes_history.copy_quotes_history_db', return_value=False)
+    def test_failed_copy_is_retried_within_bound(self, mock_copy):
+        writer = QuotesHistoryWriter(max_pending=3, enabled=True)
+        for _ in range(5):
+            writer.record('Moscow', make_quotes_df(2))
+        self.assertEqual(writer.stats['dropped'], 2)
+
+        self.assertEqual(writer.flush(), 0)
+        mock_copy.return_value = True
+        self.assertEqual(writer.flush(), 6)
+
+    def test_disabled_writer_keeps_nothing(self):
+        writer = QuotesHistoryWriter(enabled=False)
+        writer.record('Moscow', make_quotes_df(2))
+        self.assertEqual(writer.flush(), 0)
+
+
+
+class TestQuotesRollups(unittest.TestCase):
+
+    def test_incremental_rollups_match_full_recompute(self):
+        frames = [history_rows(city, datetime(2025, 4, 14, hour, minute, tzinfo=timezone.utc))
+                  for city in ('moscow', 'spb') for hour in (20, 21) for minute in (0, 5, 25)]
+        frames[0].loc[frames[0].index[:2], 'sell_quote'] = None
+
+        incremental = {}
+        for frame in frames:
+            merge_rollups(incremental, compute_quotes_rollups(frame))
+        full = {}
+        merge_rollups(full, compute_quotes_rollups(pd.concat(frames, ignore_index=True)))
+
+        self.assertEqual(incremental.keys(), full.keys())
+        for key, row in full.items():
+            for column, value in row.items():
+                if isinstance(value, float):
+                    self.assertAlmostEqual(incremental[key][column], value)
+                else:
+                    self.assertEqual(incremental[key][column], value)
+        # 21:00 UTC is midnight in Moscow, so the day bucket splits there
+        days = {key[3].date() for key in full if key[2] == 'day'}
+        self.assertEqual(days, {date(2025, 4, 14), date(2025, 4, 15)})
+        self.assertEqual(sum(1 for key in full if key[2] == '10min'), 2 * 2 * 2)
+
+    @patch('quotes_history.copy_quotes_history_db', return_value=True)
+    def test_flush_sends_rollups_and_notifies(self, mock_copy):
+        writer = QuotesHistoryWriter(enabled=True)
+        writer.on_flushed = AsyncMock()
+        writer.record('Moscow', make_quotes_df(3))
+
+        self.assertEqual(asyncio.run(writer._flush()), 3)
+        rollup_rows = mock_copy.call_args.kwargs['rollup_rows']
+        self.assertEqual({row[2] for row in rollup_rows}, {'10min', 'hour', 'day'})
+        writer.on_flushed.assert_awaited_once_with({('moscow', 'USD')})
+
+    def test_render_from_rollups(self):
+        rows = compute_quotes_rollups(pd.concat([
+            history_rows('moscow', datetime(2025, 4, 14, 9, minute, tzinfo=timezone.utc)) for minute in (0, 10, 20)
+        ]))
+        rollups = {}
+        for row in rows:
+            row = dict(zip(QUOTES_ROLLUP_COLUMNS, row))
+            rollups.setdefault(row['granularity'], []).append(row)
+
+        message = render_history_message(rollups, 'moscow', 'usd', 'en')
+        self.assertIn("USD in Moscow", message)
+        self.assertIn("📅 14.04", message)
+        self.assertEqual(render_history_message({}, 'moscow', 'usd', 'ru'),
+                         render_history_message(None, 'spb', 'eur', 'ru'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import bot_logic
+from bot_logic import BYBIT_SIDES
+from models import CityCode, CurrencyCode
+from quotes_refresher import QuotesRefresher
+from tests.helpers import RedisTestCase, make_quotes_df
+
+NUM_OF_KEYS = len(CityCode) * len(CurrencyCode) + len(CityCode) + len(BYBIT_SIDES)
+
+
+class TestQuotesRefresher(RedisTestCase):
+
+    def make_redis(self):
+        return None
+
+    def setUp(self):
+        super().setUp()
+        self.refresh_quotes = self.enterContext(patch('bot_logic.refresh_quotes_df', new_callable=AsyncMock))
+        self.refresh_quotes.return_value = make_quotes_df(seed=0)
+        self.refresh_statistics = self.enterContext(patch('quotes_refresher.refresh_statistics'))
+        self.refresh_bybit = self.enterContext(patch('quotes_refresher.refresh_bybit_stats'))
+
+    async def test_refresh_all_marks_every_key(self):
+        refresher = QuotesRefresher(interval=1)
+        await refresher.refresh_all()
+
+        self.assertEqual(self.refresh_quotes.await_count, len(CityCode) * len(CurrencyCode))
+        self.refresh_quotes.assert_any_await('USD', 'moscow')
+        self.assertEqual(self.refresh_statistics.await_count, len(CityCode))
+        self.assertEqual(self.refresh_bybit.await_count, len(BYBIT_SIDES))
+        status = refresher.get_status()
+        self.assertEqual(len(status['last_refresh']), NUM_OF_KEYS)
+        self.assertEqual(status['failures'], {})
+
+    async def test_failures_are_counted_per_key(self):
+        async def refresh(currency, city):
+            if (currency, city) == ('EUR', 'spb'):
+                raise ConnectionError('cash.rbc.ru is down')
+            return make_quotes_df(seed=0)
+
+        self.refresh_quotes.side_effect = refresh
+        self.refresh_bybit.side_effect = [ValueError('bad answer'), None] * 2
+        refresher = QuotesRefresher(interval=1)
+        await refresher.refresh_all()
+        await refresher.refresh_all()
+
+        status = refresher.get_status()
+        self.assertEqual(status['failures'], {'spb:eur': 2, 'bybit:buy': 2})
+        self.assertNotIn('spb:eur', status['last_refresh'])
+        self.assertEqual(len(status['last_refresh']), NUM_OF_KEYS - 2)
+
+    async def test_loop_refreshes_every_interval_until_stopped(self):
+        refresher = QuotesRefresher(interval=0.05)
+        refresher.start()
+        await asyncio.sleep(0.2)
+        self.assertTrue(refresher.get_status()['running'])
+        await refresher.stop()
+
+        self.assertFalse(refresher.get_status()['running'])
+        awaited = self.refresh_bybit.await_count
+        # Refreshed on start and again after the interval
+        self.assertGreaterEqual(awaited, 2 * len(BYBIT_SIDES))
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.refresh_bybit.await_count, awaited)
+
+    async def test_shares_scrape_with_handlers(self):
+        async def slow_refresh(currency, city):
+            await asyncio.sleep(0.05)
+            return make_quotes_df(seed=0)
+
+        self.refresh_quotes.side_effect = slow_refresh
+        refresher = QuotesRefresher(interval=1)
+        from_refresher, from_handler = await asyncio.gather(
+            refresher._refresh_pair('moscow', CurrencyCode.USD),
+            bot_logic.get_quotes_df('usd', 'Moscow', return_all_banks=True))
+
+        self.refresh_quotes.assert_awaited_once()
+        self.assertIs(from_refresher, from_handler)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+import pandas as pd
+
+from models import QUOTES_COLUMNS
+from quotes_serializer import dumps_quotes, loads_quotes
+from tests.helpers import make_quotes_df
+
+
+class TestQuotesSerializer(unittest.TestCase):
+
+    def _assert_roundtrip(self, serializer):
+        # The last bank has no sell offer, so its sell_quote and spreads are NaN
+        df = make_quotes_df(missing_sells=1, seed=0)
+        restored = loads_quotes(dumps_quotes(df, serializer))
+
+        pd.testing.assert_frame_equal(restored, df.reset_index(drop=True))
+        self.assertEqual(list(restored.columns), QUOTES_COLUMNS)
+        self.assertEqual(restored.attrs['fetched_at'], df.attrs['fetched_at'])
+
+    def test_msgpack_roundtrip_is_exact(self):
+        self._assert_roundtrip('msgpack')
+
+    def test_json_roundtrip(self):
+        self._assert_roundtrip('json')
+
+    def test_empty_table(self):
+        df = make_quotes_df().iloc[0:0]
+        restored = loads_quotes(dumps_quotes(df, 'msgpack'))
+        self.assertTrue(restored.empty)
+        self.assertEqual(list(restored.columns), QUOTES_COLUMNS)
+
+
+if __name__ == '__main__':
+    unittest.main()
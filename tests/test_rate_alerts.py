@@ -0,0 +1,143 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from rate_alerts import AlertEngine, ALERT_SIDES, ALERT_DIRECTIONS, ALERTS_FIRED_KEY, ALERTS_VERSION_KEY
+from tests.helpers import RedisTestCase
+
+
+def make_subscriptions(num_of_subscriptions: int, seed: int = 0) -> list[tuple]:
+    rng = np.random.default_rng(seed)
+    columns = (rng.integers(num_of_subscriptions // 4 + 1, size=num_of_subscriptions).tolist(),
+               rng.choice(['Moscow', 'SPB'], num_of_subscriptions).tolist(),
+               rng.choice(['USD', 'EUR'], num_of_subscriptions).tolist(),
+               rng.choice(ALERT_SIDES, num_of_subscriptions).tolist(),
+               rng.choice(ALERT_DIRECTIONS, num_of_subscriptions).tolist(),
+               rng.uniform(80, 100, num_of_subscriptions).round(2).tolist())
+    return [(i, user_id, 'en', city, currency, side, direction, threshold)
+            for i, (user_id, city, currency, side, direction, threshold) in enumerate(zip(*columns))]
+
+
+def make_quotes(currency: str, buy: list[float], sell: list[float]) -> pd.DataFrame:
+    return pd.DataFrame({'currency': currency, 'bank': [f'Банк {i}' for i in range(len(buy))],
+                         'buy_quote': buy, 'sell_quote': sell})
+
+
+def expected_notifications(subscriptions: list[tuple], city: str, df: pd.DataFrame, fired: set[int]) -> set:
+    """Brute force: every subscription checked one by one"""
+    best = {}
+    for side in ALERT_SIDES:
+        best[(side, 'below')] = df[f'{side}_quote'].min()
+        best[(side, 'above')] = df[f'{side}_quote'].max()
+    crossed = {}
+    for sub_id, user_id, _, sub_city, currency, side, direction, threshold in subscriptions:
+        if sub_city.lower() != city.lower() or currency != df['currency'].iloc[0]:
+            continue
+        price = best[(side, direction)]
+        if (price < threshold) if direction == 'below' else (price > threshold):
+            if sub_id in fired:
+                continue
+            key = (user_id, side, direction)
+            distance = abs(price - threshold)
+            if key not in crossed or distance < crossed[key][1]:
+                crossed[key] = (threshold, distance)
+    return {(user_id, side, direction, threshold) for (user_id, side, direction), (threshold, _) in crossed.items()}
+
+
+class TestAlertEngine(unittest.TestCase):
+
+    def test_matches_brute_force_and_fires_once(self):
+        subscriptions = make_subscriptions(5000)
+        engine = AlertEngine()
+        engine.build(subscriptions)
+        df = make_quotes('USD', [91.5, 89.2, 95.0], [88.1, 86.0, 90.3])
+
+        notifications = engine.evaluate('Moscow', df)
+        got = {(n.user_id, n.side, n.direction, n.threshold) for n in notifications}
+        self.assertEqual(got, expected_notifications(subscriptions, 'Moscow', df, fired=set()))
+        self.assertEqual(len(got), len(notifications))
+        self.assertTrue(notifications)
+        self.assertTrue(all(n.bank == 'Банк 1' for n in notifications if n.side == 'buy' and n.direction == 'below'))
+
+        # Same quotes again: nothing new crossed
+        self.assertEqual(engine.evaluate('Moscow', df), [])
+        # Quotes went back and crossed again: alerts are re-armed
+        engine.evaluate('Moscow', make_quotes('USD', [90.0], [90.0]))
+        again = engine.evaluate('Moscow', df)
+        self.assertTrue(again)
+
+    def test_100k_subscriptions_evaluated_fast(self):
+        engine = AlertEngine()
+        engine.build(make_subscriptions(100_000, seed=1))
+        quotes = {currency: make_quotes(currency, list(np.linspace(85, 95, 60)), list(np.linspace(83, 93, 60)))
+                  for currency in ('USD', 'EUR')}
+
+        started = time.perf_counter()
+        total = 0
+        for city in ('Moscow', 'SPB'):
+            for df in quotes.values():
+                total += len(engine.evaluate(city, df))
+        elapsed = time.perf_counter() - started
+
+        self.assertGreater(total, 0)
+        self.assertLess(elapsed, 1.0)
+
+    def test_rebuild_keeps_fired_state(self):
+        subscriptions = make_subscriptions(1000)
+        engine = AlertEngine()
+        engine.build(subscriptions)
+        df = make_quotes('EUR', [81.0], [99.0])
+        self.assertTrue(engine.evaluate('SPB', df))
+
+        engine.build(subscriptions)
+        self.assertEqual(engine.evaluate('SPB', df), [])
+
+
+@patch('rate_alerts.add_alert_subscription_db', side_effect=lambda *args: 1000 + int(args[-1]))
+class TestAlertSubscriptions(RedisTestCase):
+
+    async def test_subscribe_updates_index_and_limit(self, mock_add):
+        engine = AlertEngine(max_per_user=2)
+        self.assertEqual(await engine.subscribe(7, 'ru', 'Moscow', 'usd', 'sell', 'below', 90), 1090)
+        self.assertEqual(await engine.subscribe(7, 'ru', 'Moscow', 'usd', 'sell', 'below', 88), 1088)
+        self.assertIsNone(await engine.subscribe(7, 'ru', 'Moscow', 'usd', 'sell', 'below', 87))
+        self.assertEqual(engine.subscriptions(7), [('moscow', 'USD', 'sell', 'below', 88.0),
+                                                   ('moscow', 'USD', 'sell', 'below', 90.0)])
+        self.assertEqual(self.redis.data[ALERTS_VERSION_KEY], '2')
+
+        notifications = engine.evaluate('Moscow', make_quotes('USD', [92.0], [87.5]))
+        self.assertEqual([(n.user_id, n.lang, n.threshold) for n in notifications], [(7, 'ru', 88.0)])
+
+        with patch('rate_alerts.delete_alert_subscriptions_db', return_value=True):
+            self.assertTrue(await engine.unsubscribe(7))
+        self.assertEqual(engine.subscriptions(7), [])
+        self.assertEqual(await self.redis.smembers(ALERTS_FIRED_KEY), set())
+
+    async def test_fired_state_survives_restart(self, mock_add):
+        subscriptions = make_subscriptions(1000)
+        df = make_quotes('EUR', [81.0], [99.0])
+        engine = AlertEngine()
+        with patch('rate_alerts.load_alert_subscriptions_db', return_value=subscriptions):
+            await engine.reload()
+            engine.check('SPB', df)
+            await asyncio.gather(*engine._notifications)
+            self.assertEqual(await self.redis.smembers(ALERTS_FIRED_KEY), {str(i) for i in engine.fired_ids()})
+
+            restarted = AlertEngine()
+            await restarted.reload()
+        self.assertEqual(restarted.evaluate('SPB', df), [])
+
+        # The quote went back, so the alerts are re-armed for the next crossing
+        engine.check('SPB', make_quotes('EUR', [90.0], [90.0]))
+        await asyncio.gather(*engine._notifications)
+        await restarted.sync_fired()
+        self.assertEqual(restarted.fired_ids(), engine.fired_ids())
+        self.assertTrue(restarted.evaluate('SPB', df))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import unittest
+from unittest.mock import patch, AsyncMock
+
+from bot_logic import base_url, div_container
+import rbc_parser
+from rbc_parser import parse_quotes, parse_quotes_bs4, parse_quotes_lxml, page_file_name, _read_from_file, \
+    extract_office_rows
+
+PAGE = os.path.join(os.path.dirname(__file__), 'fixtures', 'rbc', 'moscow_usd_buy.html')
+
+BROKEN_ROW_PAGE = f'''
+<html><body>
+<div class="{div_container}">
+    <div class="quote__office__one">
+        <a class="quote__office__one__name">Bank without quote</a>
+        <div class="quote__office__cell quote__office__one__time">10:00</div>
+    </div>
+    <div class="quote__office__one">
+        <a class="quote__office__one__name">Bank A</a>
+        <div class="quote__office__cell quote__office__one__rate quote__mode_list_view">92.10%</div>
+        <div class="quote__office__cell quote__office__one__time">10:05</div>
+    </div>
+</div>
+</body></html>
+'''
+
+NO_QUOTE_BANK_PAGE = f'''
+<html><body>
+<div class="{div_container}">
+    <div class="quote__office__one">
+        <a class="quote__office__one__name">Bank A</a>
+    </div>
+    <div class="quote__office__one">
+        <a class="quote__office__one__name">Bank B</a>
+        <div class="quote__office__cell quote__office__one__rate quote__mode_list_view">90.5</div>
+        <div class="quote__office__cell quote__office__one__time">10:00</div>
+    </div>
+</div>
+</body></html>
+'''
+
+
+class TestRbcParser(unittest.TestCase):
+
+    def test_engines_return_same_data(self):
+        html = _read_from_file(PAGE)
+        expected = parse_quotes_bs4(html, div_container, 'usd')
+        result = parse_quotes_lxml(html, div_container, 'usd')
+
+        self.assertEqual(result, expected)
+        self.assertEqual(len(result.banks_names), 40)
+        self.assertEqual(result.currency[0], 'USD')
+
+    def test_office_rows_stay_aligned(self):
+        result = parse_quotes_lxml(BROKEN_ROW_PAGE, div_container, 'usd')
+
+        self.assertEqual(result.banks_names, ['Bank A'])
+        self.assertEqual(result.quotes, [92.10])
+        self.assertEqual(result.commissions, [True])
+        self.assertEqual(result.times[0].strftime('%H:%M'), '10:05')
+
+    def test_bank_without_quote_cell_skipped(self):
+        self.assertEqual(extract_office_rows(NO_QUOTE_BANK_PAGE, div_container),
+                         (['Bank B'], ['90.5'], ['10:00']))
+
+    def test_missing_container(self):
+        with self.assertRaises(ValueError):
+            parse_quotes_lxml('<html><body><div>maintenance</div></body></html>', div_container, 'usd')
+
+    def test_page_file_name(self):
+        url = 'https://cash.rbc.ru/cash/?currency=3&city=2&deal=sell&amount=1'
+        self.assertEqual(page_file_name(url), 'spb_usd_sell.html')
+
+    @patch('http_client.fetch_text')
+    def test_replay_mode_reads_saved_pages(self, mock_fetch):
+        url = base_url.format(currency_code=3, city_code=1, operation_code='buy')
+        with patch('rbc_parser.RBC_REPLAY_DIR', os.path.dirname(PAGE)):
+            result = asyncio.run(parse_quotes(url, div_container, 'usd'))
+
+        mock_fetch.assert_not_called()
+        self.assertEqual(len(result.quotes), 40)
+
+    def test_unchanged_page_not_parsed_again(self):
+        url = base_url.format(currency_code=3, city_code=1, operation_code='sell')
+        html = _read_from_file(PAGE)
+        # Only the markup outside the quotes container differs
+        responses = [(html, '"v1"', None),
+                     (html.replace('</body>', '<script>banner()</script></body>'), '"v2"', None),
+                     (None, '"v2"', None)]
+        stats_before = rbc_parser.get_page_stats()
+        rbc_parser._PAGE_SNAPSHOTS.pop(url, None)
+
+        with patch('http_client.fetch_text_conditional', AsyncMock(side_effect=responses)) as mock_fetch:
+            results = [asyncio.run(parse_quotes(url, div_container, 'usd')) for _ in responses]
+
+        self.assertIs(results[1], results[0])
+        self.assertIs(results[2], results[0])
+        self.assertEqual(mock_fetch.call_args.args, (url, '"v2"', None))
+        stats = rbc_parser.get_page_stats()
+        self.assertEqual({key: stats[key] - stats_before[key] for key in stats},
+                         {'fetched': 3, 'not_modified': 1, 'unchanged': 1, 'parsed': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
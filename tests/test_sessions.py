@@ -0,0 +1,39 @@
+import unittest
+
+import redis_client
+from sessions import SessionStore
+from tests.helpers import RedisTestCase
+
+
+class TestSessionStore(RedisTestCase):
+
+    async def test_choice_on_one_worker_is_seen_by_another(self):
+        worker_a, worker_b = SessionStore(local_ttl=0), SessionStore(local_ttl=0)
+        await worker_a.update(1, user_lang='en')
+        await worker_a.update(1, city='Moscow')
+
+        self.assertEqual(await worker_b.get(1), {'user_lang': 'en', 'city': 'Moscow'})
+        await worker_b.update(1, city='SPB')
+        self.assertEqual((await worker_a.get(1))['city'], 'SPB')
+
+    async def test_local_copy_is_bounded(self):
+        sessions = SessionStore(local_max_items=10)
+        for user_id in range(100):
+            await sessions.update(user_id, city='Moscow')
+            await sessions.get(user_id)
+
+        self.assertEqual(len(sessions), 10)
+        self.assertEqual(await sessions.get(0), {'city': 'Moscow'})
+
+    async def test_works_without_redis(self):
+        redis_client.REDIS_AVAILABLE = False
+        sessions = SessionStore()
+        await sessions.update(1, cash_or_crypto='cash')
+        await sessions.update(1, city='SPB')
+
+        self.assertEqual(await sessions.get(1), {'cash_or_crypto': 'cash', 'city': 'SPB'})
+        self.assertEqual(await sessions.get(2), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import asyncio
+import unittest
+from unittest.mock import patch, MagicMock, AsyncMock
+
+from singleflight import SingleFlight
+from tests.helpers import RedisTestCase, use_redis
+
+
+class TestSingleFlight(RedisTestCase):
+
+    def make_redis(self):
+        return None
+
+    async def test_concurrent_misses_are_coalesced(self):
+        flight = SingleFlight()
+        calls = 0
+
+        async def refresh():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return 'quotes'
+
+        results = await asyncio.gather(*[flight.do('moscow:usd', refresh) for _ in range(50)])
+
+        self.assertEqual(results, ['quotes'] * 50)
+        self.assertEqual(calls, 1)
+        self.assertEqual(flight.get_stats()['coalesced'], 49)
+        self.assertEqual(flight.get_stats()['refreshes'], 1)
+
+    async def test_error_is_shared_and_key_released(self):
+        flight = SingleFlight()
+
+        async def failing_refresh():
+            await asyncio.sleep(0.01)
+            raise ValueError('upstream is down')
+
+        results = await asyncio.gather(*[flight.do('moscow:usd', failing_refresh) for _ in range(3)],
+                                       return_exceptions=True)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+
+        async def refresh():
+            return 'quotes'
+
+        self.assertEqual(await flight.do('moscow:usd', refresh), 'quotes')
+
+    @patch('singleflight.REFRESH_POLL_INTERVAL', 0.01)
+    async def test_waits_for_other_process(self):
+        mock_redis = self.enterContext(use_redis(AsyncMock()))
+        flight = SingleFlight()
+        # Lock is held by another process which stores the value after a few polls
+        mock_redis.set.return_value = None
+        mock_redis.exists.return_value = 1
+        read_cached = AsyncMock(side_effect=[None, None, 'quotes'])
+        refresh = MagicMock()
+
+        result = await flight.do('moscow:usd', refresh, read_cached)
+
+        self.assertEqual(result, 'quotes')
+        refresh.assert_not_called()
+        self.assertEqual(flight.get_stats()['remote_hits'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+from unittest.mock import patch, MagicMock
+
+from usage_counters import UsageCounters, USAGE_FIELDS
+
+
+def make_user(user_id):
+    user = MagicMock()
+    user.id = user_id
+    return user
+
+
+@patch('usage_counters.increment_fields_batch_db', return_value=True)
+class TestUsageCounters(unittest.TestCase):
+
+    def test_many_requests_one_statement(self, mock_batch):
+        counters = UsageCounters(batch_size=100)
+        for _ in range(500):
+            counters.increment(make_user(1), 'filled_requests_currencies')
+        for _ in range(3):
+            counters.increment(make_user(2), 'filled_requests_stats')
+
+        self.assertEqual(counters.flush(), 2)
+        mock_batch.assert_called_once_with(USAGE_FIELDS, [(1, 500, 0), (2, 0, 3)], page_size=100)
+        self.assertEqual(counters.flush(), 0)
+        mock_batch.assert_called_once()
+
+    def test_rows_split_by_batch_size(self, mock_batch):
+        counters = UsageCounters(batch_size=2)
+        for user_id in range(5):
+            counters.increment(make_user(user_id), 'filled_requests_stats')
+
+        self.assertEqual(counters.flush(), 5)
+        self.assertEqual([len(call.args[1]) for call in mock_batch.call_args_list], [2, 2, 1])
+
+    def test_failed_flush_keeps_counts(self, mock_batch):
+        counters = UsageCounters()
+        counters.increment(make_user(1), 'filled_requests_currencies')
+        mock_batch.return_value = False
+        self.assertEqual(counters.flush(), 0)
+
+        counters.increment(make_user(1), 'filled_requests_currencies')
+        mock_batch.return_value = True
+        counters.flush()
+        mock_batch.assert_called_with(USAGE_FIELDS, [(1, 2, 0)], page_size=counters.batch_size)
+
+    def test_stop_flushes_remaining(self, mock_batch):
+        counters = UsageCounters(interval=3600)
+
+        async def run():
+            counters.start()
+            counters.increment(make_user(7), 'filled_requests_stats')
+            await counters.stop()
+
+        asyncio.run(run())
+        mock_batch.assert_called_once_with(USAGE_FIELDS, [(7, 0, 1)], page_size=counters.batch_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from unittest.mock import patch, MagicMock, AsyncMock
+
+from user_registry import UserRegistry, KNOWN_USERS_REDIS_KEY
+from tests.helpers import RedisTestCase
+
+
+def make_user(user_id):
+    user = MagicMock()
+    user.id = user_id
+    return user
+
+
+@patch('user_registry.save_new_users_batch_db', return_value=True)
+class TestUserRegistry(RedisTestCase):
+
+    def make_redis(self):
+        redis = AsyncMock()
+        redis.sismember.return_value = False
+        return redis
+
+    @patch('user_registry.load_user_ids_db', return_value={1, 2})
+    async def test_known_users_skip_database(self, mock_load, mock_save):
+        registry = UserRegistry()
+        await registry.warm()
+        self.redis.sadd.assert_called_once()
+
+        for _ in range(100):
+            self.assertFalse(await registry.register(make_user(1)))
+        self.assertEqual(await registry.flush(), 0)
+        mock_save.assert_not_called()
+        self.redis.sismember.assert_not_called()
+
+    async def test_user_known_by_other_worker(self, mock_save):
+        self.redis.sismember.return_value = True
+        registry = UserRegistry()
+
+        self.assertFalse(await registry.register(make_user(5)))
+        self.assertFalse(await registry.register(make_user(5)))
+        self.redis.sismember.assert_called_once_with(KNOWN_USERS_REDIS_KEY, 5)
+        mock_save.assert_not_called()
+
+    async def test_burst_of_new_users_inserted_in_batches(self, mock_save):
+        registry = UserRegistry(batch_size=1000)
+        for user_id in range(2500):
+            await registry.register(make_user(user_id))
+            await registry.register(make_user(user_id))
+
+        self.assertEqual(await registry.flush(), 2500)
+        self.assertEqual([len(call.args[0]) for call in mock_save.call_args_list], [1000, 1000, 500])
+        self.assertEqual(self.redis.sadd.call_count, 3)
+
+    async def test_failed_insert_is_retried(self, mock_save):
+        registry = UserRegistry()
+        await registry.register(make_user(1))
+        mock_save.return_value = False
+        self.assertEqual(await registry.flush(), 0)
+
+        mock_save.return_value = True
+        self.assertEqual(await registry.flush(), 1)
+        self.assertEqual(mock_save.call_args.args[0][0].id, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import defaultdict
+
+from dotenv import load_dotenv
+
+from db_manager import increment_fields_batch_db
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# How often buffered counters are written to the users table
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", 60))
+# Max number of users updated by one statement
+USAGE_FLUSH_BATCH_SIZE = int(os.getenv("USAGE_FLUSH_BATCH_SIZE", 1000))
+
+USAGE_FIELDS = ('filled_requests_currencies', 'filled_requests_stats')
+
+
+class UsageCounters:
+    """Write-behind buffer for the users table request counters.
+
+    Handlers only bump an in-process counter; a background task adds the
+    accumulated deltas with one batched UPDATE per flush, so DB writes grow
+    with flush intervals instead of with requests."""
+
+    def __init__(self, interval: float = USAGE_FLUSH_INTERVAL,
+                 batch_size: int = USAGE_FLUSH_BATCH_SIZE) -> None:
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending: dict[int, dict[str, int]] = defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0))
+        self._lock = threading.Lock()
+        self._task: asyncio.Task | None = None
+        self.stats = {'increments': 0, 'flushes': 0, 'flushed_rows': 0, 'failed_flushes': 0}
+
+    def increment(self, user, field_name: str) -> None:
+        if field_name not in USAGE_FIELDS:
+            raise ValueError(f"Unknown usage counter {field_name}")
+        with self._lock:
+            self._pending[user.id][field_name] += 1
+            self.stats['increments'] += 1
+
+    def _take_pending(self) -> dict[int, dict[str, int]]:
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: dict.fromkeys(USAGE_FIELDS, 0))
+        return pending
+
+    def _restore(self, pending: dict[int, dict[str, int]]) -> None:
+        # Failed deltas go back to the buffer and are retried on the next flush
+        with self._lock:
+            for user_id, counters in pending.items():
+                for field_name, delta in counters.items():
+                    self._pending[user_id][field_name] += delta
+
+    def flush(self) -> int:
+        """Write buffered deltas to the DB, returns the number of users updated"""
+        pending = self._take_pending()
+        if not pending:
+            return 0
+
+        rows = [(user_id, *[counters[field] for field in USAGE_FIELDS])
+                for user_id, counters in pending.items()]
+        flushed = 0
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            if not increment_fields_batch_db(USAGE_FIELDS, batch, page_size=self.batch_size):
+                self.stats['failed_flushes'] += 1
+                self._restore({row[0]: pending[row[0]] for row in rows[start:]})
+                break
+            flushed += len(batch)
+
+        self.stats['flushes'] += 1
+        self.stats['flushed_rows'] += flushed
+        return flushed
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error("Couldn`t flush usage counters: %s", e)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+            logger.info("Usage counters flusher started, interval %s s", self.interval)
+
+    async def stop(self) -> None:
+        """Stop the flusher and write out what is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        flushed = await asyncio.to_thread(self.flush)
+        logger.info("Usage counters flushed on shutdown: %s users, stats: %s", flushed, self.stats)
+
+
+# Shared buffer started from main
+USAGE_COUNTERS = UsageCounters()
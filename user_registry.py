@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import threading
+
+from dotenv import load_dotenv
+
+import redis_client
+from db_manager import save_new_users_batch_db, load_user_ids_db
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# How often queued new users are inserted, in one statement per batch
+USER_REGISTRY_FLUSH_INTERVAL = float(os.getenv("USER_REGISTRY_FLUSH_INTERVAL", 1))
+USER_REGISTRY_BATCH_SIZE = int(os.getenv("USER_REGISTRY_BATCH_SIZE", 1000))
+
+# Redis set with the IDs of registered users, shared by all workers
+KNOWN_USERS_REDIS_KEY = "users:known"
+
+
+class UserRegistry:
+    """Keeps /start off the database for users who are already registered.
+
+    Known IDs live in a local set, warmed from the users table at startup
+    and backed by a Redis set other workers write to. New users are queued
+    and inserted in batches, so a burst of /starts costs one INSERT."""
+
+    def __init__(self, interval: float = USER_REGISTRY_FLUSH_INTERVAL,
+                 batch_size: int = USER_REGISTRY_BATCH_SIZE) -> None:
+        self.interval = interval
+        self.batch_size = batch_size
+        self._known: set[int] = set()
+        self._queued: dict[int, object] = {}
+        self._lock = threading.Lock()
+        self._task: asyncio.Task | None = None
+        self.stats = {'known_hits': 0, 'redis_hits': 0, 'queued': 0, 'inserted': 0, 'failed_flushes': 0}
+
+    async def warm(self) -> None:
+        """Load registered IDs from the DB and share them via Redis"""
+        user_ids = await asyncio.to_thread(load_user_ids_db)
+        with self._lock:
+            self._known.update(user_ids)
+        if user_ids and redis_client.REDIS_AVAILABLE:
+            try:
+                ids = list(user_ids)
+                for start in range(0, len(ids), self.batch_size):
+                    await redis_client.REDIS_CLIENT.sadd(KNOWN_USERS_REDIS_KEY, *ids[start:start + self.batch_size])
+            except Exception as e:
+                logger.error("Couldn`t share known users in Redis: %s", e)
+        logger.info("Known users set warmed: %s users", len(user_ids))
+
+    async def _is_known_in_redis(self, user_id: int) -> bool:
+        if not redis_client.REDIS_AVAILABLE:
+            return False
+        try:
+            return bool(await redis_client.REDIS_CLIENT.sismember(KNOWN_USERS_REDIS_KEY, user_id))
+        except Exception as e:
+            logger.error("Couldn`t check known users in Redis: %s", e)
+            return False
+
+    async def register(self, user) -> bool:
+        """Queue the user for insertion unless already known, returns True if queued"""
+        with self._lock:
+            if user.id in self._known:
+                self.stats['known_hits'] += 1
+                return False
+
+        if await self._is_known_in_redis(user.id):
+            with self._lock:
+                self._known.add(user.id)
+                self.stats['redis_hits'] += 1
+            return False
+
+        with self._lock:
+            # Known right away, so repeated /starts before the flush are not queued twice
+            self._known.add(user.id)
+            self._queued[user.id] = user
+            self.stats['queued'] += 1
+        return True
+
+    async def flush(self) -> int:
+        """Insert queued users, returns how many were written"""
+        with self._lock:
+            queued, self._queued = list(self._queued.values()), {}
+        if not queued:
+            return 0
+
+        inserted = 0
+        for start in range(0, len(queued), self.batch_size):
+            batch = queued[start:start + self.batch_size]
+            if not await asyncio.to_thread(save_new_users_batch_db, batch, self.batch_size):
+                self.stats['failed_flushes'] += 1
+                with self._lock:
+                    for user in queued[start:]:
+                        self._queued.setdefault(user.id, user)
+                break
+            inserted += len(batch)
+            if redis_client.REDIS_AVAILABLE:
+                try:
+                    await redis_client.REDIS_CLIENT.sadd(KNOWN_USERS_REDIS_KEY, *[user.id for user in batch])
+                except Exception as e:
+                    logger.error("Couldn`t share known users in Redis: %s", e)
+
+        self.stats['inserted'] += inserted
+        return inserted
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Couldn`t register queued users: %s", e)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+            logger.info("User registry flusher started, interval %s s", self.interval)
+
+    async def stop(self) -> None:
+        """Stop the flusher and insert users still in the queue"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        inserted = await self.flush()
+        logger.info("Queued users registered on shutdown: %s, stats: %s", inserted, self.stats)
+
+
+# Shared registry warmed and started from main
+USER_REGISTRY = UserRegistry()